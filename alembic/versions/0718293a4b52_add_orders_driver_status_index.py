@@ -0,0 +1,24 @@
+"""add_orders_driver_status_index
+
+Revision ID: 0718293a4b52
+Revises: f60718293a41
+Create Date: 2026-10-18 00:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0718293a4b52'
+down_revision = 'f60718293a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_orders_driver_id_status', 'orders', ['driver_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_driver_id_status', table_name='orders')
@@ -0,0 +1,28 @@
+"""add_photo_control_indexes
+
+Revision ID: 18293a4b5c63
+Revises: 0718293a4b52
+Create Date: 2026-10-18 01:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '18293a4b5c63'
+down_revision = '0718293a4b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_cars_driver_id'), 'cars', ['driver_id'], unique=False)
+    op.create_index(op.f('ix_driver_documents_driver_id'), 'driver_documents', ['driver_id'], unique=False)
+    op.create_index('ix_driver_verifications_driver_id_type', 'driver_verifications', ['driver_id', 'verification_type'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_driver_verifications_driver_id_type', table_name='driver_verifications')
+    op.drop_index(op.f('ix_driver_documents_driver_id'), table_name='driver_documents')
+    op.drop_index(op.f('ix_cars_driver_id'), table_name='cars')
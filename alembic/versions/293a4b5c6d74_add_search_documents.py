@@ -0,0 +1,63 @@
+"""add_search_documents
+
+Revision ID: 293a4b5c6d74
+Revises: 18293a4b5c63
+Create Date: 2026-10-18 02:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '293a4b5c6d74'
+down_revision = '18293a4b5c63'
+branch_labels = None
+depends_on = None
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents_fts USING fts5("
+    "content, content='search_documents', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO search_documents_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_table(
+        'search_documents',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('entity', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('entity', 'entity_id', name='uq_search_documents_entity')
+    )
+    if dialect == 'postgresql':
+        op.create_index(
+            'ix_search_documents_content_trgm', 'search_documents', ['content'], unique=False,
+            postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'}
+        )
+    elif dialect == 'sqlite':
+        for statement in SQLITE_FTS:
+            op.execute(statement)
+    # Документы заполняются при первом запуске приложения или python rebuild_search_index.py
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_search_documents_content_trgm', table_name='search_documents')
+    elif dialect == 'sqlite':
+        for trigger in ('search_documents_ai', 'search_documents_ad', 'search_documents_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS search_documents_fts")
+    op.drop_table('search_documents')
@@ -0,0 +1,72 @@
+"""add_hot_query_indexes
+
+Revision ID: 3a4b5c6d7e85
+Revises: 293a4b5c6d74
+Create Date: 2026-10-18 03:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a4b5c6d7e85'
+down_revision = '293a4b5c6d74'
+branch_labels = None
+depends_on = None
+
+
+# Индексы горячих запросов: (имя, таблица, колонки, условие частичного индекса).
+# Проверка планов - check_query_plans.py
+HOT_INDEXES = [
+    ('ix_orders_driver_id_created_at', 'orders', ['driver_id', 'created_at'], None),
+    ('ix_orders_unassigned_status_created_at', 'orders', ['status', sa.text('created_at DESC')], sa.column('driver_id').is_(None)),
+    ('ix_balance_transactions_driver_id_created_at', 'balance_transactions', ['driver_id', 'created_at'], None),
+    ('ix_driver_verifications_driver_id_type_created_at', 'driver_verifications',
+     ['driver_id', 'verification_type', sa.text('created_at DESC')], None),
+    ('ix_messages_recipient_id_created_at', 'messages', ['recipient_id', 'created_at'], None),
+    ('ix_messages_is_broadcast_created_at', 'messages', ['is_broadcast', 'created_at'], None),
+    ('ix_driver_users_driver_id', 'driver_users', ['driver_id'], None),
+    ('ix_drivers_status', 'drivers', ['status'], None),
+]
+
+
+def _is_postgresql() -> bool:
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def upgrade() -> None:
+    if not _is_postgresql():
+        for name, table, columns, where in HOT_INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            sqlite_where=where)
+        op.drop_index('ix_driver_verifications_driver_id_type', table_name='driver_verifications', if_exists=True)
+        return
+
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицы, но не работает внутри
+    # транзакции. Прерванная сборка оставляет невалидный индекс - его нужно удалить
+    # вручную (DROP INDEX CONCURRENTLY) и повторить миграцию
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in HOT_INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=True,
+                            postgresql_where=where)
+        # Заменён индексом (driver_id, verification_type, created_at DESC) с тем же префиксом
+        op.drop_index('ix_driver_verifications_driver_id_type', table_name='driver_verifications',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    if not _is_postgresql():
+        op.create_index('ix_driver_verifications_driver_id_type', 'driver_verifications',
+                        ['driver_id', 'verification_type'], unique=False, if_not_exists=True)
+        for name, table, _, _ in reversed(HOT_INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
+        return
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_driver_verifications_driver_id_type', 'driver_verifications',
+                        ['driver_id', 'verification_type'], unique=False, if_not_exists=True,
+                        postgresql_concurrently=True)
+        for name, table, _, _ in reversed(HOT_INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
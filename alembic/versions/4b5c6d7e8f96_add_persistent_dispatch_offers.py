@@ -0,0 +1,44 @@
+"""add_persistent_dispatch_offers
+
+Revision ID: 4b5c6d7e8f96
+Revises: 3a4b5c6d7e85
+Create Date: 2026-10-18 04:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b5c6d7e8f96'
+down_revision = '3a4b5c6d7e85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Предложение диспетчера хранится в заказе, чтобы его видели все воркеры
+    op.add_column('orders', sa.Column('offer_expires_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_orders_offer_expires_at', 'orders', ['offer_expires_at'], unique=False,
+        postgresql_where=sa.column('offer_expires_at').isnot(None),
+        sqlite_where=sa.column('offer_expires_at').isnot(None)
+    )
+    op.create_table(
+        'order_offer_declines',
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('driver_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['driver_id'], ['drivers.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('order_id', 'driver_id')
+    )
+    # Такт диспетчера подгружает водителей, приславших позицию за DRIVER_LOCATION_TTL
+    op.create_index(op.f('ix_drivers_last_location_update'), 'drivers', ['last_location_update'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_drivers_last_location_update'), table_name='drivers')
+    op.drop_table('order_offer_declines')
+    op.drop_index('ix_orders_offer_expires_at', table_name='orders')
+    op.drop_column('orders', 'offer_expires_at')
@@ -0,0 +1,31 @@
+"""add_api_quota_usage
+
+Revision ID: 5c6d7e8f9a07
+Revises: 4b5c6d7e8f96
+Create Date: 2026-10-18 05:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c6d7e8f9a07'
+down_revision = '4b5c6d7e8f96'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Общий бюджет запросов матрицы 2GIS для ETA диспетчера (все воркеры и реплики)
+    op.create_table(
+        'api_quota_usage',
+        sa.Column('scope', sa.String(length=50), nullable=False),
+        sa.Column('window_start', sa.DateTime(), nullable=False),
+        sa.Column('used', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('scope', 'window_start')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('api_quota_usage')
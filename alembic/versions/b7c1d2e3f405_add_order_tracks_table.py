@@ -0,0 +1,41 @@
+"""add_order_tracks_table
+
+Revision ID: b7c1d2e3f405
+Revises: e50a84499425
+Create Date: 2026-10-17 16:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c1d2e3f405'
+down_revision = 'e50a84499425'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'order_tracks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('driver_id', sa.Integer(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('ended_at', sa.DateTime(), nullable=False),
+        sa.Column('point_count', sa.Integer(), nullable=True),
+        sa.Column('distance_km', sa.Float(), nullable=True),
+        sa.Column('points', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+        sa.ForeignKeyConstraint(['driver_id'], ['drivers.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_tracks_id'), 'order_tracks', ['id'], unique=False)
+    op.create_index(op.f('ix_order_tracks_order_id'), 'order_tracks', ['order_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_order_tracks_order_id'), table_name='order_tracks')
+    op.drop_index(op.f('ix_order_tracks_id'), table_name='order_tracks')
+    op.drop_table('order_tracks')
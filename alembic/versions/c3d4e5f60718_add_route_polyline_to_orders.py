@@ -0,0 +1,24 @@
+"""add_route_polyline_to_orders
+
+Revision ID: c3d4e5f60718
+Revises: b7c1d2e3f405
+Create Date: 2026-10-17 18:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d4e5f60718'
+down_revision = 'b7c1d2e3f405'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('route_polyline', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'route_polyline')
@@ -0,0 +1,36 @@
+"""add_geo_cache_table
+
+Revision ID: d4e5f6071829
+Revises: c3d4e5f60718
+Create Date: 2026-10-17 20:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e5f6071829'
+down_revision = 'c3d4e5f60718'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'geo_cache',
+        sa.Column('key', sa.String(length=512), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('value', sa.Text(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_geo_cache_kind'), 'geo_cache', ['kind'], unique=False)
+    op.create_index(op.f('ix_geo_cache_expires_at'), 'geo_cache', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_geo_cache_expires_at'), table_name='geo_cache')
+    op.drop_index(op.f('ix_geo_cache_kind'), table_name='geo_cache')
+    op.drop_table('geo_cache')
@@ -0,0 +1,24 @@
+"""add_orders_created_at_index
+
+Revision ID: e5f607182930
+Revises: d4e5f6071829
+Create Date: 2026-10-17 22:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f607182930'
+down_revision = 'd4e5f6071829'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_orders_created_at'), 'orders', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_orders_created_at'), table_name='orders')
@@ -0,0 +1,46 @@
+"""add_analytics_daily_rollups
+
+Revision ID: f60718293a41
+Revises: e5f607182930
+Create Date: 2026-10-17 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f60718293a41'
+down_revision = 'e5f607182930'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'order_daily_stats',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('tariff', sa.String(length=50), nullable=False),
+        sa.Column('taxi_park', sa.String(length=100), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('orders_count', sa.Integer(), nullable=False),
+        sa.Column('earnings', sa.Float(), nullable=False),
+        sa.Column('commission', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'tariff', 'taxi_park', 'status')
+    )
+    op.create_table(
+        'balance_daily_stats',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('type', sa.String(length=20), nullable=False),
+        sa.Column('transactions_count', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'type')
+    )
+    # Пересчёт дня транзакций баланса идёт по диапазону created_at
+    op.create_index(op.f('ix_balance_transactions_created_at'), 'balance_transactions', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_balance_transactions_created_at'), table_name='balance_transactions')
+    op.drop_table('balance_daily_stats')
+    op.drop_table('order_daily_stats')
@@ -4,6 +4,7 @@ from pydantic import BaseModel
 import logging
 
 from app.services.twogis_service import twogis_service
+from app.services.eta_service import eta_service
 
 logger = logging.getLogger(__name__)
 
@@ -149,5 +150,7 @@ async def health_check():
         "success": True,
         "api_key_configured": bool(twogis_service.api_key),
         "secret_key_configured": bool(twogis_service.secret_key),
-        "status": "ready" if twogis_service.api_key else "no_api_key"
+        "status": "ready" if twogis_service.api_key else "no_api_key",
+        "cache": twogis_service.cache_stats(),
+        "eta": eta_service.stats()
     } 
\ No newline at end of file
@@ -33,6 +33,109 @@ class Settings:
     # Cache settings
     GEOCODING_CACHE_TTL = 3600  # 1 hour in seconds
     ROUTING_CACHE_TTL = 1800    # 30 minutes in seconds
+    GEOCODING_CACHE_SIZE = 5000          # записей адрес -> точка на воркер
+    REVERSE_GEOCODING_CACHE_SIZE = 5000  # геоячеек с адресами (обратное геокодирование)
+    ROUTING_CACHE_SIZE = 2000            # маршрутов (с геометрией, самые тяжёлые)
+    REVERSE_GEOCODE_CELL_PRECISION = 8   # geohash ~19 x 29 м на широте Оша
+    REVERSE_GEOCODE_MATCH_RADIUS_M = 19  # разрешённая точка запроса дальше - промах; не больше,
+                                         # чем покрывают ячейка и 8 соседних (~19 м при точности 8)
+    REVERSE_GEOCODE_CELL_ENTRIES = 4     # адресов в одной ячейке
+
+    # Общий кэш 2GIS в БД (таблица geo_cache) - второй уровень для всех реплик
+    GEO_CACHE_ENABLED = os.getenv("GEO_CACHE_ENABLED", "true").lower() == "true"
+    GEO_CACHE_GEOCODING_TTL = 30 * 24 * 3600  # адреса почти не меняются - 30 дней
+    GEO_CACHE_ROUTING_TTL = 6 * 3600          # маршруты учитывают пробки - 6 часов
+    GEO_CACHE_WARMUP_LIMIT = 2000             # свежих записей загружается в память при старте
+
+    # Автодополнение адресов по истории заказов (до запроса в 2GIS)
+    ADDRESS_INDEX_ENABLED = os.getenv("ADDRESS_INDEX_ENABLED", "true").lower() == "true"
+    ADDRESS_INDEX_HISTORY_LIMIT = 200000      # последних заказов при построении индекса
+    ADDRESS_INDEX_MIN_PREFIX = 3              # минимальная длина слова запроса для поиска по истории
+    ADDRESS_INDEX_MIN_RESULTS = 3             # столько адресов из истории достаточно, 2GIS не вызывается
+    ADDRESS_INDEX_HALF_LIFE_DAYS = 30         # вес заказа уменьшается вдвое за столько дней
+    ADDRESS_INDEX_TOP_K = 32                  # адресов в готовом топе каждого префикса
+
+    # HTTP-клиент 2GIS (общая aiohttp-сессия на воркер)
+    TWOGIS_CONNECT_TIMEOUT = float(os.getenv("TWOGIS_CONNECT_TIMEOUT", "3"))  # сек на установку соединения
+    TWOGIS_READ_TIMEOUT = float(os.getenv("TWOGIS_READ_TIMEOUT", "10"))       # сек ожидания данных ответа
+    TWOGIS_POOL_PER_HOST = 20          # соединений на хост 2GIS
+    TWOGIS_KEEPALIVE_TIMEOUT = 60      # сек жизни простаивающего keep-alive соединения
+    TWOGIS_DNS_CACHE_TTL = 300         # сек кэша DNS
+
+    # Driver spatial index / order offers
+    DRIVER_INDEX_CELL_DEG = 0.01      # размер ячейки сетки (~1.1 км по широте)
+    DRIVER_LOCATION_TTL = 120         # водитель без обновлений позиции дольше (сек) считается оффлайн
+    ORDER_OFFER_RADIUS_KM = 5.0       # радиус поиска водителей вокруг точки подачи
+    ORDER_OFFER_CANDIDATES = 3        # сколько ближайших водителей получают предложение заказа
+
+    # Dispatch engine (пакетное распределение заказов)
+    DISPATCH_ENABLED = os.getenv("DISPATCH_ENABLED", "true").lower() == "true"
+    DISPATCH_TICK_MS = int(os.getenv("DISPATCH_TICK_MS", "500"))  # период такта диспетчера
+    DISPATCH_CANDIDATES_PER_ORDER = 8  # ближайших водителей-кандидатов на заказ
+    DISPATCH_MAX_ORDERS = 5000         # максимум ожидающих заказов за один такт
+    DISPATCH_OFFER_TTL = 20            # сколько секунд предложение ждёт ответа водителя
+    DISPATCH_ACTIVITY_WEIGHT = 0.3     # до 30% скидки к стоимости для водителей с активностью 100
+    DISPATCH_USE_ETA = os.getenv("DISPATCH_USE_ETA", "true").lower() == "true"  # стоимость по ETA вместо км
+    # Ключ pg_advisory_lock: такты ведёт один воркер на все реплики и процессы
+    DISPATCH_LEADER_LOCK_KEY = int(os.getenv("DISPATCH_LEADER_LOCK_KEY", "72410001"))
+
+    # ETA подачи (матрица 2GIS для кандидатов одного заказа)
+    ETA_USE_MATRIX = os.getenv("ETA_USE_MATRIX", "true").lower() == "true"
+    ETA_CELL_PRECISION = 7             # geohash ~150 м: соседние водители делят ETA из кэша
+    ETA_TIME_BUCKET_SECONDS = 300      # интервал времени в ключе кэша (пробки меняются)
+    ETA_CACHE_SIZE = 20000             # пар ячеек в кэше воркера
+    ETA_MAX_MATRIX_CALLS = 3           # запросов матрицы за один такт, остальные заказы - кэш/оценка
+    # Собственный бюджет матриц ETA внутри дневного лимита ключа 2GIS (MAX_ROUTING_REQUESTS),
+    # общий для всех воркеров и реплик (таблица api_quota_usage): остальное - маршрутам и геокодированию
+    ETA_MATRIX_BUDGET_PER_MINUTE = int(os.getenv("ETA_MATRIX_BUDGET_PER_MINUTE", "2"))
+    ETA_MATRIX_BUDGET_PER_DAY = int(os.getenv("ETA_MATRIX_BUDGET_PER_DAY", "200"))
+    ETA_TICK_TIMEOUT = 2.0             # сек ожидания матриц тактом диспетчера
+    ETA_UPSTREAM_BACKOFF = 60          # сек без запросов к 2GIS после ошибки
+    ETA_DETOUR_FACTOR = 1.4            # отношение пути по дорогам к прямой (оценка без 2GIS)
+    ETA_FALLBACK_SPEED_KMH = 25        # средняя скорость по городу для оценки
+
+    # WebSocket водителей (/ws/driver/{driver_id})
+    DRIVER_WS_MAX_CONNECTIONS = int(os.getenv("DRIVER_WS_MAX_CONNECTIONS", "2000"))  # лимит соединений на воркер
+    DRIVER_WS_PING_INTERVAL = 20       # сек без сообщений от клиента до отправки ping
+    DRIVER_WS_TIMEOUT = 60             # сек без сообщений от клиента до закрытия соединения
+    DRIVER_WS_SEND_TIMEOUT = 5         # сек на отправку одного события медленному клиенту
+    # События водителям с других воркеров и реплик: PostgreSQL LISTEN/NOTIFY (cluster_bus)
+    CLUSTER_BUS_CHANNEL = os.getenv("CLUSTER_BUS_CHANNEL", "wazir_driver_events")
+    CLUSTER_BUS_PING_INTERVAL = 10     # сек между проверками слушающего соединения
+    CLUSTER_BUS_RECONNECT_DELAY = 3    # сек до переподключения после обрыва
+
+    # SSE-поток заказа для пассажира (/api/orders/{order_id}/events)
+    ORDER_EVENTS_BUFFER = 100          # событий на заказ для догона по Last-Event-ID
+    ORDER_EVENTS_KEEPALIVE = 15        # сек между keepalive-комментариями
+    ORDER_EVENTS_RECONCILE = 15        # сек между сверками с БД (изменения с других воркеров)
+    ORDER_EVENTS_IDLE_TTL = 300        # сек хранения потока заказа без подписчиков
+
+    # Позиции водителей: в памяти, в БД - пакетом
+    LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", "3"))  # сек между пакетными UPDATE
+
+    # GPS-треки поездок (order_tracks)
+    TRACK_MIN_STEP_M = 15              # точки ближе к предыдущей (м) не сохраняются
+    TRACK_MAX_SPEED_KMH = 200          # скачки быстрее считаются ошибкой GPS
+    TRACK_MAX_POINTS = 1500            # максимум точек на поездку (~8 КБ)
+    TRACK_CHUNK_POINTS = 120           # точек в одном фрагменте
+    TRACK_CHUNK_SECONDS = 60           # максимальный возраст незаписанного фрагмента
+    TRACK_IDLE_TTL = 3600              # трек без точек дольше (сек) забывается
+
+    # Прогресс поездки по маршруту 2GIS (orders.route_polyline)
+    ROUTE_SIMPLIFY_TOLERANCE_M = 10    # допуск упрощения линии маршрута (Дуглас-Пекер)
+    ROUTE_SEARCH_BACK_KM = 0.5         # окно поиска сегмента назад от прошлой позиции
+    ROUTE_SEARCH_AHEAD_KM = 3.0        # и вперёд (покрывает интервал между пингами)
+    ROUTE_OFF_ROUTE_M = 150            # дальше от маршрута - поиск по всей линии
+    ROUTE_CACHE_SIZE = 1000            # декодированных маршрутов в памяти воркера
+
+    # Дневные сводки для графиков аналитики (order_daily_stats, balance_daily_stats)
+    ORDER_COMMISSION_RATE = 0.10       # комиссия сервиса с заказа (списывается при принятии)
+    ANALYTICS_ROLLUP_INTERVAL = 5      # сек между пересчётами изменённых дней
+    ANALYTICS_ROLLUP_RECONCILE = 600   # сек между контрольными пересчётами последних дней
+    ANALYTICS_ROLLUP_RECENT_DAYS = 2   # последних дней в контрольном пересчёте
+    ANALYTICS_BACKFILL_CHUNK_DAYS = 31 # дней в одной транзакции заполнения истории
+    # Ключ pg_advisory_lock: пересчёты сводок всех воркеров идут по одному
+    ANALYTICS_ROLLUP_LOCK_KEY = int(os.getenv("ANALYTICS_ROLLUP_LOCK_KEY", "72410002"))
 
 settings = Settings()
 
@@ -1,10 +1,14 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, exists, false, func, or_
+from sqlalchemy.orm import Session, contains_eager, undefer
 import random
 import string
 from . import models, schemas
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import HTTPException
+from .services.address_index import address_index
+from .services.search import search_index, ENTITY_DRIVER, ENTITY_ORDER
+from .services.keyset import KeysetPage, paginate
 
 # Utility functions
 def generate_unique_id():
@@ -41,6 +45,9 @@ def create_order(db: Session, order: schemas.OrderCreate):
         
         print(f"✅ ЗАКАЗ СОЗДАН: ID={db_order.id}, origin_lat={db_order.origin_lat}, origin_lng={db_order.origin_lng}")
         print(f"✅ КООРДИНАТЫ: destination_lat={db_order.destination_lat}, destination_lng={db_order.destination_lng}")
+
+        # Адреса нового заказа сразу доступны автодополнению
+        address_index.add_order(db_order)
         
         return db_order
         
@@ -62,6 +69,12 @@ def get_driver_by_license(db: Session, license_number: str):
 def get_drivers(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Driver).offset(skip).limit(limit).all()
 
+def get_drivers_page(db: Session, cursor: Optional[str] = None, limit: int = 100,
+                     skip: int = 0, with_total: bool = False) -> KeysetPage:
+    """Страница водителей по id (keyset-пагинация)"""
+    return paginate(db.query(models.Driver), [models.Driver.id], cursor=cursor, limit=limit,
+                    skip=skip, with_total=with_total)
+
 def create_driver(db: Session, driver: schemas.DriverCreate):
     try:
         # Генерируем уникальный ID, если не предоставлен
@@ -212,6 +225,15 @@ def get_car_by_vin(db: Session, vin: str):
 def get_cars(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Car).offset(skip).limit(limit).all()
 
+def get_cars_page(db: Session, cursor: Optional[str] = None, limit: int = 100,
+                  skip: int = 0, with_total: bool = False) -> KeysetPage:
+    """Страница автомобилей по id (keyset-пагинация)"""
+    return paginate(db.query(models.Car), [models.Car.id], cursor=cursor, limit=limit,
+                    skip=skip, with_total=with_total)
+
+def get_cars_count(db: Session):
+    return db.query(func.count(models.Car.id)).scalar() or 0
+
 def get_driver_cars(db: Session, driver_id: int):
     return db.query(models.Car).filter(models.Car.driver_id == driver_id).all()
 
@@ -295,12 +317,312 @@ def delete_car(db: Session, car_id: int):
 def get_order(db: Session, order_id: int):
     return db.query(models.Order).filter(models.Order.id == order_id).first()
 
-def get_orders(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Order).offset(skip).limit(limit).all()
+def get_orders_page(db: Session, cursor: Optional[str] = None, limit: int = 100,
+                    skip: int = 0, with_total: bool = False) -> KeysetPage:
+    """Страница заказов по id: новые заказы добавляются в конец и не сдвигают выданные страницы"""
+    return paginate(db.query(models.Order), [models.Order.id], cursor=cursor, limit=limit,
+                    skip=skip, with_total=with_total)
+
+def filter_dispatcher_orders(db: Session, search: Optional[str] = None, status: Optional[str] = None,
+                             date: Optional[str] = None, start_date: Optional[str] = None,
+                             end_date: Optional[str] = None):
+    """
+    Запрос заказов диспетчерской с фильтрами в SQL.
+
+    search ищет по поисковому индексу: номер и адреса заказа, ФИО, позывной
+    и телефон водителя (services/search.py),
+    date - день в формате дд.мм.гг, start_date/end_date - диапазон ГГГГ-ММ-ДД.
+    Некорректные даты игнорируются, как и раньше.
+    """
+    query = db.query(models.Order).outerjoin(models.Driver, models.Order.driver_id == models.Driver.id)
+    query = search_index.apply(query, db, ENTITY_ORDER, models.Order.id, search, ranked=False)
+
+    if status:
+        query = query.filter(models.Order.status == status)
+
+    if date and date != "all":
+        try:
+            day = datetime.strptime(date, '%d.%m.%y')
+            query = query.filter(models.Order.created_at >= day, models.Order.created_at < day + timedelta(days=1))
+        except ValueError:
+            pass
+
+    if start_date and end_date:
+        try:
+            start = datetime.strptime(start_date, '%Y-%m-%d')
+            end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(models.Order.created_at >= start, models.Order.created_at < end)
+        except ValueError:
+            pass
+
+    return query
+
+def get_dispatcher_orders_page(db: Session, page: int = 1, per_page: int = 10, **filters):
+    """Страница заказов диспетчерской и общее число подходящих заказов: (orders, total, page)"""
+    query = filter_dispatcher_orders(db, **filters)
+    total = query.with_entities(func.count(models.Order.id)).scalar() or 0
+    total_pages = max(1, -(-total // per_page))
+    page = min(max(1, page), total_pages)
+    orders = query.options(contains_eager(models.Order.driver)).order_by(
+        models.Order.id
+    ).offset((page - 1) * per_page).limit(per_page).all()
+    return orders, total, page
+
+def get_recent_order_dates(db: Session, days: int = 90):
+    """Дни (дд.мм.гг) с заказами за последние days дней - варианты фильтра по дате"""
+    since = datetime.now() - timedelta(days=days)
+    day = func.date(models.Order.created_at)
+    rows = db.query(day).filter(models.Order.created_at >= since).distinct().order_by(day).all()
+    dates = []
+    for (value,) in rows:
+        if isinstance(value, str):
+            # SQLite возвращает date() строкой
+            value = datetime.strptime(value, '%Y-%m-%d')
+        dates.append(value.strftime('%d.%m.%y'))
+    return dates
+
+def filter_dispatcher_drivers(db: Session, search: Optional[str] = None, status: Optional[str] = None,
+                              state: Optional[str] = None):
+    """
+    Запрос водителей диспетчерской с фильтрами в SQL.
+
+    search ищет по поисковому индексу (ФИО, позывной, телефон, номер ВУ,
+    номера автомобилей), status - "занят"/"свободен"
+    (EXISTS по активным заказам), state - статус водителя без учёта регистра.
+    """
+    query = db.query(models.Driver)
+    query = search_index.apply(query, db, ENTITY_DRIVER, models.Driver.id, search, ranked=False)
+
+    if status:
+        status = status.lower()
+        if status == 'занят':
+            query = query.filter(models.Driver.is_busy)
+        elif status == 'свободен':
+            query = query.filter(~models.Driver.is_busy)
+        else:
+            query = query.filter(false())
+
+    if state:
+        query = query.filter(func.lower(models.Driver.status) == state.lower())
+
+    return query
+
+def get_drivers_stats(db: Session, query=None):
+    """Количество водителей, суммарный баланс, занятые и свободные - одним агрегатом по запросу"""
+    query = query if query is not None else db.query(models.Driver)
+    total, balance, busy = query.order_by(None).with_entities(
+        func.count(models.Driver.id),
+        func.coalesce(func.sum(models.Driver.balance), 0),
+        func.count(models.Driver.id).filter(models.Driver.is_busy)
+    ).one()
+    return {
+        "total": total or 0,
+        "balance": float(balance or 0),
+        "busy": busy or 0,
+        "available": (total or 0) - (busy or 0)
+    }
+
+def get_dispatcher_drivers_page(db: Session, page: int = 1, per_page: int = 10, **filters):
+    """Страница водителей диспетчерской и сводка по всем подходящим: (drivers, stats, page)"""
+    query = filter_dispatcher_drivers(db, **filters)
+    stats = get_drivers_stats(db, query)
+    total_pages = max(1, -(-stats["total"] // per_page))
+    page = min(max(1, page), total_pages)
+    drivers = query.options(undefer(models.Driver.is_busy)).order_by(
+        models.Driver.id
+    ).offset((page - 1) * per_page).limit(per_page).all()
+    return drivers, stats, page
+
+def _driver_review_filter(status: str):
+    """Водители со статусом анкеты status; без статуса - ожидающие"""
+    if status == "pending":
+        return or_(models.Driver.status == "pending", models.Driver.status.is_(None))
+    return models.Driver.status == status
+
+def get_drivers_control_page(db: Session, search: Optional[str] = None, status: Optional[str] = None,
+                             page: int = 1, per_page: int = 20):
+    """
+    Страница контроля водителей: (drivers, status_counts, stats, page).
+
+    status_counts - число водителей по статусам анкеты одним GROUP BY,
+    stats - сводка get_drivers_stats; обе по найденным поиском водителям.
+    Страница - с учётом фильтра status, по релевантности поиска, затем по id.
+    """
+    query = db.query(models.Driver)
+    query = search_index.apply(query, db, ENTITY_DRIVER, models.Driver.id, search)
+
+    rows = query.order_by(None).with_entities(
+        models.Driver.status, func.count(models.Driver.id)
+    ).group_by(models.Driver.status).all()
+    status_counts = {"pending": 0, "accepted": 0, "rejected": 0}
+    for driver_status, count in rows:
+        key = driver_status or "pending"
+        status_counts[key] = status_counts.get(key, 0) + count
+    stats = get_drivers_stats(db, query)
+
+    if status:
+        query = query.filter(_driver_review_filter(status))
+    total = status_counts.get(status, 0) if status else stats["total"]
+    total_pages = max(1, -(-total // per_page))
+    page = min(max(1, page), total_pages)
+    drivers = query.order_by(models.Driver.id).offset((page - 1) * per_page).limit(per_page).all()
+    return drivers, status_counts, stats, page
+
+# Фотографии документов водителя и автомобиля, любая из которых ставит водителя в очередь фотоконтроля
+DOCUMENT_PHOTO_FIELDS = ("passport_front", "passport_back", "license_front", "license_back", "driver_with_license")
+CAR_PHOTO_FIELDS = ("photo_front", "photo_rear", "photo_right", "photo_left", "photo_interior_front", "photo_interior_rear")
+
+def _photo_verifications():
+    return models.DriverVerification.verification_type.like("photo_%")
+
+def filter_photo_control_queue(query):
+    """
+    Очередь фотоконтроля поверх запроса водителей: есть загруженные фото
+    (документы или автомобиль) и нет фото-верификаций либо есть ожидающая.
+    """
+    Driver, Documents, Car, Verification = models.Driver, models.DriverDocuments, models.Car, models.DriverVerification
+    has_photos = or_(
+        exists().where(Documents.driver_id == Driver.id,
+                       or_(*(getattr(Documents, field).isnot(None) for field in DOCUMENT_PHOTO_FIELDS))),
+        exists().where(Car.driver_id == Driver.id,
+                       or_(*(getattr(Car, field).isnot(None) for field in CAR_PHOTO_FIELDS)))
+    )
+    photo_verification = and_(Verification.driver_id == Driver.id, _photo_verifications())
+    needs_review = or_(
+        ~exists().where(photo_verification),
+        exists().where(photo_verification, Verification.status == "pending")
+    )
+    return query.filter(has_photos, needs_review)
+
+def get_photo_control_page(db: Session, query, page: int = 1, per_page: int = 10):
+    """
+    Страница очереди фотоконтроля: (drivers, total, page). Водители страницы
+    и статусы их фото приходят одним запросом (LEFT JOIN driver_verifications),
+    photo_status - {тип фото: статус}.
+    """
+    Driver, Verification = models.Driver, models.DriverVerification
+    queue = filter_photo_control_queue(query)
+    total = queue.with_entities(func.count(Driver.id)).scalar() or 0
+    total_pages = max(1, -(-total // per_page))
+    page = min(max(1, page), total_pages)
+
+    page_ids = queue.with_entities(Driver.id).order_by(Driver.id).offset((page - 1) * per_page).limit(per_page).subquery()
+    rows = db.query(
+        Driver.id, Driver.full_name, Driver.callsign, Driver.phone, Driver.city, Driver.status,
+        Driver.registration_date, Verification.verification_type, Verification.status
+    ).join(page_ids, Driver.id == page_ids.c.id).outerjoin(
+        Verification, and_(Verification.driver_id == Driver.id, _photo_verifications())
+    ).order_by(Driver.id, Verification.id).all()
+
+    drivers = {}
+    for driver_id, full_name, callsign, phone, city, status, registered, verification_type, verification_status in rows:
+        driver = drivers.get(driver_id)
+        if driver is None:
+            driver = drivers[driver_id] = {
+                "id": driver_id,
+                "full_name": full_name,
+                "callsign": callsign,
+                "phone": phone,
+                "city": city,
+                "status": status,
+                "registration_date": registered.strftime("%d.%m.%Y") if registered else None,
+                "photo_status": {}
+            }
+        if verification_type is not None:
+            driver["photo_status"][verification_type.replace("photo_", "")] = verification_status
+    return list(drivers.values()), total, page
+
+def get_photo_verification_counts(db: Session):
+    """Количество фото-верификаций по статусам одним GROUP BY"""
+    Verification = models.DriverVerification
+    rows = db.query(Verification.status, func.count(Verification.id)).filter(
+        _photo_verifications()
+    ).group_by(Verification.status).all()
+    return {status: count for status, count in rows}
+
+def get_drivers_summary(db: Session):
+    """Количество водителей и их суммарный баланс одним запросом"""
+    count, balance = db.query(func.count(models.Driver.id), func.coalesce(func.sum(models.Driver.balance), 0)).one()
+    return count, float(balance or 0)
+
+# Периоды аналитики заказов: ключ API -> число дней (None - за всё время)
+ORDER_ANALYTICS_PERIODS = {'7': 7, '30': 30, '365': 365, 'all': None}
+
+def get_order_analytics(db: Session, now: Optional[datetime] = None):
+    """
+    Сводка по заказам для аналитики одним агрегирующим запросом.
+
+    Сумма, количество и средний чек оплаченных заказов (price > 0) за каждый
+    период из ORDER_ANALYTICS_PERIODS считаются через FILTER по created_at,
+    плюс минимальный/максимальный заказ и счётчики по статусам. ORM-объекты
+    не загружаются.
+    """
+    now = now or datetime.now()
+    Order = models.Order
+    paid = Order.price > 0
+
+    columns = []
+    for days in ORDER_ANALYTICS_PERIODS.values():
+        condition = paid if days is None else (paid & (Order.created_at >= now - timedelta(days=days)))
+        columns.append(func.coalesce(func.sum(Order.price).filter(condition), 0))
+        columns.append(func.count(Order.id).filter(condition))
+    columns += [
+        func.max(Order.price).filter(paid),
+        func.min(Order.price).filter(paid),
+        func.count(Order.id),
+        func.count(Order.id).filter(Order.status == "Завершен"),
+        func.count(Order.id).filter(Order.status == "Отменен"),
+    ]
+    row = db.query(*columns).one()
+
+    periods = {}
+    for index, period in enumerate(ORDER_ANALYTICS_PERIODS):
+        earnings = float(row[2 * index] or 0)
+        count = int(row[2 * index + 1] or 0)
+        periods[period] = {
+            "earnings": earnings,
+            "count": count,
+            "avg": earnings / count if count else 0.0
+        }
+    max_order, min_order, total, completed, cancelled = row[2 * len(ORDER_ANALYTICS_PERIODS):]
+    return {
+        "periods": periods,
+        "max_order": float(max_order or 0),
+        "min_order": float(min_order or 0),
+        "total_orders": int(total or 0),
+        "completed_orders": int(completed or 0),
+        "cancelled_orders": int(cancelled or 0)
+    }
+
+def get_order_daily_series(db: Session, since=None, value: str = "earnings"):
+    """Дневной ряд из order_daily_stats: {день: сумма value по всем тарифам, паркам и статусам}"""
+    stats = models.OrderDailyStats
+    query = db.query(stats.day, func.sum(getattr(stats, value))).group_by(stats.day)
+    if since is not None:
+        query = query.filter(stats.day >= since)
+    return {day: float(total or 0) for day, total in query.all()}
+
+def get_balance_daily_series(db: Session, since=None, transaction_type: str = "deposit"):
+    """Дневной ряд сумм транзакций баланса одного типа из balance_daily_stats"""
+    stats = models.BalanceDailyStats
+    query = db.query(stats.day, stats.amount).filter(stats.type == transaction_type)
+    if since is not None:
+        query = query.filter(stats.day >= since)
+    return {day: float(amount or 0) for day, amount in query.all()}
 
 def get_driver_orders(db: Session, driver_id: int):
     return db.query(models.Order).filter(models.Order.driver_id == driver_id).all()
 
+def get_driver_activity_page(db: Session, driver_id: int, since: Optional[datetime] = None,
+                             cursor: Optional[str] = None, limit: int = 50,
+                             with_total: bool = False) -> KeysetPage:
+    """История заказов водителя от новых к старым, страницами по (created_at, id)"""
+    query = db.query(models.Order).filter(models.Order.driver_id == driver_id)
+    if since:
+        query = query.filter(models.Order.created_at >= since)
+    return paginate(query, [models.Order.created_at, models.Order.id], cursor=cursor, limit=limit,
+                    descending=True, with_total=with_total)
+
 # Функция create_order уже определена выше в строках 15-50 с поддержкой координат
 
 def update_order(db: Session, order_id: int, order_data: schemas.OrderCreate):
@@ -333,12 +655,15 @@ def create_message(db: Session, message: schemas.MessageCreate, sender_id: Optio
     db.refresh(db_message)
     return db_message
 
-def get_messages_for_driver(db: Session, driver_id: int, skip: int = 0, limit: int = 100):
-    """Получить все сообщения для конкретного водителя (персональные + общие рассылки)"""
-    return db.query(models.Message).filter(
+def get_messages_for_driver(db: Session, driver_id: int, cursor: Optional[str] = None, limit: int = 100,
+                            skip: int = 0, with_total: bool = False) -> KeysetPage:
+    """Сообщения для конкретного водителя (персональные + общие рассылки), от новых к старым"""
+    query = db.query(models.Message).filter(
         (models.Message.recipient_id == driver_id) | 
         (models.Message.is_broadcast == True)
-    ).order_by(models.Message.created_at.desc()).offset(skip).limit(limit).all()
+    )
+    return paginate(query, [models.Message.created_at, models.Message.id], cursor=cursor, limit=limit,
+                    descending=True, skip=skip, with_total=with_total)
 
 def get_broadcast_messages(db: Session, skip: int = 0, limit: int = 100):
     """Получить все общие рассылки"""
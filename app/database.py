@@ -1,4 +1,6 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -11,6 +13,29 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронные драйверы для той же БД: asyncpg в продакшене, aiosqlite для разработки
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url: str):
+    """DATABASE_URL с асинхронным драйвером вместо синхронного (psycopg2, pysqlite)"""
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername))
+
+async_engine = create_async_engine(async_database_url(SQLALCHEMY_DATABASE_URL))
+# sync_session_class - чтобы слушатели сессий SessionLocal (поисковый индекс, сводки
+# аналитики) срабатывали и для асинхронных сессий. expire_on_commit=False: после
+# commit атрибуты не перечитываются неявно - в асинхронном коде это ошибка
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    sync_session_class=SessionLocal.class_,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
 
 def get_db():
@@ -18,4 +43,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """Асинхронная сессия для async-эндпоинтов: запросы не блокируют цикл событий"""
+    async with AsyncSessionLocal() as db:
+        yield db
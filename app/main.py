@@ -1,7 +1,7 @@
 import logging
 import sys
-from fastapi import FastAPI, Depends, Request, Response, Query, Form, UploadFile, File, HTTPException, status, Cookie
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse
+from fastapi import FastAPI, Depends, Request, Response, Query, Form, UploadFile, File, HTTPException, status, Cookie, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -10,8 +10,9 @@ import os, sys, random, string, json, time, math, re, asyncio, logging
 from datetime import datetime, timedelta, timezone, date
 from typing import Optional, List, Dict, Any, Union
 from pydantic import BaseModel, Field, validator, ValidationError
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, or_, and_, select, delete, exists
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 import jose.jwt
 import secrets
@@ -20,7 +21,6 @@ from pathlib import Path
 from math import ceil
 from contextlib import asynccontextmanager
 import hashlib
-from geopy.distance import geodesic
 
 # Настройка подробного логирования
 logging.basicConfig(
@@ -36,14 +36,35 @@ logger = logging.getLogger(__name__)
 
 # Включить логирование SQL-запросов
 logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+# aiosqlite на DEBUG пишет каждую операцию курсора - SQL уже есть в логе sqlalchemy.engine
+logging.getLogger('aiosqlite').setLevel(logging.INFO)
 
 # Импорт модулей проекта
 from . import crud, models, schemas
-from .database import engine, SessionLocal, get_db, Base
+from .database import engine, SessionLocal, get_db, Base, AsyncSessionLocal, async_engine, get_async_db
 from .routers import drivers, cars, orders, messages, driver_auth
 from .models import TokenResponse
 from .api import twogis
 from .config import settings
+from .services.driver_index import driver_index
+from .services.dispatch_service import (
+    dispatch_engine, eta_cost, claim_order, release_offer, OFFERED_ORDER_STATUS, PENDING_ORDER_STATUSES
+)
+from .services.eta_service import eta_service, thread_provider as eta_thread_provider
+from .services.driver_ws import driver_connections
+from .services.cluster_bus import cluster_bus
+from .services.location_store import location_store
+from .services.trip_track import trip_tracks, load_track
+from .services import polyline
+from .services import plus_codes
+from .services.distance import distance_km
+from .services.route_progress import route_progress, schedule_route_fetch, forget_route
+from .services.keyset import InvalidCursor
+from .services.twogis_service import twogis_service
+from .services.address_index import address_index
+from .services.analytics_rollup import analytics_rollup, build_chart
+from .services.search import search_index, ENTITY_DRIVER, ENTITY_ORDER
+from .services.order_events import order_events, order_state, TERMINAL_ORDER_STATUSES, TRACKED_ORDER_STATUSES
 
 # Выполняем миграцию базы данных
 # from .migration import run_migrations
@@ -56,11 +77,41 @@ Base.metadata.create_all(bind=engine)
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("uploads/cars", exist_ok=True)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка фоновых сервисов приложения"""
+    await twogis_service.start()
+    await twogis_service.warm_up()
+    if settings.ADDRESS_INDEX_ENABLED:
+        await asyncio.to_thread(address_index.build_from_db)
+    cluster_bus.set_listener(driver_connections.receive)
+    await cluster_bus.start()
+    location_store.start()
+    trip_tracks.start()
+    analytics_rollup.start()
+    search_index.start()
+    if settings.DISPATCH_ENABLED:
+        dispatch_engine.set_offer_listener(push_dispatch_offers)
+        if settings.DISPATCH_USE_ETA:
+            dispatch_engine.set_eta_provider(eta_thread_provider(eta_service, asyncio.get_running_loop()))
+            dispatch_engine.set_cost_function(eta_cost)
+        dispatch_engine.start()
+    yield
+    await dispatch_engine.stop()
+    await trip_tracks.stop()
+    await analytics_rollup.stop()
+    await search_index.stop()
+    await location_store.stop()
+    await cluster_bus.stop()
+    await twogis_service.close()
+    await async_engine.dispose()
+
 # Создаем экземпляр FastAPI
 app = FastAPI(
     title="WAZIR MTT API",
     description="API для управления водителями и заказами WAZIR MTT",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Отладочная информация при запуске
@@ -78,6 +129,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],  # Keyset-пагинация списковых API
 )
 
 # Подключаем статические файлы
@@ -328,17 +380,22 @@ def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> fl
         return 0.0
     
     try:
-        point1 = (lat1, lng1)
-        point2 = (lat2, lng2)
-        distance = geodesic(point1, point2).kilometers
-        return round(distance, 3)
+        return round(distance_km(lat1, lng1, lat2, lng2), 3)
     except Exception as e:
         logger.error(f"Ошибка расчета расстояния: {e}")
         return 0.0
 
 # Функция для расчета прогресса выполнения заказа
 def calculate_order_progress(order, current_lat: float, current_lng: float) -> dict:
-    """Рассчитывает прогресс выполнения заказа"""
+    """
+    Рассчитывает прогресс выполнения заказа.
+
+    Если при принятии заказа сохранён маршрут 2GIS, позиция проецируется на
+    него и прогресс считается вдоль дороги; иначе - по прямой до назначения.
+    """
+    route_data = route_progress(order, current_lat, current_lng)
+    if route_data is not None:
+        return route_data
     
     if not all([order.origin_lat, order.origin_lng, order.destination_lat, order.destination_lng]):
         return {"progress": 0.0, "completed_distance": 0.0, "remaining_distance": 0.0}
@@ -565,96 +622,35 @@ async def disp_home(
     page: int = Query(1, ge=1)
 ):
     """Главная страница диспетчерской с отображением заказов"""
-    # Получаем все заказы из БД
-    all_orders = crud.get_orders(db)
-    all_drivers = crud.get_drivers(db)
-    
-    # Фильтрация заказов
-    filtered_orders = all_orders.copy() if all_orders else []
-    
-    # Фильтр по поиску (ищем в номере телефона, адресах и позывном)
-    if search:
-        search_lower = search.lower()
-        filtered_orders = [
-            order for order in filtered_orders if (
-                (hasattr(order, 'driver') and 
-                 order.driver and 
-                 hasattr(order.driver, 'phone') and 
-                 search_lower in str(order.driver.phone).lower()) or
-                (hasattr(order, 'origin') and 
-                 order.origin and 
-                 search_lower in order.origin.lower()) or
-                (hasattr(order, 'destination') and 
-                 order.destination and 
-                 search_lower in order.destination.lower()) or
-                (hasattr(order, 'driver') and 
-                 order.driver and 
-                 hasattr(order.driver, 'callsign') and 
-                 search_lower in order.driver.callsign.lower())
-            )
-        ]
-    
-    # Фильтр по статусу
-    if status:
-        filtered_orders = [
-            order for order in filtered_orders if
-            (hasattr(order, 'status') and order.status == status)
-        ]
-    
-    # Фильтр по конкретной дате
-    if date and date != "all":
-        filtered_orders = [
-            order for order in filtered_orders if
-            (hasattr(order, 'created_at') and 
-             order.created_at.strftime('%d.%m.%y') == date)
-        ]
-    
-    # Фильтр по диапазону дат
-    if start_date and end_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d')
-            end = datetime.strptime(end_date, '%Y-%m-%d')
-            end = end.replace(hour=23, minute=59, second=59)  # До конца дня
-            
-            filtered_orders = [
-                order for order in filtered_orders if
-                (hasattr(order, 'created_at') and 
-                 start <= order.created_at <= end)
-            ]
-        except ValueError:
-            # В случае некорректного формата дат, игнорируем этот фильтр
-            pass
+    # Фильтры, подсчёт и страница - в SQL, водители подгружаются тем же запросом
+    filters = {
+        "search": search,
+        "status": status,
+        "date": date,
+        "start_date": start_date,
+        "end_date": end_date
+    }
+    items_per_page = 10
+    paged_orders, total_orders, page = crud.get_dispatcher_orders_page(
+        db, page=page, per_page=items_per_page, **filters
+    )
+    total_pages = max(1, ceil(total_orders / items_per_page))
     
     # Проверяем наличие хотя бы одного примененного фильтра
     is_filtered = bool(search) or bool(status) or bool(date) or (bool(start_date) and bool(end_date))
     
-    # Подсчет количества заказов и извлечение доступных дат для фильтра
-    total_orders = len(filtered_orders)
-    available_dates = sorted(set(
-        order.created_at.strftime('%d.%m.%y') 
-        for order in all_orders 
-        if hasattr(order, 'created_at')
-    ))
+    available_dates = crud.get_recent_order_dates(db)
+    total_drivers, total_balance = crud.get_drivers_summary(db)
     
-    # Расчет суммарного баланса всех водителей
-    total_balance = sum(driver.balance for driver in all_drivers if hasattr(driver, 'balance'))
-    
-    # Пагинация
-    items_per_page = 10
-    total_pages = max(1, ceil(total_orders / items_per_page))
-    page = min(max(1, page), total_pages)
-    
-    # Получаем заказы для текущей страницы
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, total_orders)
-    paged_orders = filtered_orders[start_idx:end_idx] if filtered_orders else []
+    # Номера страниц вокруг текущей (плюс первая и последняя)
+    page_numbers = sorted({1, total_pages, *range(max(1, page - 3), min(total_pages, page + 3) + 1)})
     
     # Данные для шаблона
     template_data = {
         "current_page": "home",
         "orders": paged_orders,
         "total_orders": total_orders,
-        "total_drivers": len(all_drivers),
+        "total_drivers": total_drivers,
         "total_balance": f"{total_balance:.0f}",
         
         # Параметры фильтрации
@@ -668,6 +664,7 @@ async def disp_home(
         # Параметры пагинации
         "page": page,
         "total_pages": total_pages,
+        "page_numbers": page_numbers,
         
         # Флаг применения фильтров
         "is_filtered": is_filtered,
@@ -679,28 +676,16 @@ async def disp_home(
     
     return templates.TemplateResponse("disp/index.html", {"request": request, **template_data})
 
+# Аналитика - обычные def: FastAPI выполняет их в пуле потоков, и тяжёлые
+# синхронные запросы не останавливают цикл событий (опрос водителей, WebSocket)
 @app.get("/disp/analytics", response_class=HTMLResponse)
-async def disp_analytics(request: Request, db: Session = Depends(get_db)):
+def disp_analytics(request: Request, db: Session = Depends(get_db)):
     """Страница аналитики"""
-    from datetime import datetime, timedelta
-    from sqlalchemy import func
-    
-    # Получаем данные о водителях, машинах и заказах из БД
-    all_drivers = crud.get_drivers(db)
-    all_cars = crud.get_cars(db)
-    all_orders = crud.get_orders(db, limit=10000)  # Получаем больше заказов для аналитики
-    
-    # Расчет суммарного баланса всех водителей
-    total_balance = 0
-    if all_drivers:
-        for driver in all_drivers:
-            total_balance += driver.balance if driver.balance else 0
-    
-    # Расчеты по времени
-    now = datetime.now()
-    last_7_days = now - timedelta(days=7)
-    last_30_days = now - timedelta(days=30)
-    last_year = now - timedelta(days=365)
+    # Сводки по водителям, машинам и заказам считаются в БД агрегатами
+    total_drivers, total_balance = crud.get_drivers_summary(db)
+    total_cars = crud.get_cars_count(db)
+    analytics = crud.get_order_analytics(db)
+    periods = analytics["periods"]
     
     # 📊 АНАЛИТИКА ПОПОЛНЕНИЙ БАЛАНСА
     # Примерные данные (в реальном проекте будет таблица пополнений)
@@ -713,36 +698,20 @@ async def disp_analytics(request: Request, db: Session = Depends(get_db)):
     }
     
     # 🚗 АНАЛИТИКА ЗАКАЗОВ
-    orders_with_price = [order for order in all_orders if order.price and order.price > 0]
-    
-    # Фильтрация заказов по периодам
-    orders_7_days = [o for o in orders_with_price if o.created_at >= last_7_days]
-    orders_30_days = [o for o in orders_with_price if o.created_at >= last_30_days]
-    orders_year = [o for o in orders_with_price if o.created_at >= last_year]
-    
-    # Расчеты для заказов за 30 дней (по умолчанию)
-    earnings_30_days = sum(order.price for order in orders_30_days)
-    count_30_days = len(orders_30_days)
-    avg_order_30_days = earnings_30_days / count_30_days if count_30_days > 0 else 0
-    
-    # Максимальный и минимальный заказы
-    max_order = max((order.price for order in orders_with_price), default=0)
-    min_order = min((order.price for order in orders_with_price), default=0)
-    
     orders_stats = {
-        "earnings_30_days": f"{earnings_30_days:.0f}",
-        "count_30_days": str(count_30_days),
-        "avg_order": f"{avg_order_30_days:.0f}",
-        "max_order": f"{max_order:.0f}",
-        "min_order": f"{min_order:.0f}",
+        "earnings_30_days": f"{periods['30']['earnings']:.0f}",
+        "count_30_days": str(periods['30']['count']),
+        "avg_order": f"{periods['30']['avg']:.0f}",
+        "max_order": f"{analytics['max_order']:.0f}",
+        "min_order": f"{analytics['min_order']:.0f}",
         
         # Дополнительные данные для других периодов
-        "earnings_7_days": f"{sum(order.price for order in orders_7_days):.0f}",
-        "count_7_days": str(len(orders_7_days)),
-        "earnings_year": f"{sum(order.price for order in orders_year):.0f}",
-        "count_year": str(len(orders_year)),
-        "earnings_all": f"{sum(order.price for order in orders_with_price):.0f}",
-        "count_all": str(len(orders_with_price)),
+        "earnings_7_days": f"{periods['7']['earnings']:.0f}",
+        "count_7_days": str(periods['7']['count']),
+        "earnings_year": f"{periods['365']['earnings']:.0f}",
+        "count_year": str(periods['365']['count']),
+        "earnings_all": f"{periods['all']['earnings']:.0f}",
+        "count_all": str(periods['all']['count']),
         
         # Данные для пополнений
         "count_30_days": "12",  # Количество пополнений за месяц
@@ -755,8 +724,8 @@ async def disp_analytics(request: Request, db: Session = Depends(get_db)):
         "balance": f"{total_balance:.0f}",
         
         # Количество водителей и машин для диаграмм
-        "total_drivers": len(all_drivers),
-        "total_cars": len(all_cars),
+        "total_drivers": total_drivers,
+        "total_cars": total_cars,
         
         # 💰 Новые данные пополнений
         "balance_stats": balance_stats,
@@ -765,9 +734,9 @@ async def disp_analytics(request: Request, db: Session = Depends(get_db)):
         "orders_stats": orders_stats,
         
         # Данные для старых диаграмм (оставляем для совместимости)
-        "total_orders": len(all_orders),
-        "completed_orders": len([o for o in all_orders if o.status == "Завершен"]),
-        "cancelled_orders": len([o for o in all_orders if o.status == "Отменен"]),
+        "total_orders": analytics["total_orders"],
+        "completed_orders": analytics["completed_orders"],
+        "cancelled_orders": analytics["cancelled_orders"],
         "completed_percentage": 55,
         "total_types": 50,
         "taxipark_orders": 30,
@@ -786,38 +755,20 @@ async def disp_analytics(request: Request, db: Session = Depends(get_db)):
     )
 
 @app.get("/api/analytics/orders/{period}")
-async def get_orders_analytics(period: str, db: Session = Depends(get_db)):
+def get_orders_analytics(period: str, db: Session = Depends(get_db)):
     """API для получения аналитики заказов за определенный период"""
-    from datetime import datetime, timedelta
-    
-    all_orders = crud.get_orders(db, limit=10000)
-    orders_with_price = [order for order in all_orders if order.price and order.price > 0]
-    
-    now = datetime.now()
-    
-    # Определяем период фильтрации
-    if period == "7":
-        filtered_orders = [o for o in orders_with_price if o.created_at >= now - timedelta(days=7)]
-    elif period == "30":
-        filtered_orders = [o for o in orders_with_price if o.created_at >= now - timedelta(days=30)]
-    elif period == "365":
-        filtered_orders = [o for o in orders_with_price if o.created_at >= now - timedelta(days=365)]
-    else:  # "all"
-        filtered_orders = orders_with_price
-    
-    # Расчеты
-    total_earnings = sum(order.price for order in filtered_orders)
-    total_count = len(filtered_orders)
-    avg_order = total_earnings / total_count if total_count > 0 else 0
+    periods = crud.get_order_analytics(db)["periods"]
+    # Неизвестный период - за всё время
+    stats = periods.get(period, periods["all"])
     
     return {
-        "earnings": f"{total_earnings:.0f}",
-        "count": str(total_count),
-        "avg": f"{avg_order:.0f}"
+        "earnings": f"{stats['earnings']:.0f}",
+        "count": str(stats["count"]),
+        "avg": f"{stats['avg']:.0f}"
     }
 
 @app.get("/api/analytics/balance/{period}")
-async def get_balance_analytics(period: str, db: Session = Depends(get_db)):
+def get_balance_analytics(period: str, db: Session = Depends(get_db)):
     """API для получения аналитики пополнений за определенный период"""
     from datetime import datetime, timedelta
     
@@ -841,55 +792,16 @@ async def get_balance_analytics(period: str, db: Session = Depends(get_db)):
     }
 
 @app.get("/api/analytics/balance-chart/{period}")
-async def get_balance_chart_data(period: str):
+def get_balance_chart_data(period: str, db: Session = Depends(get_db)):
     """API для получения данных графика пополнений"""
-    
-    if period == "7":
-        return {
-            "labels": ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"],
-            "data": [1200, 800, 0, 1500, 2200, 1800, 900]
-        }
-    elif period == "30":
-        return {
-            "labels": ["1", "5", "10", "15", "20", "25", "30"],
-            "data": [3000, 5000, 2000, 8000, 12000, 7000, 4500]
-        }
-    elif period == "365":
-        return {
-            "labels": ["Янв", "Фев", "Мар", "Апр", "Май", "Июн", "Июл", "Авг", "Сен", "Окт", "Ноя", "Дек"],
-            "data": [15000, 23000, 18000, 32000, 28000, 35000, 42000, 38000, 31000, 27000, 22000, 19000]
-        }
-    else:  # all
-        return {
-            "labels": ["2022", "2023", "2024", "2025"],
-            "data": [180000, 250000, 320000, 85000]
-        }
+    # Несколько сотен строк дневной сводки вместо прохода по исходной таблице
+    return build_chart(period, lambda since: crud.get_balance_daily_series(db, since=since, transaction_type="deposit"))
 
 @app.get("/api/analytics/orders-chart/{period}")
-async def get_orders_chart_data(period: str, db: Session = Depends(get_db)):
+def get_orders_chart_data(period: str, db: Session = Depends(get_db)):
     """API для получения данных графика заказов"""
-    from datetime import datetime, timedelta
-    
-    if period == "7":
-        return {
-            "labels": ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"],
-            "data": [18000, 22000, 19000, 25000, 32000, 38000, 28000]
-        }
-    elif period == "30":
-        return {
-            "labels": ["1-5", "6-10", "11-15", "16-20", "21-25", "26-30"],
-            "data": [95000, 112000, 87000, 134000, 156000, 128000]
-        }
-    elif period == "365":
-        return {
-            "labels": ["Янв", "Фев", "Мар", "Апр", "Май", "Июн", "Июл", "Авг", "Сен", "Окт", "Ноя", "Дек"],
-            "data": [320000, 385000, 298000, 456000, 512000, 478000, 523000, 489000, 445000, 398000, 356000, 412000]
-        }
-    else:  # all
-        return {
-            "labels": ["2022", "2023", "2024", "2025"],
-            "data": [2800000, 3650000, 4250000, 1200000]
-        }
+    # Несколько сотен строк дневной сводки вместо прохода по исходной таблице
+    return build_chart(period, lambda since: crud.get_order_daily_series(db, since=since, value="earnings"))
 
 @app.get("/disp/cars", response_class=HTMLResponse)
 async def disp_cars(
@@ -997,55 +909,27 @@ async def disp_drivers(
     page: int = 1
 ):
     """Страница водителей с поддержкой фильтрации и пагинации"""
-    # Получаем всех водителей
-    drivers = crud.get_drivers(db)
-    
-    # Применяем фильтры, если они указаны
-    filtered_drivers = drivers.copy() if drivers else []
-    
-    if search:
-        search = search.lower()
-        filtered_drivers = [
-            d for d in filtered_drivers if (
-                search in d.full_name.lower() or 
-                search in getattr(d, 'callsign', '').lower() or
-                search in str(getattr(d, 'driver_license_number', '')).lower()
-            )
-        ]
-    
-    if status:
-        status = status.lower()
-        filtered_drivers = [
-            d for d in filtered_drivers if 
-            (status == 'занят' and getattr(d, 'is_busy', False)) or
-            (status == 'свободен' and not getattr(d, 'is_busy', False))
-        ]
-    
-    if state:
-        state = state.lower()
-        filtered_drivers = [
-            d for d in filtered_drivers if
-            getattr(d, 'status', 'работает').lower() == state
-        ]
+    # Фильтры, занятость (EXISTS по активным заказам), подсчёт и страница - в SQL
+    items_per_page = 10
+    paged_drivers, stats, page = crud.get_dispatcher_drivers_page(
+        db, page=page, per_page=items_per_page, search=search, status=status, state=state
+    )
+    search = search.lower() if search else search
+    status = status.lower() if status else status
+    state = state.lower() if state else state
     
     # Фильтры
     is_filtered = bool(search) or bool(status) or bool(state)
     
-    # Подсчет метрик для отфильтрованных данных
-    total_drivers = len(filtered_drivers)
-    total_balance = sum(driver.balance for driver in filtered_drivers) if filtered_drivers else 0
-    available_drivers = len([d for d in filtered_drivers if not getattr(d, 'is_busy', False)])
-    busy_drivers = total_drivers - available_drivers
+    # Метрики по всем отфильтрованным водителям
+    total_drivers = stats["total"]
+    total_balance = stats["balance"]
+    available_drivers = stats["available"]
+    busy_drivers = stats["busy"]
     
     # Пагинация
-    items_per_page = 10
     total_pages = max(1, ceil(total_drivers / items_per_page))
-    page = min(max(1, page), total_pages)
-    
-    # Получаем водителей для текущей страницы
-    offset = (page - 1) * items_per_page
-    limit = items_per_page
-    paged_drivers = filtered_drivers[offset:offset+limit] if filtered_drivers else []
+    page_numbers = sorted({1, total_pages, *range(max(1, page - 3), min(total_pages, page + 3) + 1)})
     
     return templates.TemplateResponse(
         "disp/drivers.html", 
@@ -1058,6 +942,7 @@ async def disp_drivers(
             "busy_drivers": busy_drivers,
             "page": page,
             "total_pages": total_pages,
+            "page_numbers": page_numbers,
             "is_filtered": is_filtered,
             "search": search if search else "",
             "status": status if status else "",
@@ -1070,72 +955,40 @@ async def disp_drivers_control(
     request: Request, 
     db: Session = Depends(get_db),
     search: Optional[str] = None,
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    page: int = 1
 ):
-    """Страница фото контроля водителей с фильтрацией и поиском"""
-    # Базовый запрос всех водителей
-    query = db.query(models.Driver)
-    
-    # Применяем фильтры, если они указаны
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                models.Driver.full_name.ilike(search_term),
-                models.Driver.callsign.ilike(search_term),
-                models.Driver.phone.ilike(search_term)
-            )
-        )
-    
-    # Получаем всех водителей для базового списка
-    all_drivers = query.all()
-    
-    # Разделяем водителей на принятых и отклоненных для правильного подсчета
-    accepted_drivers = [d for d in all_drivers if getattr(d, 'status', None) == 'accepted']
-    rejected_drivers = [d for d in all_drivers if getattr(d, 'status', None) == 'rejected']
-    pending_drivers = [d for d in all_drivers if getattr(d, 'status', None) == 'pending' or getattr(d, 'status', None) is None]
-    
-    # Если указан статус, применяем фильтр к исходному запросу
-    if status:
-        query = query.filter(models.Driver.status == status)
-        # Получаем отфильтрованных водителей
-        filtered_drivers = query.all()
-        
-        # В зависимости от статуса, заполняем соответствующий список фильтрованными данными
-        if status == 'accepted':
-            accepted_drivers = filtered_drivers
-        elif status == 'rejected':
-            rejected_drivers = filtered_drivers
-        elif status == 'pending':
-            pending_drivers = filtered_drivers
-    
-    # Получаем статистику
-    total_drivers = len(all_drivers)
-    available_drivers = len([d for d in all_drivers if hasattr(d, 'is_busy') and not d.is_busy])
-    busy_drivers = total_drivers - available_drivers
-    
-    # Рассчитываем общий баланс
-    total_balance = sum(getattr(driver, 'balance', 0) for driver in all_drivers)
+    """Страница фото контроля водителей с фильтрацией, поиском и пагинацией"""
+    # Поиск по индексу, счётчики по статусам (GROUP BY), сводка и страница - в SQL
+    items_per_page = 20
+    drivers, status_counts, stats, page = crud.get_drivers_control_page(
+        db, search=search, status=status, page=page, per_page=items_per_page
+    )
+    total_drivers = stats["total"]
+    total_balance = stats["balance"]
     
-    # Считаем количество отклоненных водителей для отображения
-    rejected_count = len(rejected_drivers)
+    # Пагинация по водителям выбранного статуса
+    filtered_total = status_counts.get(status, 0) if status else total_drivers
+    total_pages = max(1, ceil(filtered_total / items_per_page))
+    page_numbers = sorted({1, total_pages, *range(max(1, page - 3), min(total_pages, page + 3) + 1)})
     
     return templates.TemplateResponse(
         "disp/drivers_control.html",
         {
             "request": request,
             "current_page": "drivers_control",
-            "all_drivers": all_drivers,
-            "accepted_drivers": accepted_drivers,
-            "rejected_drivers": rejected_drivers,
-            "pending_drivers": pending_drivers,
+            "drivers": drivers,
+            "status_counts": status_counts,
             "total_drivers": total_drivers,
-            "available_drivers": available_drivers,
-            "busy_drivers": busy_drivers,
+            "available_drivers": stats["available"],
+            "busy_drivers": stats["busy"],
             "total_balance": f"{total_balance:.0f}",
             "search": search,
             "status": status,
-            "rejected_count": rejected_count
+            "rejected_count": status_counts["rejected"],
+            "page": page,
+            "total_pages": total_pages,
+            "page_numbers": page_numbers
         }
     )
 
@@ -1499,8 +1352,8 @@ async def disp_pay_balance(
     """Страница пополнения баланса водителей"""
     items_per_page = 10
     
-    # Базовый запрос водителей с присоединением автомобилей
-    query = db.query(models.Driver).join(models.Car, models.Driver.id == models.Car.driver_id, isouter=True)
+    # Базовый запрос водителей
+    query = db.query(models.Driver)
     
     # Применяем фильтры
     if status:
@@ -1517,16 +1370,8 @@ async def disp_pay_balance(
             start_date = datetime.now().date() - timedelta(days=30)
             query = query.filter(models.Driver.created_at >= start_date)
     
-    if search:
-        search = f"%{search}%"
-        query = query.filter(
-            or_(
-                models.Driver.full_name.ilike(search),
-                models.Driver.callsign.ilike(search),
-                models.Driver.phone.ilike(search),
-                models.Car.license_plate.ilike(search)
-            )
-        )
+    # Поиск по индексу (ФИО, позывной, телефон, номера автомобилей), по релевантности
+    query = search_index.apply(query, db, ENTITY_DRIVER, models.Driver.id, search)
     
     # Подсчет общего количества водителей
     total_drivers = query.count()
@@ -1668,73 +1513,23 @@ async def filter_drivers(
                 month_ago = today - timedelta(days=30)
                 query = query.filter(models.Driver.registration_date >= month_ago)
         
-        # Если нужны водители для фотоконтроля
-        photo_control_drivers = []
+        # Очередь фотоконтроля: отбор, статусы фото и счётчики - в SQL, с пагинацией
         if photo_control:
-            # Фильтруем тех, у кого есть загруженные фотографии, но нет верификации
-            drivers_with_photos = query.all()
-            
-            for driver in drivers_with_photos:
-                # Проверяем наличие фотографий
-                has_photos = False
-                passport_front = getattr(driver, "passport_front_path", None)
-                passport_back = getattr(driver, "passport_back_path", None)
-                license_front = getattr(driver, "license_front_path", None)
-                license_back = getattr(driver, "license_back_path", None)
-                
-                if passport_front or passport_back or license_front or license_back:
-                    has_photos = True
-                
-                if not has_photos:
-                    car = db.query(models.Car).filter(models.Car.driver_id == driver.id).first()
-                    if car and (car.photo_front or car.photo_rear or car.photo_right or 
-                               car.photo_left or car.photo_interior_front or car.photo_interior_rear):
-                        has_photos = True
-                
-                # Проверяем статус верификации
-                if has_photos:
-                    verifications = db.query(models.DriverVerification).filter(
-                        models.DriverVerification.driver_id == driver.id,
-                        models.DriverVerification.verification_type.like("photo_%")
-                    ).all()
-                    
-                    # Добавляем статусы верификации к данным водителя
-                    driver_dict = {
-                        "id": driver.id,
-                        "full_name": driver.full_name,
-                        "callsign": getattr(driver, "callsign", ""),
-                        "phone": getattr(driver, "phone", ""),
-                        "city": getattr(driver, "city", ""),
-                        "status": getattr(driver, "status", ""),
-                        "registration_date": getattr(driver, "registration_date", None)
-                    }
-                    
-                    if driver.registration_date:
-                        driver_dict["registration_date"] = driver.registration_date.strftime("%d.%m.%Y")
-                    
-                    # Если это водитель без верификации или с pending верификацией, добавляем его
-                    if not verifications or any(v.status == "pending" for v in verifications):
-                        driver_dict["photo_status"] = {v.verification_type.replace("photo_", ""): v.status for v in verifications}
-                        photo_control_drivers.append(driver_dict)
-            
-            # Считаем количество водителей по статусам
-            all_verifications = db.query(models.DriverVerification).filter(
-                models.DriverVerification.verification_type.like("photo_%")
-            ).all()
-            
-            pending_count = len([v for v in all_verifications if v.status == "pending"])
-            accepted_count = len([v for v in all_verifications if v.status == "accepted"])
-            rejected_count = len([v for v in all_verifications if v.status == "rejected"])
+            photo_control_drivers, total, page = crud.get_photo_control_page(db, query, page=page, per_page=page_size)
+            counts = crud.get_photo_verification_counts(db)
             
             # Вычисляем общий баланс
             total_balance = db.query(func.sum(models.Driver.balance)).scalar() or 0
             
             return {
                 "drivers": photo_control_drivers,
-                "total": len(photo_control_drivers),
-                "pending_count": pending_count,
-                "accepted_count": accepted_count,
-                "rejected_count": rejected_count,
+                "total": total,
+                "page": page,
+                "page_size": page_size,
+                "total_pages": ceil(total / page_size),
+                "pending_count": counts.get("pending", 0),
+                "accepted_count": counts.get("accepted", 0),
+                "rejected_count": counts.get("rejected", 0),
                 "total_balance": f"{total_balance:.0f}"
             }
         
@@ -1786,18 +1581,11 @@ async def search_drivers(
             return {"success": False, "detail": "Минимальная длина поискового запроса - 3 символа"}
         
         items_per_page = 10
-        search_term = f"%{query}%"
-        
-        # Поиск водителей
-        search_query = db.query(models.Driver).join(
-            models.Car, models.Driver.id == models.Car.driver_id, isouter=True
-        ).filter(
-            or_(
-                models.Driver.full_name.ilike(search_term),
-                models.Driver.callsign.ilike(search_term),
-                models.Driver.phone.ilike(search_term),
-                models.Car.license_plate.ilike(search_term)
-            )
+        
+        # Поиск водителей по индексу: номера автомобилей входят в текст водителя, JOIN с cars не нужен
+        search_query = search_index.apply(
+            db.query(models.Driver).options(selectinload(models.Driver.cars)),
+            db, ENTITY_DRIVER, models.Driver.id, query
         )
         
         # Подсчет общего количества найденных водителей
@@ -1849,25 +1637,18 @@ async def disp_create_driver(request: Request, db: Session = Depends(get_db)):
 @app.get("/disp/create_driver_step1", response_class=HTMLResponse)
 async def disp_create_driver_step1(request: Request, db: Session = Depends(get_db)):
     """Шаг 1: Персональные данные водителя"""
-    # Получаем всех водителей из БД для статистики
-    drivers = crud.get_drivers(db)
-    
-    # Расчет суммарного баланса всех водителей
-    total_balance = sum(driver.balance for driver in drivers) if drivers else 0
-    
-    # Получаем количество свободных и занятых водителей
-    available_drivers = len([d for d in drivers if getattr(d, 'is_busy', False) == False]) if drivers else 0
-    busy_drivers = len(drivers) - available_drivers if drivers else 0
+    # Статистика водителей одним агрегатом
+    stats = crud.get_drivers_stats(db)
     
     current_year = datetime.now().year
     
     template_data = {
         "request": request,
         "current_page": "create_driver",
-        "total_drivers": len(drivers) if drivers else 0,
-        "available_drivers": available_drivers,
-        "busy_drivers": busy_drivers,
-        "total_balance": f"{total_balance:.0f}",
+        "total_drivers": stats["total"],
+        "available_drivers": stats["available"],
+        "busy_drivers": stats["busy"],
+        "total_balance": f"{stats['balance']:.0f}",
         "current_year": current_year
     }
     
@@ -1876,25 +1657,18 @@ async def disp_create_driver_step1(request: Request, db: Session = Depends(get_d
 @app.get("/disp/create_driver_step2", response_class=HTMLResponse)
 async def disp_create_driver_step2(request: Request, db: Session = Depends(get_db)):
     """Шаг 2: Информация об автомобиле"""
-    # Получаем всех водителей из БД для статистики
-    drivers = crud.get_drivers(db)
-    
-    # Расчет суммарного баланса всех водителей
-    total_balance = sum(driver.balance for driver in drivers) if drivers else 0
-    
-    # Получаем количество свободных и занятых водителей
-    available_drivers = len([d for d in drivers if getattr(d, 'is_busy', False) == False]) if drivers else 0
-    busy_drivers = len(drivers) - available_drivers if drivers else 0
+    # Статистика водителей одним агрегатом
+    stats = crud.get_drivers_stats(db)
     
     current_year = datetime.now().year
     
     template_data = {
         "request": request,
         "current_page": "create_driver",
-        "total_drivers": len(drivers) if drivers else 0,
-        "available_drivers": available_drivers,
-        "busy_drivers": busy_drivers,
-        "total_balance": f"{total_balance:.0f}",
+        "total_drivers": stats["total"],
+        "available_drivers": stats["available"],
+        "busy_drivers": stats["busy"],
+        "total_balance": f"{stats['balance']:.0f}",
         "current_year": current_year
     }
     
@@ -1903,25 +1677,18 @@ async def disp_create_driver_step2(request: Request, db: Session = Depends(get_d
 @app.get("/disp/create_driver_step3", response_class=HTMLResponse)
 async def disp_create_driver_step3(request: Request, db: Session = Depends(get_db)):
     """Шаг 3: Фотографии автомобиля"""
-    # Получаем всех водителей из БД для статистики
-    drivers = crud.get_drivers(db)
-    
-    # Расчет суммарного баланса всех водителей
-    total_balance = sum(driver.balance for driver in drivers) if drivers else 0
-    
-    # Получаем количество свободных и занятых водителей
-    available_drivers = len([d for d in drivers if getattr(d, 'is_busy', False) == False]) if drivers else 0
-    busy_drivers = len(drivers) - available_drivers if drivers else 0
+    # Статистика водителей одним агрегатом
+    stats = crud.get_drivers_stats(db)
     
     current_year = datetime.now().year
     
     template_data = {
         "request": request,
         "current_page": "create_driver",
-        "total_drivers": len(drivers) if drivers else 0,
-        "available_drivers": available_drivers,
-        "busy_drivers": busy_drivers,
-        "total_balance": f"{total_balance:.0f}",
+        "total_drivers": stats["total"],
+        "available_drivers": stats["available"],
+        "busy_drivers": stats["busy"],
+        "total_balance": f"{stats['balance']:.0f}",
         "current_year": current_year
     }
     
@@ -4078,6 +3845,26 @@ async def driver_data_page(request: Request, db: Session = Depends(get_db), toke
         print(f"Ошибка при загрузке страницы личных данных: {str(e)}")
         return HTMLResponse(content=f"Произошла ошибка: {str(e)}", status_code=500)
 
+# Заказов на странице истории активности водителя
+ACTIVITY_PAGE_SIZE = 50
+
+def format_activity_order(order: models.Order) -> dict:
+    """Заказ для истории активности водителя (шаблон и /api/driver/{id}/activity)"""
+    return {
+        'id': order.id,
+        'date_str': order.created_at.strftime("%d.%m.%Y"),  # Дата для группировки
+        'time_str': order.created_at.strftime("%H:%M"),
+        'origin': order.origin,
+        'destination': order.destination,
+        'price': order.price,
+        'price_formatted': f"{order.price:.0f}" if order.price else "0",
+        'status': order.status,
+        'payment_type': getattr(order, 'payment_type', 'cash'),
+        'distance': getattr(order, 'distance', '0'),
+        'duration': getattr(order, 'duration', '0 мин'),
+        'tariff': getattr(order, 'tariff', 'Стандарт')
+    }
+
 @app.get("/driver/activity", response_class=HTMLResponse, name="driver_activity_page")
 async def driver_activity_page(request: Request, db: Session = Depends(get_db), token: Optional[str] = Cookie(None)):
     """Страница истории активности водителя"""
@@ -4104,48 +3891,17 @@ async def driver_activity_page(request: Request, db: Session = Depends(get_db),
         if not driver:
             return RedirectResponse(url="/driver/survey/1")
         
-        # Получаем заказы водителя за последнюю неделю
+        # Первая страница заказов водителя за последнюю неделю, остальные догружает /api/driver/{id}/activity
         week_ago = datetime.now() - timedelta(days=7)
-        orders = db.query(models.Order).filter(
-            models.Order.driver_id == driver.id,
-            models.Order.created_at >= week_ago
-        ).order_by(models.Order.created_at.desc()).all()
-        
-        # Форматируем заказы для отображения
-        formatted_orders = []
-        for order in orders:
-            # Дата для группировки
-            order_date = order.created_at.date()
-            date_str = order_date.strftime("%d.%m.%Y")
-            
-            # Время заказа
-            time_str = order.created_at.strftime("%H:%M")
-            
-            # Форматируем цену
-            price_formatted = f"{order.price:.0f}" if hasattr(order, 'price') and order.price else "0"
-            
-            # Добавляем заказ в список
-            formatted_orders.append({
-                'id': order.id,
-                'date_str': date_str,
-                'time_str': time_str,
-                'origin': order.origin,
-                'destination': order.destination,
-                'price': order.price,
-                'price_formatted': price_formatted,
-                'status': order.status,
-                'payment_type': getattr(order, 'payment_type', 'cash'),
-                'distance': getattr(order, 'distance', '0'),
-                'duration': getattr(order, 'duration', '0 мин'),
-                'tariff': getattr(order, 'tariff', 'Стандарт')
-            })
+        page = crud.get_driver_activity_page(db, driver.id, since=week_ago, limit=ACTIVITY_PAGE_SIZE)
         
         # Формируем данные для шаблона
         template_data = {
             "request": request,
             "user": user,
             "driver": driver,
-            "orders": formatted_orders
+            "orders": [format_activity_order(order) for order in page.items],
+            "next_cursor": page.next_cursor
         }
         
         return templates.TemplateResponse("driver/profile/activity.html", template_data)
@@ -4160,9 +3916,11 @@ async def driver_activity_page(request: Request, db: Session = Depends(get_db),
 async def get_driver_activity(
     driver_id: str, 
     period: str = Query("week", regex="^(week|month|all)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(ACTIVITY_PAGE_SIZE, ge=1, le=200),
     db: Session = Depends(get_db)
 ):
-    """API для получения истории заказов водителя"""
+    """API для получения истории заказов водителя: страницы по (created_at, id), следующая - по next_cursor"""
     try:
         # Проверяем, существует ли водитель
         driver = db.query(models.Driver).filter(models.Driver.id == driver_id).first()
@@ -4176,52 +3934,21 @@ async def get_driver_activity(
         elif period == "month":
             start_date = datetime.now() - timedelta(days=30)
         
-        # Запрос заказов
-        query = db.query(models.Order).filter(models.Order.driver_id == driver.id)
-        
-        # Применяем фильтр по дате, если указан период
-        if start_date:
-            query = query.filter(models.Order.created_at >= start_date)
-        
-        # Получаем отсортированные заказы
-        orders = query.order_by(models.Order.created_at.desc()).all()
-        
-        # Форматируем заказы
-        formatted_orders = []
-        for order in orders:
-            # Дата для группировки
-            order_date = order.created_at.date()
-            date_str = order_date.strftime("%d.%m.%Y")
-            
-            # Время заказа
-            time_str = order.created_at.strftime("%H:%M")
-            
-            # Форматируем цену
-            price_formatted = f"{order.price:.0f}" if hasattr(order, 'price') and order.price else "0"
-            
-            # Добавляем заказ в список
-            formatted_orders.append({
-                'id': order.id,
-                'date_str': date_str,
-                'time_str': time_str,
-                'origin': order.origin,
-                'destination': order.destination,
-                'price': order.price,
-                'price_formatted': price_formatted,
-                'status': order.status,
-                'payment_type': getattr(order, 'payment_type', 'cash'),
-                'distance': getattr(order, 'distance', '0'),
-                'duration': getattr(order, 'duration', '0 мин'),
-                'tariff': getattr(order, 'tariff', 'Стандарт')
-            })
+        # Страница заказов за период; total_count - оценка по всему периоду (без COUNT(*) в PostgreSQL)
+        page = crud.get_driver_activity_page(
+            db, driver.id, since=start_date, cursor=cursor, limit=limit, with_total=not cursor
+        )
         
         return {
             "success": True,
-            "orders": formatted_orders,
-            "total_count": len(formatted_orders),
+            "orders": [format_activity_order(order) for order in page.items],
+            "next_cursor": page.next_cursor,
+            "total_count": page.total,
             "period": period
         }
         
+    except InvalidCursor as e:
+        return {"success": False, "message": str(e)}
     except Exception as e:
         print(f"Ошибка при получении истории активности: {str(e)}")
         return {"success": False, "message": str(e)}
@@ -4452,6 +4179,8 @@ async def update_driver_tariff(request: Request, db: Session = Depends(get_db)):
             car.tariff = tariff
         
         db.commit()
+        # Следующее обновление позиции заново прочитает тариф водителя из БД
+        driver_index.remove(driver.id)
         
         return {
             "success": True, 
@@ -5741,82 +5470,22 @@ async def verify_driver_photo(
         )
 
 def extract_coordinates_from_plus_code(address: str):
-    """Извлекает приблизительные координаты из Plus кодов для Газалкента"""
+    """
+    Координаты центра Plus кода (Open Location Code) из адреса.
+
+    Короткий код (HQCQ+XCV) восстанавливается относительно населённого
+    пункта, названного в адресе, или центра города из настроек.
+    """
     if not address:
         return None, None
-        
-    # Ищем Plus код в адресе (формат: XXXX+XXX)
-    plus_code_match = re.search(r'([A-Z0-9]{4}\+[A-Z0-9]{2,3})', address.upper())
-    if not plus_code_match:
+
+    try:
+        lat, lng = plus_codes.coordinates_from_text(address)
+    except ValueError as e:
+        logger.warning(f"⚠️ Некорректный Plus код в адресе '{address}': {e}")
         return None, None
-    
-    plus_code = plus_code_match.group(1)
-    logger.info(f"📍 Найден Plus код: {plus_code}")
-    
-    # ПРАВИЛЬНЫЕ координаты для основных Plus кодов
-    plus_code_coords = {
-        # Газалкент, Узбекистан (HQXX) - ИСПРАВЛЕННЫЕ КООРДИНАТЫ!
-        'HQCQ+XCV': (41.6201, 69.9184),  # Газалкент близко к Ташкенту
-        'HQCR+P7X': (41.6215, 69.9225),  # Газалкент близко к Ташкенту  
-        'HQ9R+Q7H': (41.6195, 69.9155),  # Газалкент близко к Ташкенту
-        'HQ9Q+P98': (41.6180, 69.9140),  # Газалкент близко к Ташкенту
-        'HQCQ+': (41.62, 69.92),   # Базовые координаты для HQCQ+
-        'HQCR+': (41.62, 69.92),   # Базовые координаты для HQCR+
-        'HQ9R+': (41.62, 69.91),   # Базовые координаты для HQ9R+
-        'HQ9Q+': (41.618, 69.914), # Базовые координаты для HQ9Q+
-        'HQ9V+': (41.615, 69.925), # Базовые координаты для HQ9V+
-        
-        # Ош, Кыргызстан (GPXX)
-        'GP2Q+VX': (40.515000, 72.800000),   # Ош центр
-        'GP32+65': (40.505000, 72.801000),   # Ош район
-        'GP2Q+': (40.515, 72.80),            # Базовые для GP2Q+
-        'GP32+': (40.505, 72.801),           # Базовые для GP32+
-        
-        # Другие районы Кыргызстана (GRXX, HVXX)
-        'GRMW+4G': (40.500000, 72.950000),   # Медресе район
-        'HV2G+9XR': (40.520000, 72.980000),  # Кыргыз-Чек
-        'GRMW+': (40.50, 72.95),             # Базовые для GRMW+
-        'HV2G+': (40.52, 72.98),             # Базовые для HV2G+
-    }
-    
-    # Точное совпадение
-    if plus_code in plus_code_coords:
-        lat, lng = plus_code_coords[plus_code]
-        logger.info(f"📍 Точное совпадение Plus кода {plus_code}: {lat}, {lng}")
-        return lat, lng
-    
-    # Приблизительное совпадение по первым 4 символам
-    base_code = plus_code[:5]  # HQCQ+, HQCR+, etc.
-    if base_code in plus_code_coords:
-        lat, lng = plus_code_coords[base_code]
-        # Добавляем небольшую случайность для уникальности
-        lat += (random.random() - 0.5) * 0.001  # ±50 метров
-        lng += (random.random() - 0.5) * 0.001
-        logger.info(f"📍 Приблизительное совпадение Plus кода {plus_code} -> {base_code}: {lat}, {lng}")
-        return lat, lng
-    
-    # Если не найдено точного совпадения, используем координаты в зависимости от префикса
-    if plus_code.startswith('HQ'):
-        # Газалкент, Узбекистан (близко к Ташкенту!)
-        lat = 41.62 + (random.random() - 0.5) * 0.01
-        lng = 69.92 + (random.random() - 0.5) * 0.01
-        logger.info(f"📍 Использованы общие координаты Газалкента для {plus_code}: {lat}, {lng}")
-    elif plus_code.startswith('GP'):
-        # Ош, Кыргызстан
-        lat = 40.51 + (random.random() - 0.5) * 0.01
-        lng = 72.80 + (random.random() - 0.5) * 0.01
-        logger.info(f"📍 Использованы общие координаты Оша для {plus_code}: {lat}, {lng}")
-    elif plus_code.startswith('GR') or plus_code.startswith('HV'):
-        # Другие районы Кыргызстана
-        lat = 40.50 + (random.random() - 0.5) * 0.02
-        lng = 72.90 + (random.random() - 0.5) * 0.10
-        logger.info(f"📍 Использованы общие координаты Кыргызстана для {plus_code}: {lat}, {lng}")
-    else:
-        # По умолчанию - Газалкент (близко к Ташкенту!)
-        lat = 41.62 + (random.random() - 0.5) * 0.01
-        lng = 69.92 + (random.random() - 0.5) * 0.01
-        logger.info(f"📍 Использованы координаты по умолчанию для {plus_code}: {lat}, {lng}")
-    
+    if lat is not None:
+        logger.info(f"📍 Plus код в адресе '{address}': {lat:.6f}, {lng:.6f}")
     return lat, lng
 
 @app.post("/api/admin/orders/")
@@ -5990,16 +5659,8 @@ async def get_orders_for_map(
         if status:
             query = query.filter(models.Order.status == status)
             
-        if search:
-            search_filter = or_(
-                models.Order.order_number.ilike(f"%{search}%"),
-                models.Order.origin.ilike(f"%{search}%"),
-                models.Order.destination.ilike(f"%{search}%"),
-                models.Driver.first_name.ilike(f"%{search}%"),
-                models.Driver.last_name.ilike(f"%{search}%"),
-                models.Driver.phone.ilike(f"%{search}%")
-            )
-            query = query.filter(search_filter)
+        # Поиск по индексу: номер и адреса заказа, ФИО и телефон водителя
+        query = search_index.apply(query, db, ENTITY_ORDER, models.Order.id, search, ranked=False)
             
         # Фильтры по дате
         if date and date != 'all':
@@ -6030,6 +5691,13 @@ async def get_orders_for_map(
         # Получаем заказы
         orders = query.order_by(models.Order.created_at.desc()).limit(50).all()
         
+        # Позиции водителей - из памяти воркера или из БД, что новее
+        # (в БД они попадают с задержкой пакетной записи, зато от всех воркеров)
+        driver_positions = {
+            order.driver_id: location_store.latest(order.driver)
+            for order in orders if order.driver_id and order.driver is not None
+        }
+        
         # Формируем данные для карты
         orders_data = []
         for order in orders:
@@ -6039,8 +5707,10 @@ async def get_orders_for_map(
                 "origin": order.origin,
                 "destination": order.destination,
                 "status": order.status or "Выполняется",
-                "driver_name": f"{order.driver.first_name} {order.driver.last_name}",
+                "driver_name": order.driver.full_name,
                 "driver_phone": order.driver.phone or "",
+                "driver_lat": driver_positions[order.driver_id]['lat'] if driver_positions.get(order.driver_id) else None,
+                "driver_lng": driver_positions[order.driver_id]['lng'] if driver_positions.get(order.driver_id) else None,
                 "price": str(order.price) if order.price else "",
                 "tariff": order.tariff or order.driver.tariff or "",
                 "time": order.time,
@@ -6112,6 +5782,11 @@ async def cancel_order(
         # Сохраняем изменения
         db.commit()
         db.refresh(order)
+        if order.driver_id:
+            driver_index.set_busy(order.driver_id, False)
+            trip_tracks.finish(order.id)
+            forget_route(order.id)
+        notify_order_cancelled(order)
         
         logger.info(f"✅ Заказ #{order.order_number} (ID: {order_id}) успешно отменен")
         
@@ -6141,17 +5816,49 @@ async def decline_order_by_driver(
     driver_id: int,
     order_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Отклонение заказа водителем"""
     try:
         logger.info(f"🚫 Водитель {driver_id} отклоняет заказ {order_id}")
         
         # Получаем заказ из БД
-        order = db.query(models.Order).filter(
+        order = await db.scalar(select(models.Order).where(
             models.Order.id == order_id,
             models.Order.driver_id == driver_id
-        ).first()
+        ))
+        
+        # Предложение диспетчера или заказ без водителя из резервного подбора: заказ остаётся
+        # (или возвращается) в ожидании, этому водителю диспетчер его больше не предлагает
+        is_offer = order is not None and order.status == OFFERED_ORDER_STATUS and order.offer_expires_at is not None
+        if is_offer or order is None:
+            if is_offer:
+                released = (await db.execute(release_offer(order_id, driver_id))).rowcount
+            else:
+                released = 0
+                order = await db.scalar(select(models.Order).where(
+                    models.Order.id == order_id,
+                    models.Order.driver_id.is_(None),
+                    models.Order.status.in_(PENDING_ORDER_STATUSES)
+                ))
+            if released or order is not None:
+                if await db.get(models.OrderOfferDecline, (order_id, driver_id)) is None:
+                    db.add(models.OrderOfferDecline(order_id=order_id, driver_id=driver_id))
+                await db.commit()
+                dispatch_engine.decline(driver_id, order_id)
+                if released:
+                    # UPDATE в обход ORM: день заказа в сводках аналитики отмечаем сами
+                    analytics_rollup.mark(order_ids=[order_id])
+                    order_events.publish_order(await load_order_state(db, order))
+                return JSONResponse(
+                    status_code=200,
+                    content={
+                        "success": True,
+                        "message": "Предложение отклонено",
+                        "order_id": order_id,
+                        "new_status": PENDING_ORDER_STATUSES[0] if released else order.status
+                    }
+                )
         
         if not order:
             return JSONResponse(
@@ -6180,7 +5887,7 @@ async def decline_order_by_driver(
         order.notes = f"{current_notes}\n[ОТКЛОНЕН ВОДИТЕЛЕМ] {datetime.now().strftime('%d.%m.%Y %H:%M')}".strip()
         
         # Уменьшаем активность водителя на 10 баллов
-        driver = db.query(models.Driver).filter(models.Driver.id == driver_id).first()
+        driver = await db.get(models.Driver, driver_id)
         if driver:
             current_activity = getattr(driver, 'activity', 50) or 50
             new_activity = max(0, current_activity - 10)
@@ -6188,8 +5895,9 @@ async def decline_order_by_driver(
             logger.info(f"📉 Активность водителя {driver_id}: {current_activity} -> {new_activity}")
         
         # Сохраняем изменения
-        db.commit()
-        db.refresh(order)
+        await db.commit()
+        order = await load_order_state(db, order)
+        order_events.publish_order(order)
         
         logger.info(f"✅ Заказ #{order.order_number} отклонен водителем {driver_id}")
         
@@ -6206,7 +5914,7 @@ async def decline_order_by_driver(
         
     except Exception as e:
         logger.error(f"❌ Ошибка отклонения заказа {order_id} водителем {driver_id}: {e}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(
             status_code=500,
             content={
@@ -6220,17 +5928,23 @@ async def accept_order_by_driver(
     driver_id: int,
     order_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Принятие заказа водителем"""
     try:
         logger.info(f"✅ Водитель {driver_id} принимает заказ {order_id}")
         
         # Получаем заказ из БД
-        order = db.query(models.Order).filter(
+        order = await db.scalar(select(models.Order).where(
             models.Order.id == order_id,
             models.Order.driver_id == driver_id
-        ).first()
+        ))
+        
+        # Заказ без водителя (резервный подбор предлагает его нескольким водителям)
+        # достаётся первому принявшему: условный UPDATE срабатывает только у одного
+        if not order:
+            if (await db.execute(claim_order(order_id, driver_id))).rowcount:
+                order = await db.get(models.Order, order_id)
         
         if not order:
             return JSONResponse(
@@ -6253,13 +5967,15 @@ async def accept_order_by_driver(
         
         # Обновляем статус заказа
         order.status = "Выполняется"
+        order.offer_expires_at = None
+        await db.execute(delete(models.OrderOfferDecline).where(models.OrderOfferDecline.order_id == order_id))
         
         # Добавляем информацию в примечания
         current_notes = order.notes or ""
         order.notes = f"{current_notes}\n[ПРИНЯТ ВОДИТЕЛЕМ] {datetime.now().strftime('%d.%m.%Y %H:%M')}".strip()
         
         # Увеличиваем активность водителя на 4 балла и списываем комиссию
-        driver = db.query(models.Driver).filter(models.Driver.id == driver_id).first()
+        driver = await db.get(models.Driver, driver_id)
         if driver:
             # Обновляем активность
             current_activity = getattr(driver, 'activity', 50) or 50
@@ -6270,7 +5986,7 @@ async def accept_order_by_driver(
             # ✅ НОВОЕ: Списываем 10% комиссию с баланса водителя
             current_balance = getattr(driver, 'balance', 0) or 0
             order_price = order.price or 0
-            commission = round(order_price * 0.10)  # 10% комиссия
+            commission = round(order_price * settings.ORDER_COMMISSION_RATE)  # 10% комиссия
             new_balance = current_balance - commission
             
             # Записываем транзакцию о списании комиссии
@@ -6291,8 +6007,13 @@ async def accept_order_by_driver(
             logger.info(f"💰 Баланс водителя {driver_id}: {current_balance} -> {new_balance} сом")
         
         # Сохраняем изменения
-        db.commit()
-        db.refresh(order)
+        await db.commit()
+        order = await load_order_state(db, order)
+        driver_index.set_busy(driver_id, True)
+        dispatch_engine.accept(driver_id, order_id)
+        notify_trip_update(order)
+        if not order.route_polyline:
+            schedule_route_fetch(order.id)
         
         logger.info(f"✅ Заказ #{order.order_number} принят водителем {driver_id}")
         
@@ -6309,7 +6030,7 @@ async def accept_order_by_driver(
         
     except Exception as e:
         logger.error(f"❌ Ошибка принятия заказа {order_id} водителем {driver_id}: {e}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(
             status_code=500,
             content={
@@ -6318,22 +6039,143 @@ async def accept_order_by_driver(
             }
         )
 
+def serialize_order_offer(order: models.Order, distance_km: Optional[float] = None) -> Dict[str, Any]:
+    """Заказ в формате предложения водителю (опрос new-orders и WebSocket)"""
+    return {
+        "id": order.id,
+        "order_number": order.order_number,
+        "origin": order.origin,
+        "destination": order.destination,
+        "status": order.status,
+        "price": order.price,
+        "tariff": order.tariff,
+        "notes": order.notes,
+        "time": order.time,
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+        "origin_lat": order.origin_lat,
+        "origin_lng": order.origin_lng,
+        "destination_lat": order.destination_lat,
+        "destination_lng": order.destination_lng,
+        "distance_to_pickup": f"{distance_km:.1f} км" if distance_km is not None else None
+    }
+
+async def load_order_state(db: AsyncSession, order: models.Order) -> models.Order:
+    """
+    Перечитывает заказ после commit вместе с водителем и его машинами.
+    order_state() читает order.driver и driver.cars уже вне сессии, а ленивая
+    загрузка в асинхронной сессии падает с MissingGreenlet.
+    """
+    return await db.scalar(
+        select(models.Order).where(models.Order.id == order.id)
+        .options(selectinload(models.Order.driver).selectinload(models.Driver.cars))
+        .execution_options(populate_existing=True)
+    )
+
+def notify_trip_update(order: models.Order) -> None:
+    """Push водителю и пассажиру об изменении статуса заказа"""
+    order_events.publish_order(order)
+    driver_connections.notify(order.driver_id, {
+        "type": "trip_update",
+        "order_id": order.id,
+        "status": order.status
+    })
+
+def notify_order_cancelled(order: models.Order) -> None:
+    """Push об отмене заказа пассажиру и назначенному водителю (или водителю с предложением)"""
+    order_events.publish_order(order)
+    driver_connections.notify(order.driver_id, {
+        "type": "order_cancelled",
+        "order_id": order.id,
+        "status": order.status
+    })
+
+async def push_dispatch_offers(assignments: List[tuple], expired: List[tuple]) -> None:
+    """
+    Рассылка предложений и истёкших предложений диспетчера водителям.
+
+    Такты ведёт один воркер-лидер, а водители подключены к разным воркерам:
+    событие для водителя не отсюда уходит через cluster_bus
+    """
+    messages = [
+        (driver_id, {"type": "offer_expired", "order_id": order_id})
+        for driver_id, order_id in expired
+    ]
+    
+    if assignments:
+        distances = {order_id: distance for order_id, _, distance in assignments}
+        
+        def load_offers() -> Dict[int, Dict[str, Any]]:
+            db = SessionLocal()
+            try:
+                # Предложение ещё действует: заказ не принят и не отменён после такта
+                orders = db.query(models.Order).filter(
+                    models.Order.id.in_(list(distances)),
+                    models.Order.status == OFFERED_ORDER_STATUS
+                ).all()
+                return {order.id: serialize_order_offer(order, distances[order.id]) for order in orders}
+            finally:
+                db.close()
+        
+        offers = await asyncio.to_thread(load_offers)
+        for order_id, driver_id, _ in assignments:
+            if order_id in offers:
+                messages.append((driver_id, {
+                    "type": "offer",
+                    "order": offers[order_id],
+                    "expires_in": settings.DISPATCH_OFFER_TTL
+                }))
+    
+    if messages:
+        await asyncio.gather(*(driver_connections.deliver(driver_id, message) for driver_id, message in messages))
+
 @app.get("/api/driver/{driver_id}/new-orders", response_class=JSONResponse)
-async def get_new_orders_for_driver(driver_id: int, db: Session = Depends(get_db)):
+async def get_new_orders_for_driver(driver_id: int, db: AsyncSession = Depends(get_async_db)):
     """Получение новых заказов для водителя"""
     try:
-        # Получаем заказы назначенные этому водителю
-        new_orders = db.query(models.Order).filter(
+        # Заказы, назначенные этому водителю: вручную или предложением диспетчера (его выдаёт любой воркер)
+        new_orders = list(await db.scalars(select(models.Order).where(
             models.Order.driver_id == driver_id,
-            models.Order.status.in_(["Ожидает водителя", "Назначен"])
-        ).order_by(models.Order.created_at.desc()).limit(1).all()
-        
-        # Альтернативный поиск заказов без назначенного водителя
-        if not new_orders:
-            new_orders = db.query(models.Order).filter(
+            models.Order.status.in_(["Ожидает водителя", OFFERED_ORDER_STATUS]),
+            or_(models.Order.offer_expires_at.is_(None), models.Order.offer_expires_at >= datetime.now())
+        ).order_by(models.Order.created_at.desc()).limit(1)))
+        
+        distances = {}
+        if new_orders:
+            order = new_orders[0]
+            entry = driver_index.get(driver_id)
+            if entry and order.origin_lat is not None and order.origin_lng is not None:
+                distances[order.id] = calculate_distance(entry['lat'], entry['lng'], order.origin_lat, order.origin_lng)
+        else:
+            # Резервный подбор (и при включённом диспетчере): заказы без водителя предлагаем
+            # ближайшим свободным водителям, кроме отказавшихся. Принимает первый
+            pending_orders = await db.scalars(select(models.Order).where(
                 models.Order.status == "Ожидает водителя",
-                models.Order.driver_id.is_(None)
-            ).order_by(models.Order.created_at.desc()).limit(1).all()
+                models.Order.driver_id.is_(None),
+                ~exists().where(
+                    models.OrderOfferDecline.order_id == models.Order.id,
+                    models.OrderOfferDecline.driver_id == driver_id
+                )
+            ).order_by(models.Order.created_at.desc()).limit(20))
+            
+            for order in pending_orders:
+                if order.origin_lat is None or order.origin_lng is None:
+                    # Без координат подачи ближайших не определить - предлагаем всем
+                    new_orders = [order]
+                    break
+                
+                nearest = driver_index.nearest(
+                    order.origin_lat, order.origin_lng,
+                    k=settings.ORDER_OFFER_CANDIDATES,
+                    tariff=order.tariff
+                )
+                nearest_ids = [candidate_id for candidate_id, _ in nearest]
+                
+                # Если рядом нет ни одного подходящего водителя, заказ не должен простаивать
+                if not nearest or driver_id in nearest_ids:
+                    new_orders = [order]
+                    if driver_id in nearest_ids:
+                        distances[order.id] = dict(nearest)[driver_id]
+                    break
         
         logger.info(f"📋 Найдено заказов для водителя {driver_id}: {len(new_orders)}")
         
@@ -6341,25 +6183,7 @@ async def get_new_orders_for_driver(driver_id: int, db: Session = Depends(get_db
             status_code=200,
             content={
                 "success": True,
-                "orders": [
-                    {
-                        "id": order.id,
-                        "order_number": order.order_number,
-                        "origin": order.origin,
-                        "destination": order.destination,
-                        "status": order.status,
-                        "price": order.price,
-                        "tariff": order.tariff,
-                        "notes": order.notes,
-                        "time": order.time,
-                        "created_at": order.created_at.isoformat() if order.created_at else None,
-                        "origin_lat": order.origin_lat,
-                        "origin_lng": order.origin_lng,
-                        "destination_lat": order.destination_lat,
-                        "destination_lng": order.destination_lng
-                    }
-                    for order in new_orders
-                ]
+                "orders": [serialize_order_offer(order, distances.get(order.id)) for order in new_orders]
             }
         )
         
@@ -6377,13 +6201,13 @@ async def get_new_orders_for_driver(driver_id: int, db: Session = Depends(get_db
 
 
 @app.post("/api/driver/{driver_id}/start-trip/{order_id}", response_class=JSONResponse)
-async def start_trip(driver_id: int, order_id: int, db: Session = Depends(get_db)):
+async def start_trip(driver_id: int, order_id: int, db: AsyncSession = Depends(get_async_db)):
     """Водитель начинает поездку"""
     try:
-        order = db.query(models.Order).filter(
+        order = await db.scalar(select(models.Order).where(
             models.Order.id == order_id,
             models.Order.driver_id == driver_id
-        ).first()
+        ))
         
         if not order:
             raise HTTPException(status_code=404, detail="Заказ не найден")
@@ -6392,7 +6216,9 @@ async def start_trip(driver_id: int, order_id: int, db: Session = Depends(get_db
             raise HTTPException(status_code=400, detail="Заказ не может быть начат")
         
         order.status = "Выполняется"
-        db.commit()
+        await db.commit()
+        order = await load_order_state(db, order)
+        notify_trip_update(order)
         
         logger.info(f"✅ Водитель {driver_id} начал поездку по заказу {order_id}")
         
@@ -6409,21 +6235,21 @@ async def start_trip(driver_id: int, order_id: int, db: Session = Depends(get_db
         raise
     except Exception as e:
         logger.error(f"❌ Ошибка начала поездки {order_id}: {e}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(
             status_code=500,
             content={"success": False, "error": str(e)}
         )
 
 @app.get("/api/driver/{driver_id}/active-trip", response_class=JSONResponse)
-async def get_active_trip(driver_id: int, db: Session = Depends(get_db)):
+async def get_active_trip(driver_id: int, db: AsyncSession = Depends(get_async_db)):
     """Получение активной поездки водителя для восстановления состояния"""
     try:
         # Ищем активный заказ водителя
-        active_order = db.query(models.Order).filter(
+        active_order = await db.scalar(select(models.Order).where(
             models.Order.driver_id == driver_id,
             models.Order.status.in_(["Принят", "Выполняется"])
-        ).first()
+        ))
         
         if not active_order:
             return JSONResponse(
@@ -6459,12 +6285,78 @@ async def get_active_trip(driver_id: int, db: Session = Depends(get_db)):
             content={"success": False, "error": str(e)}
         )
 
+async def _call_driver_handler(handler, *args) -> Dict[str, Any]:
+    """Вызов HTTP-обработчика водителя из WebSocket с отдельной асинхронной сессией БД"""
+    async with AsyncSessionLocal() as db:
+        response = await handler(*args, db=db)
+        return json.loads(response.body)
+
+@app.websocket("/ws/driver/{driver_id}")
+async def driver_websocket(websocket: WebSocket, driver_id: int):
+    """
+    Канал событий водителя: предложения заказов, отмены и изменения поездки.
+    
+    Сервер -> клиент: hello, offer, offer_expired, order_cancelled, trip_update, ping, result
+    Клиент -> сервер: {"type": "accept"|"decline", "order_id": ...}, {"type": "pong"}
+    
+    Если соединение недоступно, клиент продолжает опрос /api/driver/{driver_id}/new-orders.
+    """
+    if not await driver_connections.connect(driver_id, websocket):
+        return
+    
+    try:
+        # После (пере)подключения отдаём текущее состояние, чтобы клиент не пропустил события
+        trip = (await _call_driver_handler(get_active_trip, driver_id)).get("trip")
+        offers = (await _call_driver_handler(get_new_orders_for_driver, driver_id)).get("orders", [])
+        await websocket.send_json({
+            "type": "hello",
+            "trip": trip,
+            "offer": offers[0] if offers and not trip else None,
+            "ping_interval": settings.DRIVER_WS_PING_INTERVAL
+        })
+        
+        last_seen = time.monotonic()
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive_json(), timeout=settings.DRIVER_WS_PING_INTERVAL)
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_seen > settings.DRIVER_WS_TIMEOUT:
+                    logger.info(f"⏱️ Водитель {driver_id} не отвечает, закрываем WebSocket")
+                    await websocket.close(code=1001)
+                    break
+                await websocket.send_json({"type": "ping"})
+                continue
+            except (ValueError, KeyError):
+                # Не JSON - игнорируем, но считаем признаком жизни
+                last_seen = time.monotonic()
+                continue
+            
+            last_seen = time.monotonic()
+            message_type = message.get("type") if isinstance(message, dict) else None
+            
+            if message_type in ("accept", "decline"):
+                order_id = message.get("order_id")
+                if not isinstance(order_id, int):
+                    await websocket.send_json({"type": "result", "action": message_type, "success": False, "error": "Не указан order_id"})
+                    continue
+                handler = accept_order_by_driver if message_type == "accept" else decline_order_by_driver
+                result = await _call_driver_handler(handler, driver_id, order_id, None)
+                await websocket.send_json({"type": "result", "action": message_type, "order_id": order_id, **result})
+            elif message_type == "ping":
+                await websocket.send_json({"type": "pong"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"❌ Ошибка WebSocket водителя {driver_id}: {e}")
+    finally:
+        driver_connections.disconnect(driver_id, websocket)
+
 @app.post("/api/driver/{driver_id}/complete-trip/{order_id}", response_class=JSONResponse)
 async def complete_trip(
     driver_id: int, 
     order_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Завершение поездки с расчетом оплаты по проценту выполнения"""
     try:
@@ -6473,10 +6365,10 @@ async def complete_trip(
         rating = body.get('rating', 5)
         
         # Получаем заказ
-        order = db.query(models.Order).filter(
+        order = await db.scalar(select(models.Order).where(
             models.Order.id == order_id,
             models.Order.driver_id == driver_id
-        ).first()
+        ))
         
         if not order:
             return JSONResponse(
@@ -6506,7 +6398,7 @@ async def complete_trip(
         order.notes = (order.notes or "") + f"\n[ЗАВЕРШЕН] {completion_percentage}% маршрута. Оценка: {rating}⭐"
         
         # Обновляем активность водителя
-        driver = db.query(models.Driver).filter(models.Driver.id == driver_id).first()
+        driver = await db.get(models.Driver, driver_id)
         activity_gain = 0
         new_activity = 50
         new_balance = 0
@@ -6529,8 +6421,12 @@ async def complete_trip(
             logger.info(f"💰 Водитель {driver_id}: +{final_price} СОМ, активность {current_activity} -> {new_activity}")
         
         # Сохраняем изменения
-        db.commit()
-        db.refresh(order)
+        await db.commit()
+        order = await load_order_state(db, order)
+        driver_index.set_busy(driver_id, False)
+        trip_tracks.finish(order.id)
+        forget_route(order.id)
+        notify_trip_update(order)
         
         logger.info(f"🏁 Поездка завершена: заказ #{order.order_number}, {completion_percentage}%, {final_price} СОМ")
         logger.info(f"💰 Водитель {driver_id}: активность {new_activity}, баланс {new_balance}")
@@ -6554,7 +6450,7 @@ async def complete_trip(
         logger.error(f"❌ Ошибка завершения поездки {order_id}: {e}")
         import traceback
         logger.error(f"❌ Полная ошибка: {traceback.format_exc()}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(
             status_code=500,
             content={
@@ -6752,6 +6648,14 @@ async def cancel_order(order_id: int, request: CancelOrderRequest, db: Session =
             logger.info(f"📝 Причина отмены: {request.reason}")
         
         db.commit()
+        if order.driver_id:
+            driver_index.set_busy(order.driver_id, False)
+            trip_tracks.finish(order.id)
+            forget_route(order.id)
+        if request.cancelled_by != "driver":
+            notify_order_cancelled(order)
+        else:
+            order_events.publish_order(order)
         
         return JSONResponse(
             status_code=200,
@@ -6809,6 +6713,79 @@ async def get_order_status(order_id: int, db: Session = Depends(get_db)):
             content={"success": False, "error": f"Ошибка сервера: {str(e)}"}
         )
 
+@app.get("/api/orders/{order_id}/events")
+async def stream_order_events(order_id: int, request: Request):
+    """
+    SSE-поток заказа для пассажира: snapshot, status, location.
+    
+    Поддерживает возобновление по заголовку Last-Event-ID. Изменения, сделанные
+    другими воркерами, подхватываются сверкой с БД раз в ORDER_EVENTS_RECONCILE секунд.
+    """
+    def load_state() -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            order = db.query(models.Order).filter(models.Order.id == order_id).first()
+            return order_state(order) if order else None
+        finally:
+            db.close()
+    
+    state = await asyncio.to_thread(load_state)
+    if state is None:
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "error": "Заказ не найден"}
+        )
+    
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    queue, replay, _ = order_events.subscribe(order_id, last_event_id)
+    if state["status"] in TRACKED_ORDER_STATUSES:
+        order_events.track_driver(state["driver_id"], order_id)
+    
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            if replay is None:
+                yield order_events.snapshot(order_id, state)
+                if state["status"] in TERMINAL_ORDER_STATUSES:
+                    return
+            else:
+                for seq, event, data in replay:
+                    yield order_events.format(seq, event, data)
+                    if event == "status" and data.get("status") in TERMINAL_ORDER_STATUSES:
+                        return
+            
+            last_reconcile = time.monotonic()
+            while True:
+                try:
+                    seq, event, data = await asyncio.wait_for(queue.get(), timeout=settings.ORDER_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                else:
+                    yield order_events.format(seq, event, data)
+                    if event == "status" and data.get("status") in TERMINAL_ORDER_STATUSES:
+                        break
+                
+                if time.monotonic() - last_reconcile >= settings.ORDER_EVENTS_RECONCILE:
+                    last_reconcile = time.monotonic()
+                    current = await asyncio.to_thread(load_state)
+                    if current is not None:
+                        if current["status"] in TRACKED_ORDER_STATUSES:
+                            order_events.track_driver(current["driver_id"], order_id)
+                        order_events.publish(order_id, "status", current)
+        finally:
+            order_events.unsubscribe(order_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @app.get("/api/orders/test", response_class=JSONResponse)
 async def test_orders_api():
     """Тестовый endpoint для проверки API orders"""
@@ -6924,6 +6901,10 @@ async def complete_order_with_progress(request: Request, db: Session = Depends(g
             print(f"✅ Commit успешен")
             db.refresh(order)
             db.refresh(driver)
+            driver_index.set_busy(driver.id, False)
+            trip_tracks.finish(order.id)
+            forget_route(order.id)
+            order_events.publish_order(order)
             print(f"✅ Refresh объектов успешен")
         except Exception as commit_error:
             print(f"❌ Ошибка при commit: {str(commit_error)}")
@@ -6962,35 +6943,48 @@ async def complete_order_with_progress(request: Request, db: Session = Depends(g
 
 # API для обновления позиции водителя
 @app.post("/api/driver/update-location", response_class=JSONResponse)
-async def update_driver_location(request: UpdateDriverLocationRequest, db: Session = Depends(get_db)):
+async def update_driver_location(request: UpdateDriverLocationRequest, db: AsyncSession = Depends(get_async_db)):
     """Обновление позиции водителя и расчет прогресса заказа"""
     try:
-        # Находим водителя
-        driver = db.query(models.Driver).filter(models.Driver.id == request.driver_id).first()
-        if not driver:
-            return JSONResponse(
-                status_code=404,
-                content={"success": False, "error": "Водитель не найден"}
-            )
+        if request.driver_id in driver_index:
+            # Водитель уже на линии - строку drivers не читаем и не обновляем
+            driver_index.update(request.driver_id, request.latitude, request.longitude)
+        else:
+            # Первое появление в индексе (например, после рестарта) - проверяем водителя и занятость по БД
+            driver = (await db.execute(
+                select(models.Driver.id, models.Driver.tariff).where(models.Driver.id == request.driver_id)
+            )).first()
+            if not driver:
+                return JSONResponse(
+                    status_code=404,
+                    content={"success": False, "error": "Водитель не найден"}
+                )
+            busy = await db.scalar(select(models.Order.id).where(
+                models.Order.driver_id == request.driver_id,
+                models.Order.status.in_(["Принят", "Выполняется"])
+            ).limit(1)) is not None
+            driver_index.update(driver.id, request.latitude, request.longitude, tariff=driver.tariff, busy=busy)
         
-        # Обновляем позицию водителя
-        driver.current_lat = request.latitude
-        driver.current_lng = request.longitude
-        driver.last_location_update = datetime.now()
-        driver.is_online = True
+        # Позиция попадёт в drivers пакетным UPDATE (location_store)
+        location_store.update(request.driver_id, request.latitude, request.longitude)
         
         response_data = {
             "success": True,
-            "driver_id": driver.id,
+            "driver_id": request.driver_id,
             "location_updated": True
         }
         
         # Если указан заказ, рассчитываем прогресс
         if request.order_id:
-            order = db.query(models.Order).filter(
+            order = await db.scalar(select(models.Order).where(
                 models.Order.id == request.order_id,
                 models.Order.driver_id == request.driver_id
-            ).first()
+            ))
+            
+            if order and order.status in ["Принят", "Выполняется", "В пути"]:
+                # Точка в GPS-трек поездки
+                travelled_distance = trip_tracks.append(order.id, request.driver_id, request.latitude, request.longitude)
+                response_data["travelled_distance"] = round(travelled_distance, 3)
             
             if order and order.status in ["Выполняется", "В пути"]:
                 # Рассчитываем прогресс
@@ -6999,12 +6993,19 @@ async def update_driver_location(request: UpdateDriverLocationRequest, db: Sessi
                 # Обновляем данные заказа
                 order.completed_distance = progress_data["completed_distance"]
                 order.progress_percentage = progress_data["progress"]
+                if not order.total_distance and progress_data.get("total_distance"):
+                    order.total_distance = progress_data["total_distance"]
                 
                 # Рассчитываем фактическую оплату
                 if order.price:
                     actual_payment = calculate_actual_payment(order.price, progress_data["progress"])
                     order.actual_price = actual_payment
                 
+                order_events.publish_location(
+                    request.driver_id, request.latitude, request.longitude,
+                    order_id=order.id, progress_percentage=progress_data["progress"]
+                )
+                
                 response_data.update({
                     "order_progress": {
                         "progress_percentage": progress_data["progress"],
@@ -7015,12 +7016,17 @@ async def update_driver_location(request: UpdateDriverLocationRequest, db: Sessi
                     }
                 })
         
-        db.commit()
+        if "order_progress" in response_data:
+            await db.commit()
+        else:
+            # Пассажир видит водителя и по пути к точке подачи (без пересчёта прогресса)
+            order_events.publish_location(request.driver_id, request.latitude, request.longitude)
+        
         return JSONResponse(content=response_data)
         
     except Exception as e:
         logger.error(f"❌ Ошибка обновления позиции водителя: {str(e)}")
-        db.rollback()
+        await db.rollback()
         return JSONResponse(
             status_code=500,
             content={"success": False, "error": f"Ошибка сервера: {str(e)}"}
@@ -7028,6 +7034,39 @@ async def update_driver_location(request: UpdateDriverLocationRequest, db: Sessi
 
 # Endpoint перенесен в app/routers/orders.py
 
+# API для получения GPS-трека поездки
+@app.get("/api/order/{order_id}/track", response_class=JSONResponse)
+async def get_order_track(order_id: int, db: Session = Depends(get_db)):
+    """GPS-трек поездки: точки [lat, lng, unix-время], polyline для карты и пройденное расстояние"""
+    try:
+        order = db.query(models.Order.id, models.Order.status).filter(models.Order.id == order_id).first()
+        if not order:
+            return JSONResponse(
+                status_code=404,
+                content={"success": False, "error": "Заказ не найден"}
+            )
+        
+        track = load_track(db, order_id)
+        
+        return JSONResponse(content={
+            "success": True,
+            "order_id": order.id,
+            "status": order.status,
+            "distance_km": track["distance_km"],
+            "point_count": track["point_count"],
+            "started_at": track["started_at"],
+            "ended_at": track["ended_at"],
+            "polyline": polyline.encode([(lat, lng) for lat, lng, _ in track["points"]]),
+            "points": [[lat, lng, ts] for lat, lng, ts in track["points"]]
+        })
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения трека заказа {order_id}: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "error": f"Ошибка сервера: {str(e)}"}
+        )
+
 # API для получения прогресса заказа
 @app.get("/api/order/{order_id}/progress", response_class=JSONResponse)
 async def get_order_progress(order_id: int, db: Session = Depends(get_db)):
@@ -7040,14 +7079,11 @@ async def get_order_progress(order_id: int, db: Session = Depends(get_db)):
                 content={"success": False, "error": "Заказ не найден"}
             )
         
-        # Если есть водитель, получаем его текущую позицию
+        # Если есть водитель, получаем его текущую позицию (из памяти воркера или из БД, что новее)
         current_progress = 0.0
-        if order.driver and order.driver.current_lat and order.driver.current_lng:
-            progress_data = calculate_order_progress(
-                order, 
-                order.driver.current_lat, 
-                order.driver.current_lng
-            )
+        position = location_store.latest(order.driver) if order.driver_id and order.driver else None
+        if position:
+            progress_data = calculate_order_progress(order, position['lat'], position['lng'])
             current_progress = progress_data["progress"]
         
         return JSONResponse(content={
@@ -7060,10 +7096,10 @@ async def get_order_progress(order_id: int, db: Session = Depends(get_db)):
             "base_price": order.price,
             "actual_price": order.actual_price,
             "driver_location": {
-                "lat": order.driver.current_lat if order.driver else None,
-                "lng": order.driver.current_lng if order.driver else None,
-                "last_update": order.driver.last_location_update.isoformat() if order.driver and order.driver.last_location_update else None
-            } if order.driver else None
+                "lat": position['lat'] if position else None,
+                "lng": position['lng'] if position else None,
+                "last_update": position['updated_at'].isoformat() if position and position['updated_at'] else None
+            } if order.driver_id else None
         })
         
     except Exception as e:
@@ -1,5 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Date, DateTime, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import DDL, Boolean, Column, ForeignKey, Index, Integer, String, Float, Date, DateTime, Text, UniqueConstraint, event, exists
+from sqlalchemy.orm import column_property, relationship
 from sqlalchemy.sql import func
 from datetime import datetime
 from typing import Optional
@@ -22,7 +22,7 @@ class Driver(Base):
     tariff = Column(String(50), nullable=False)  # Бюджетный, Стандартный, Бизнес, Люкс
     taxi_park = Column(String(100), nullable=True)
     phone = Column(String(50), nullable=True)  # Номер телефона водителя
-    status = Column(String(20), default="pending")  # accepted, rejected, pending
+    status = Column(String(20), default="pending", index=True)  # accepted, rejected, pending
     
     # Новые поля для активности и рейтинга
     activity = Column(Integer, default=0)  # Количество заказов/активность водителя
@@ -40,7 +40,7 @@ class Driver(Base):
     # Поля для отслеживания позиции водителя
     current_lat = Column(Float, nullable=True)  # Текущая широта
     current_lng = Column(Float, nullable=True)  # Текущая долгота
-    last_location_update = Column(DateTime, nullable=True)  # Время последнего обновления позиции
+    last_location_update = Column(DateTime, nullable=True, index=True)  # Время последнего обновления позиции
     is_online = Column(Boolean, default=False)  # Статус "на линии"
     
     cars = relationship("Car", back_populates="driver")
@@ -60,18 +60,12 @@ class Driver(Base):
         if not hasattr(self, '_car'):
             self._car = value
 
-    @property
-    def is_busy(self):
-        """Возвращает занятость водителя (для обратной совместимости)"""
-        # Проверяем наличие активных заказов
-        return any(order.status == "Занят" for order in self.orders) if hasattr(self, 'orders') and self.orders else False
-
 
 class Car(Base):
     __tablename__ = "cars"
 
     id = Column(Integer, primary_key=True, index=True)
-    driver_id = Column(Integer, ForeignKey("drivers.id"))
+    driver_id = Column(Integer, ForeignKey("drivers.id"), index=True)
     brand = Column(String(100), nullable=False)
     model = Column(String(100), nullable=False)
     year = Column(Integer, nullable=False)
@@ -108,7 +102,7 @@ class Order(Base):
     origin = Column(Text, nullable=False)  # Откуда
     destination = Column(Text, nullable=False)  # Куда
     driver_id = Column(Integer, ForeignKey("drivers.id"))
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(DateTime, server_default=func.now(), index=True)
     status = Column(String(50), default="Выполняется")  # Выполняется, Завершен, Отменен
     price = Column(Float, nullable=True)  # Стоимость поездки
     tariff = Column(String(50), nullable=True)  # Тариф (Эконом, Комфорт, и т.д.)
@@ -121,15 +115,135 @@ class Order(Base):
     destination_lat = Column(Float, nullable=True)  # Широта точки назначения
     destination_lng = Column(Float, nullable=True)  # Долгота точки назначения
     total_distance = Column(Float, nullable=True)  # Общее расстояние маршрута в км
+    route_polyline = Column(Text, nullable=True)  # Упрощённая линия маршрута 2GIS (encoded polyline)
     completed_distance = Column(Float, default=0.0)  # Пройденное расстояние в км
     progress_percentage = Column(Float, default=0.0)  # Процент выполнения заказа (0-100)
     actual_price = Column(Float, nullable=True)  # Фактическая оплата с учетом прогресса
     started_at = Column(DateTime, nullable=True)  # Время начала поездки
     completed_at = Column(DateTime, nullable=True)  # Время завершения поездки
+    offer_expires_at = Column(DateTime, nullable=True)  # До какого времени действует предложение диспетчера (NULL - назначен вручную)
     
     # Связь с водителем
     driver = relationship("Driver", back_populates="orders")
 
+    __table_args__ = (
+        # Активные заказы водителя: занятость, текущая поездка
+        Index('ix_orders_driver_id_status', 'driver_id', 'status'),
+        # История заказов водителя от новых к старым (страницы по created_at, id)
+        Index('ix_orders_driver_id_created_at', 'driver_id', 'created_at'),
+        # Очередь заказов без водителя: частичный индекс, назначенные заказы в него не попадают
+        Index(
+            'ix_orders_unassigned_status_created_at', 'status', created_at.desc(),
+            postgresql_where=driver_id.is_(None),
+            sqlite_where=driver_id.is_(None),
+        ),
+        # Истёкшие предложения диспетчера: в индексе только заказы с действующим предложением
+        Index(
+            'ix_orders_offer_expires_at', 'offer_expires_at',
+            postgresql_where=offer_expires_at.isnot(None),
+            sqlite_where=offer_expires_at.isnot(None),
+        ),
+    )
+
+
+# Статусы заказа, в которых водитель занят поездкой
+BUSY_ORDER_STATUSES = ["Принят", "Выполняется"]
+
+# Занятость водителя - EXISTS по активным заказам. Отложенная: в списки водителей
+# подгружается через undefer(Driver.is_busy) тем же запросом, в фильтрах и агрегатах
+# используется как SQL-выражение
+Driver.is_busy = column_property(
+    exists().where(
+        Order.driver_id == Driver.id,
+        Order.status.in_(BUSY_ORDER_STATUSES)
+    ).correlate_except(Order),
+    deferred=True
+)
+
+
+class OrderOfferDecline(Base):
+    """Водитель отказался от предложения диспетчера (или не ответил) - заказ ему больше не предлагается"""
+    __tablename__ = "order_offer_declines"
+
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), primary_key=True)
+    driver_id = Column(Integer, ForeignKey("drivers.id", ondelete="CASCADE"), primary_key=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class OrderTrack(Base):
+    """Фрагмент GPS-трека поездки: точки заказа в формате encoded polyline (lat, lng, время)"""
+    __tablename__ = "order_tracks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    driver_id = Column(Integer, ForeignKey("drivers.id"), nullable=True)
+    started_at = Column(DateTime, nullable=False)  # Время первой точки фрагмента
+    ended_at = Column(DateTime, nullable=False)  # Время последней точки фрагмента
+    point_count = Column(Integer, default=0)  # Количество точек во фрагменте
+    distance_km = Column(Float, default=0.0)  # Пройденное расстояние внутри фрагмента
+    points = Column(Text, nullable=False)  # Encoded polyline: lat/lng (1e-5), время (сек)
+
+
+class GeoCacheEntry(Base):
+    """Общий для всех реплик кэш ответов 2GIS (геокодирование адресов, маршруты)"""
+    __tablename__ = "geo_cache"
+
+    key = Column(String(512), primary_key=True)  # Нормализованный ключ запроса
+    kind = Column(String(20), nullable=False, index=True)  # geocode, route
+    value = Column(Text, nullable=False)  # Ответ в JSON
+    expires_at = Column(DateTime, nullable=False, index=True)  # Время устаревания записи
+    updated_at = Column(DateTime, nullable=False)  # Время последней записи
+
+
+class ApiQuotaUsage(Base):
+    """Расход бюджета запросов к внешнему API за окно времени, общий для всех воркеров и реплик"""
+    __tablename__ = "api_quota_usage"
+
+    scope = Column(String(50), primary_key=True)  # Бюджет и размер окна: eta_matrix:minute, eta_matrix:day
+    window_start = Column(DateTime, primary_key=True)  # Начало окна
+    used = Column(Integer, nullable=False, default=0)  # Запросов в окне
+
+
+class SearchDocument(Base):
+    """Нормализованный текст водителя или заказа для поиска по подстроке (см. services/search.py)"""
+    __tablename__ = "search_documents"
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String(20), nullable=False)  # driver, order
+    entity_id = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False, default="")  # Поля через " | ", нижний регистр
+
+    __table_args__ = (
+        UniqueConstraint('entity', 'entity_id', name='uq_search_documents_entity'),
+        # PostgreSQL: триграммный GIN-индекс обслуживает LIKE '%...%'
+        Index(
+            'ix_search_documents_content_trgm', 'content',
+            postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
+
+
+# Расширение pg_trgm нужно до создания индекса
+event.listen(
+    SearchDocument.__table__, 'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql')
+)
+
+# SQLite (локальная разработка): FTS5-таблица с триграммами поверх search_documents
+SQLITE_SEARCH_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents_fts USING fts5("
+    "content, content='search_documents', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO search_documents_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+for statement in SQLITE_SEARCH_FTS_DDL:
+    event.listen(SearchDocument.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -147,6 +261,12 @@ class Message(Base):
     # Связь с получателем (если это конкретный водитель)
     recipient = relationship("Driver", foreign_keys=[recipient_id], backref="received_messages")
 
+    __table_args__ = (
+        # Сообщения водителя (персональные ИЛИ рассылки): по индексу на каждую ветку OR
+        Index('ix_messages_recipient_id_created_at', 'recipient_id', 'created_at'),
+        Index('ix_messages_is_broadcast_created_at', 'is_broadcast', 'created_at'),
+    )
+
 
 class BalanceTransaction(Base):
     __tablename__ = "balance_transactions"
@@ -157,10 +277,38 @@ class BalanceTransaction(Base):
     type = Column(String)  # deposit, withdrawal
     status = Column(String)  # completed, pending, cancelled
     description = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, default=datetime.now, index=True)
     
     driver = relationship("Driver", back_populates="transactions")
 
+    __table_args__ = (
+        # Последние транзакции и сверка баланса водителя
+        Index('ix_balance_transactions_driver_id_created_at', 'driver_id', 'created_at'),
+    )
+
+
+class OrderDailyStats(Base):
+    """Дневная сводка заказов для графиков аналитики: день x тариф x таксопарк x статус"""
+    __tablename__ = "order_daily_stats"
+
+    day = Column(Date, primary_key=True)
+    tariff = Column(String(50), primary_key=True, default="")  # "" - без тарифа
+    taxi_park = Column(String(100), primary_key=True, default="")  # Таксопарк водителя, "" - без водителя
+    status = Column(String(50), primary_key=True, default="")
+    orders_count = Column(Integer, nullable=False, default=0)  # Количество заказов
+    earnings = Column(Float, nullable=False, default=0.0)  # Сумма цен заказов (price > 0)
+    commission = Column(Float, nullable=False, default=0.0)  # Комиссия сервиса с этих заказов
+
+
+class BalanceDailyStats(Base):
+    """Дневная сводка проведённых транзакций баланса по типам (deposit, withdrawal, correction)"""
+    __tablename__ = "balance_daily_stats"
+
+    day = Column(Date, primary_key=True)
+    type = Column(String(20), primary_key=True)
+    transactions_count = Column(Integer, nullable=False, default=0)  # Количество транзакций
+    amount = Column(Float, nullable=False, default=0.0)  # Сумма (списания отрицательные)
+
 
 class DriverUser(Base):
     __tablename__ = "driver_users"
@@ -172,7 +320,7 @@ class DriverUser(Base):
     is_verified = Column(Boolean, default=False)
     date_registered = Column(DateTime, default=datetime.now)
     last_login = Column(DateTime, nullable=True)
-    driver_id = Column(Integer, ForeignKey("drivers.id"), nullable=True)
+    driver_id = Column(Integer, ForeignKey("drivers.id"), nullable=True, index=True)
     
     # Связь с водителем
     driver = relationship("Driver", backref="user_account")
@@ -223,7 +371,7 @@ class DriverDocuments(Base):
     __tablename__ = "driver_documents"
 
     id = Column(Integer, primary_key=True, index=True)
-    driver_id = Column(Integer, ForeignKey("drivers.id"))
+    driver_id = Column(Integer, ForeignKey("drivers.id"), index=True)
     passport_front = Column(String(255), nullable=True)
     passport_back = Column(String(255), nullable=True)
     license_front = Column(String(255), nullable=True)
@@ -248,4 +396,9 @@ class DriverVerification(Base):
     verified_at = Column(DateTime, nullable=True)
     
     # Связь с водителем
-    driver = relationship("Driver", backref="verifications") 
\ No newline at end of file
+    driver = relationship("Driver", backref="verifications")
+
+    __table_args__ = (
+        # Очередь фотоконтроля: последняя верификация водителя по типу
+        Index('ix_driver_verifications_driver_id_type_created_at', 'driver_id', 'verification_type', created_at.desc()),
+    )
\ No newline at end of file
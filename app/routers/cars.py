@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, File, UploadFile
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
 import shutil
 from .. import crud, models, schemas
 from ..database import get_db
+from ..services.keyset import InvalidCursor, set_page_headers
 
 router = APIRouter(
     prefix="/cars",
@@ -44,9 +45,25 @@ def create_car(driver_id: int, car: schemas.CarCreate, db: Session = Depends(get
     return crud.create_car(db=db, car=car, driver_id=driver_id)
 
 @router.get("/", response_model=List[schemas.Car])
-def read_cars(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    cars = crud.get_cars(db, skip=skip, limit=limit)
-    return cars
+def read_cars(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    skip: int = Query(0, ge=0, deprecated=True),
+    with_total: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Список автомобилей по id.
+
+    Keyset-пагинация, как у /api/orders/: курсор следующей страницы - в X-Next-Cursor.
+    """
+    try:
+        page = crud.get_cars_page(db, cursor=cursor, limit=limit, skip=skip, with_total=with_total)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_page_headers(response, page)
+    return page.items
 
 @router.get("/{car_id}", response_model=schemas.Car)
 def read_car(car_id: int, db: Session = Depends(get_db)):
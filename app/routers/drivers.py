@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from .. import crud, models, schemas
 from ..database import get_db
+from ..services.keyset import InvalidCursor, set_page_headers
 
 router = APIRouter(
     prefix="/drivers",
@@ -32,9 +33,25 @@ def create_driver(driver: schemas.DriverCreate, db: Session = Depends(get_db)):
     return crud.create_driver(db=db, driver=driver)
 
 @router.get("/", response_model=List[schemas.Driver])
-def read_drivers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    drivers = crud.get_drivers(db, skip=skip, limit=limit)
-    return drivers
+def read_drivers(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    skip: int = Query(0, ge=0, deprecated=True),
+    with_total: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Список водителей по id.
+
+    Keyset-пагинация, как у /api/orders/: курсор следующей страницы - в X-Next-Cursor.
+    """
+    try:
+        page = crud.get_drivers_page(db, cursor=cursor, limit=limit, skip=skip, with_total=with_total)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_page_headers(response, page)
+    return page.items
 
 @router.get("/{driver_id}", response_model=schemas.Driver)
 def read_driver(driver_id: int, db: Session = Depends(get_db)):
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
 from .. import crud, models, schemas
 from ..database import get_db
+from ..services.keyset import InvalidCursor, set_page_headers
 
 router = APIRouter(
     prefix="/messages",
@@ -68,8 +69,19 @@ def create_bulk_messages(recipient_ids: List[int], content: str, db: Session = D
     return messages
 
 @router.get("/driver/{driver_id}", response_model=List[schemas.Message])
-def read_driver_messages(driver_id: int, db: Session = Depends(get_db)):
-    """Получить все сообщения для конкретного водителя (персональные + общие рассылки)"""
+def read_driver_messages(
+    driver_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    with_total: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Сообщения для конкретного водителя (персональные + общие рассылки), от новых к старым.
+
+    Keyset-пагинация по (created_at, id): курсор следующей страницы - в X-Next-Cursor.
+    """
     # Проверяем, существует ли водитель
     db_driver = crud.get_driver(db, driver_id=driver_id)
     if db_driver is None:
@@ -78,7 +90,12 @@ def read_driver_messages(driver_id: int, db: Session = Depends(get_db)):
             detail="Driver not found"
         )
     
-    return crud.get_messages_for_driver(db, driver_id=driver_id)
+    try:
+        page = crud.get_messages_for_driver(db, driver_id=driver_id, cursor=cursor, limit=limit, with_total=with_total)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_page_headers(response, page)
+    return page.items
 
 @router.get("/broadcast", response_model=List[schemas.Message])
 def read_broadcast_messages(db: Session = Depends(get_db)):
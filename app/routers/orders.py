@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
@@ -6,6 +6,12 @@ from datetime import datetime
 
 from .. import crud, models, schemas
 from ..database import get_db
+from ..services.driver_index import driver_index
+from ..services.order_events import order_events
+from ..services.location_store import location_store
+from ..services.trip_track import trip_tracks
+from ..services.route_progress import forget_route
+from ..services.keyset import InvalidCursor, set_page_headers
 
 
 router = APIRouter(
@@ -41,9 +47,27 @@ def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
     return crud.create_order(db=db, order=order)
 
 @router.get("/", response_model=List[schemas.Order])
-def read_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    orders = crud.get_orders(db, skip=skip, limit=limit)
-    return orders
+def read_orders(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    skip: int = Query(0, ge=0, deprecated=True),
+    with_total: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Список заказов по id.
+
+    Keyset-пагинация: курсор следующей страницы - в заголовке X-Next-Cursor
+    (нет заголовка - страница последняя), оценка общего числа при
+    with_total=true - в X-Total-Count. skip оставлен для старых клиентов.
+    """
+    try:
+        page = crud.get_orders_page(db, cursor=cursor, limit=limit, skip=skip, with_total=with_total)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_page_headers(response, page)
+    return page.items
 
 @router.get("/test-endpoint")
 def test_endpoint():
@@ -116,9 +140,8 @@ def complete_order_with_progress(
         
         # Обновляем позицию если указана
         if final_latitude and final_longitude:
-            db_driver.current_lat = final_latitude
-            db_driver.current_lng = final_longitude
-            db_driver.last_location_update = datetime.now()
+            # Через буфер позиций, чтобы отложенная пакетная запись не затёрла финальную точку
+            location_store.update(db_driver.id, final_latitude, final_longitude)
         
         # Рассчитываем фактическую оплату
         base_price = float(db_order.price) if db_order.price else 433.0  # Цена по умолчанию
@@ -163,6 +186,10 @@ def complete_order_with_progress(
         db.commit()
         db.refresh(db_order)
         db.refresh(db_driver)
+        driver_index.set_busy(db_driver.id, False)
+        trip_tracks.finish(db_order.id)
+        forget_route(db_order.id)
+        order_events.publish_order(db_order)
         
         final_progress = db_order.progress_percentage or 30.0
         final_payment = db_order.actual_price or 0.0
@@ -256,7 +283,9 @@ def update_order_info(order_id: int, order: schemas.OrderCreate, db: Session = D
             detail="Invalid time format. Must be in 'HH:MM' format (24-hour)"
         )
     
-    return crud.update_order(db=db, order_id=order_id, order_data=order)
+    db_order = crud.update_order(db=db, order_id=order_id, order_data=order)
+    order_events.publish_order(db_order)
+    return db_order
 
 @router.delete("/{order_id}", response_model=schemas.Order)
 def delete_order(order_id: int, db: Session = Depends(get_db)):
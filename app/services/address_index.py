@@ -0,0 +1,351 @@
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.services.geo_cache import normalize_address
+
+logger = logging.getLogger(__name__)
+
+# Кириллица (включая кыргызские ң, ө, ү) -> латиница
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'ң': 'n', 'ө': 'o', 'ү': 'u',
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+
+# Варианты латинского написания сводятся к одному: Aitmatov/Aytmatov, Jibek/Zhibek, Kh/H
+_LATIN_FOLDS = (('kh', 'h'), ('x', 'h'), ('w', 'v'), ('q', 'k'), ('j', 'zh'), ('y', 'i'))
+
+_TOKEN_SPLIT_RE = re.compile(r'[\s/-]+')
+
+# Слова-типы (улица, проспект, микрорайон...) есть почти в каждом адресе и не различают их
+STOP_TOKENS = {
+    'ul', 'ulitsa', 'pr', 'prt', 'prosp', 'prospekt', 'mkr', 'mikroraion', 'per', 'pereulok',
+    'd', 'dom', 'g', 'gorod', 'kv', 'kocho', 'kochosu', 'bul', 'bulvar'
+}
+
+
+def canonical_address(text: str) -> str:
+    """Нормализованный адрес в латинице: одинаковый для кириллического и латинского написания"""
+    text = normalize_address(text).translate(_TRANSLIT_TABLE)
+    for source, target in _LATIN_FOLDS:
+        text = text.replace(source, target)
+    return text
+
+
+def address_tokens(text: str) -> List[str]:
+    return [token for token in _TOKEN_SPLIT_RE.split(canonical_address(text))
+            if token and token not in STOP_TOKENS]
+
+
+def is_house_token(token: str) -> bool:
+    """Номер дома (12, 12a, 5/1 после разбиения): слово начинается с цифры"""
+    return token[0].isdigit()
+
+
+# Длина префиксов, для которых хранится готовый топ адресов
+MAX_PREFIX = 12
+
+
+class AddressEntry:
+    __slots__ = ('address', 'lat', 'lng', 'count', 'last_used', 'tokens', 'rank')
+
+    def __init__(self, address: str, lat: float, lng: float, last_used: float, tokens: Tuple[str, ...]):
+        self.address = address
+        self.lat = lat
+        self.lng = lng
+        self.count = 0
+        self.last_used = last_used
+        self.tokens = tokens
+        self.rank = 0.0
+
+
+class AddressIndex:
+    """
+    Индекс автодополнения по адресам из истории заказов (origin/destination).
+
+    Адреса хранятся в каноническом виде (нижний регистр, латиница), каждый
+    уникальный адрес - одна запись с частотой и временем последнего заказа.
+
+    Вес записи - частота с затуханием вдвое за ADDRESS_INDEX_HALF_LIFE_DAYS:
+    count * 2 ** ((last_used - now) / half_life). Множитель с now общий для
+    всех записей, поэтому порядок задаёт статический ранг
+    log2(count) + last_used / half_life, который со временем только растёт.
+    Благодаря этому для каждого префикса слова (от ADDRESS_INDEX_MIN_PREFIX
+    до MAX_PREFIX символов) хранится точный топ ADDRESS_INDEX_TOP_K записей,
+    обновляемый при каждом заказе: запрос фильтрует готовый короткий список.
+
+    Номера домов редко попадают в топ улицы, поэтому так же хранится топ
+    для пары (слово, префикс номера дома): запрос «Айтматова 12» берёт
+    готовые топы пар слов на «aitmatova» с префиксом «12». Если и так
+    адресов мало, поиск идёт по полному диапазону словаря токенов
+    (отсортирован, префикс - непрерывный диапазон).
+    """
+
+    def __init__(self, top_k: int = None):
+        self.top_k = top_k or settings.ADDRESS_INDEX_TOP_K
+        self._half_life = settings.ADDRESS_INDEX_HALF_LIFE_DAYS * 86400
+        self._entries: List[AddressEntry] = []
+        self._by_key: Dict[str, int] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._vocabulary: List[str] = []
+        self._top: Dict[str, List[int]] = {}
+        # (слово, префикс номера дома) -> топ записей
+        self._house_top: Dict[Tuple[str, str], List[int]] = {}
+        self._bulk = False
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.local_answers = 0
+        self.house_lookups = 0
+        self.full_scans = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _prefixes(self, token: str):
+        for length in range(settings.ADDRESS_INDEX_MIN_PREFIX, min(len(token), MAX_PREFIX) + 1):
+            yield token[:length]
+
+    @staticmethod
+    def _house_keys(tokens: Tuple[str, ...]):
+        """Пары (слово, префикс номера дома) адреса"""
+        houses = {token for token in tokens if is_house_token(token)}
+        for word in set(tokens) - houses:
+            for house in houses:
+                for length in range(1, min(len(house), MAX_PREFIX) + 1):
+                    yield word, house[:length]
+
+    def _rank_key(self, entry_id: int) -> float:
+        return self._entries[entry_id].rank
+
+    def _push(self, tops: Dict, key, entry_id: int, rank: float) -> None:
+        top = tops.get(key)
+        if top is None:
+            tops[key] = [entry_id]
+            return
+        if entry_id not in top:
+            if len(top) >= self.top_k and rank <= self._entries[top[-1]].rank:
+                return
+            top.append(entry_id)
+        top.sort(key=self._rank_key, reverse=True)
+        del top[self.top_k:]
+
+    def _promote(self, entry_id: int) -> None:
+        """Ставит запись, чей ранг вырос, в топы префиксов её слов и пар с номером дома"""
+        entry = self._entries[entry_id]
+        for token in set(entry.tokens):
+            for prefix in self._prefixes(token):
+                self._push(self._top, prefix, entry_id, entry.rank)
+        for key in self._house_keys(entry.tokens):
+            self._push(self._house_top, key, entry_id, entry.rank)
+
+    def _rebuild_top(self) -> None:
+        """Пересчитывает все топы префиксов: топ префикса - лучшие из топов его слов"""
+        candidates: Dict[str, Set[int]] = {}
+        for token, posting in self._postings.items():
+            best = heapq.nlargest(self.top_k, posting, key=self._rank_key)
+            for prefix in self._prefixes(token):
+                candidates.setdefault(prefix, set()).update(best)
+        self._top = {
+            prefix: heapq.nlargest(self.top_k, ids, key=self._rank_key)
+            for prefix, ids in candidates.items()
+        }
+        houses: Dict[Tuple[str, str], List[int]] = {}
+        for entry_id, entry in enumerate(self._entries):
+            for key in self._house_keys(entry.tokens):
+                houses.setdefault(key, []).append(entry_id)
+        self._house_top = {
+            key: heapq.nlargest(self.top_k, ids, key=self._rank_key)
+            for key, ids in houses.items()
+        }
+
+    def add(self, address: Optional[str], lat: Optional[float], lng: Optional[float],
+            used_at: Optional[float] = None) -> None:
+        """Учитывает одно использование адреса (вызывается на каждый созданный заказ)"""
+        if not address or lat is None or lng is None:
+            return
+        key = canonical_address(address)
+        if not key:
+            return
+        used_at = used_at if used_at is not None else time.time()
+        with self._lock:
+            entry_id = self._by_key.get(key)
+            if entry_id is None:
+                tokens = tuple(address_tokens(address))
+                if not tokens:
+                    return
+                entry_id = len(self._entries)
+                self._by_key[key] = entry_id
+                self._entries.append(AddressEntry(address.strip(), lat, lng, used_at, tokens))
+                for token in set(tokens):
+                    posting = self._postings.get(token)
+                    if posting is None:
+                        posting = self._postings[token] = set()
+                        insort(self._vocabulary, token)
+                    posting.add(entry_id)
+            entry = self._entries[entry_id]
+            entry.count += 1
+            if used_at >= entry.last_used:
+                # Свежий заказ задаёт написание и координаты
+                entry.last_used = used_at
+                entry.address = address.strip()
+                entry.lat, entry.lng = lat, lng
+            entry.rank = math.log2(entry.count) + entry.last_used / self._half_life
+            if not self._bulk:
+                self._promote(entry_id)
+
+    def add_order(self, order) -> None:
+        used_at = order.created_at.timestamp() if order.created_at else None
+        self.add(order.origin, order.origin_lat, order.origin_lng, used_at)
+        self.add(order.destination, order.destination_lat, order.destination_lng, used_at)
+
+    def _prefix_candidates(self, prefix: str) -> Set[int]:
+        start = bisect_left(self._vocabulary, prefix)
+        end = bisect_left(self._vocabulary, prefix + '\uffff', start)
+        if end - start == 1:
+            return self._postings[self._vocabulary[start]]
+        found: Set[int] = set()
+        for token in self._vocabulary[start:end]:
+            found |= self._postings[token]
+        return found
+
+    def _house_tops(self, prefix: str, house: str) -> List[List[int]]:
+        """Топы пар (слово на prefix, номер дома на house)"""
+        start = bisect_left(self._vocabulary, prefix)
+        end = bisect_left(self._vocabulary, prefix + '\uffff', start)
+        house = house[:MAX_PREFIX]
+        return [
+            top for top in (self._house_top.get((token, house)) for token in self._vocabulary[start:end])
+            if top
+        ]
+
+    def _matches(self, entry_id: int, parts: List[str]) -> bool:
+        tokens = self._entries[entry_id].tokens
+        return all(any(token.startswith(part) for token in tokens) for part in parts)
+
+    def search(self, query: str, limit: int = 5) -> List[Dict]:
+        """Адреса из истории, подходящие под ввод, в формате ответа search_addresses"""
+        self.lookups += 1
+        tokens = address_tokens(query)
+        if not tokens:
+            return []
+        # Все слова запроса - префиксы (последнее обычно не дописано); кандидаты - по самому
+        # длинному слову, номер дома ведущим берётся, только если слов нет
+        tokens.sort(key=lambda token: (not is_house_token(token), len(token)), reverse=True)
+        lead = tokens[0]
+        if len(lead) < settings.ADDRESS_INDEX_MIN_PREFIX:
+            return []
+        parts = tokens[1:] + ([lead] if len(lead) > MAX_PREFIX else [])
+
+        house = next((part for part in parts if is_house_token(part)), None)
+        if is_house_token(lead):
+            house = None
+
+        with self._lock:
+            if house is not None:
+                # Улица с номером дома: готовые топы пар (слово на lead, префикс номера);
+                # слово и номер (до MAX_PREFIX) в паре уже совпали - проверяются остальные слова
+                self.house_lookups += 1
+                rest = [part for part in parts if part is not house or len(house) > MAX_PREFIX]
+                tops = self._house_tops(lead, house)
+            else:
+                tops = [self._top.get(lead[:MAX_PREFIX], [])]
+                rest = parts
+            if len(tops) == 1:
+                # Топ отсортирован по рангу: первые подходящие и есть лучшие
+                best = []
+                for entry_id in tops[0]:
+                    if not rest or self._matches(entry_id, rest):
+                        best.append(entry_id)
+                        if len(best) == limit:
+                            break
+            else:
+                candidates = {entry_id for top in tops for entry_id in top
+                              if not rest or self._matches(entry_id, rest)}
+                best = heapq.nlargest(limit, candidates, key=self._rank_key)
+            if len(best) < limit and any(len(top) >= self.top_k for top in tops):
+                # В топах не хватило подходящих, а сами топы могли отсечь нужные - полный перебор по словарю
+                self.full_scans += 1
+                candidates = self._prefix_candidates(lead)
+                if parts:
+                    candidates = [entry_id for entry_id in candidates if self._matches(entry_id, parts)]
+                best = heapq.nlargest(limit, candidates, key=self._rank_key)
+            results = [
+                {
+                    'lat': self._entries[entry_id].lat,
+                    'lon': self._entries[entry_id].lng,
+                    'address': self._entries[entry_id].address,
+                    'name': '',
+                    'short_address': self._entries[entry_id].address,
+                    'source': 'history'
+                }
+                for entry_id in best
+            ]
+        if results:
+            self.local_answers += 1
+        return results
+
+    def build(self, db, limit: int = None) -> int:
+        """Заполняет индекс адресами последних заказов, возвращает число обработанных заказов"""
+        from app import models
+
+        limit = limit or settings.ADDRESS_INDEX_HISTORY_LIMIT
+        started = time.perf_counter()
+        rows = db.query(
+            models.Order.origin, models.Order.origin_lat, models.Order.origin_lng,
+            models.Order.destination, models.Order.destination_lat, models.Order.destination_lng,
+            models.Order.created_at
+        ).order_by(models.Order.id.desc()).limit(limit).yield_per(5000)
+
+        # Топы префиксов пересчитываются один раз в конце, а не на каждый адрес
+        self._bulk = True
+        count = 0
+        try:
+            for origin, origin_lat, origin_lng, destination, destination_lat, destination_lng, created_at in rows:
+                used_at = created_at.timestamp() if isinstance(created_at, datetime) else None
+                self.add(origin, origin_lat, origin_lng, used_at)
+                self.add(destination, destination_lat, destination_lng, used_at)
+                count += 1
+        finally:
+            with self._lock:
+                self._bulk = False
+                self._rebuild_top()
+        logger.info(f"📇 Индекс адресов построен: {len(self._entries)} адресов из {count} заказов "
+                    f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+        return count
+
+    def build_from_db(self) -> int:
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            return self.build(db)
+        except Exception as e:
+            logger.error(f"❌ Ошибка построения индекса адресов: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        return {
+            'addresses': len(self._entries),
+            'tokens': len(self._vocabulary),
+            'prefixes': len(self._top),
+            'lookups': self.lookups,
+            'local_answers': self.local_answers,
+            'house_lookups': self.house_lookups,
+            'full_scans': self.full_scans
+        }
+
+
+address_index = AddressIndex()
@@ -0,0 +1,449 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, delete, event, func, insert, inspect, literal, or_, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import attributes
+
+from app.config import settings
+from app.services.orm_history import fields_changed
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+MONTHS = ['Янв', 'Фев', 'Мар', 'Апр', 'Май', 'Июн', 'Июл', 'Авг', 'Сен', 'Окт', 'Ноя', 'Дек']
+
+_SESSION_KEY = 'analytics_rollup'
+
+# Периоды графиков с фиксированным началом; остальные значения - за всё время
+CHART_PERIODS = ('7', '30', '365')
+
+# Поля, от которых зависят сводки: изменение остальных (позиция, прогресс,
+# маршрут) день не пересчитывает
+ORDER_FIELDS = ('created_at', 'status', 'price', 'tariff', 'driver_id')
+BALANCE_FIELDS = ('created_at', 'type', 'amount', 'status')
+
+
+def as_date(value) -> Optional[date]:
+    """date(created_at) из БД: SQLite возвращает строку"""
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def _day_range(start: date, end: date) -> Tuple[datetime, datetime]:
+    return datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time())
+
+
+def lock_rebuilds(connection) -> None:
+    """
+    Пересчёты сводок разных воркеров и реплик идут по одному: одновременные
+    DELETE + INSERT одних дней ломаются на первичном ключе. Блокировка
+    держится до конца транзакции; в других СУБД пишет один процесс.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': settings.ANALYTICS_ROLLUP_LOCK_KEY})
+
+
+def rebuild_orders(connection, start: date, end: date) -> None:
+    """Пересчитывает order_daily_stats за дни [start, end) из orders"""
+    from app import models
+
+    Order, Driver = models.Order, models.Driver
+    stats = models.OrderDailyStats.__table__
+    since, until = _day_range(start, end)
+    paid = Order.price > 0
+    rows = select(
+        func.date(Order.created_at),
+        func.coalesce(Order.tariff, ''),
+        func.coalesce(Driver.taxi_park, ''),
+        func.coalesce(Order.status, ''),
+        func.count(Order.id),
+        func.coalesce(func.sum(case((paid, Order.price), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((paid, func.round(Order.price * literal(settings.ORDER_COMMISSION_RATE))), else_=0.0)), 0.0)
+    ).select_from(Order).outerjoin(Driver, Order.driver_id == Driver.id).where(
+        Order.created_at >= since, Order.created_at < until
+    ).group_by(
+        func.date(Order.created_at),
+        func.coalesce(Order.tariff, ''),
+        func.coalesce(Driver.taxi_park, ''),
+        func.coalesce(Order.status, '')
+    )
+    connection.execute(delete(stats).where(stats.c.day >= start, stats.c.day < end))
+    connection.execute(insert(stats).from_select(
+        ['day', 'tariff', 'taxi_park', 'status', 'orders_count', 'earnings', 'commission'], rows
+    ))
+
+
+def rebuild_balance(connection, start: date, end: date) -> None:
+    """Пересчитывает balance_daily_stats за дни [start, end) из проведённых balance_transactions"""
+    from app import models
+
+    Transaction = models.BalanceTransaction
+    stats = models.BalanceDailyStats.__table__
+    since, until = _day_range(start, end)
+    rows = select(
+        func.date(Transaction.created_at),
+        Transaction.type,
+        func.count(Transaction.id),
+        func.coalesce(func.sum(Transaction.amount), 0.0)
+    ).where(
+        Transaction.created_at >= since, Transaction.created_at < until,
+        Transaction.type.isnot(None),
+        # Корректировки проводятся без статуса
+        or_(Transaction.status.is_(None), Transaction.status == 'completed')
+    ).group_by(func.date(Transaction.created_at), Transaction.type)
+    connection.execute(delete(stats).where(stats.c.day >= start, stats.c.day < end))
+    connection.execute(insert(stats).from_select(['day', 'type', 'transactions_count', 'amount'], rows))
+
+
+class AnalyticsRollup:
+    """
+    Дневные сводки заказов и транзакций баланса для графиков аналитики.
+
+    Сводка дня всегда пересчитывается целиком из исходных таблиц (DELETE +
+    INSERT ... SELECT по диапазону created_at), поэтому пересчёт идемпотентен
+    и одинаков для инкрементального обновления и заполнения истории.
+    События сессии отмечают дни заказов и транзакций, у которых изменились
+    поля сводки (ORDER_FIELDS, BALANCE_FIELDS, таксопарк водителя); после
+    commit эти дни пересчитываются фоновой задачей раз в
+    ANALYTICS_ROLLUP_INTERVAL секунд. Изменения в обход ORM (query.update,
+    другие процессы) подхватывает контрольный пересчёт последних дней.
+
+    Пересчёты всех воркеров сериализуются блокировкой lock_rebuilds, а
+    заполнение истории при старте выполняет один воркер.
+    """
+
+    def __init__(self):
+        self._order_days: Set[date] = set()
+        self._order_ids: Set[int] = set()
+        self._driver_ids: Set[int] = set()
+        self._balance_days: Set[date] = set()
+        self._lock = threading.Lock()
+        self._listening = False
+        self._task: Optional[asyncio.Task] = None
+        self._last_reconcile = 0.0
+        self.refreshed_days = 0
+        self.failures = 0
+        self.last_refresh_stats: Dict = {}
+
+    # --- Отслеживание изменений ---
+
+    @staticmethod
+    def _touched_days(obj) -> Set[date]:
+        """Дни created_at объекта: текущий и прежний (если дату меняли)"""
+        state = inspect(obj)
+        history = attributes.get_history(obj, 'created_at', passive=attributes.PASSIVE_NO_INITIALIZE)
+        values = chain([state.dict.get('created_at')], history.added or (), history.deleted or ())
+        return {value.date() for value in values if isinstance(value, datetime)}
+
+    def _after_flush(self, session, flush_context) -> None:
+        from app import models
+
+        touched = session.info.setdefault(_SESSION_KEY, (set(), set(), set(), set()))
+        order_days, order_ids, balance_days, driver_ids = touched
+        new, dirty, deleted = session.new, session.dirty, session.deleted
+        for obj in chain(new, dirty, deleted):
+            if isinstance(obj, models.Order):
+                if obj in dirty and not fields_changed(obj, ORDER_FIELDS):
+                    continue
+                days = self._touched_days(obj)
+                if days:
+                    order_days.update(days)
+                elif obj.id is not None:
+                    # created_at заполняется БД (server_default) - день узнаем при пересчёте
+                    order_ids.add(obj.id)
+            elif isinstance(obj, models.BalanceTransaction):
+                if obj in dirty and not fields_changed(obj, BALANCE_FIELDS):
+                    continue
+                balance_days.update(self._touched_days(obj) or {date.today()})
+            elif isinstance(obj, models.Driver):
+                # Таксопарк водителя входит в ключ сводки всех дней его заказов
+                if obj in dirty and obj.id is not None and fields_changed(obj, ('taxi_park',)):
+                    driver_ids.add(obj.id)
+
+    def _after_commit(self, session) -> None:
+        touched = session.info.pop(_SESSION_KEY, None)
+        if touched:
+            order_days, order_ids, balance_days, driver_ids = touched
+            self.mark(order_days, order_ids, balance_days, driver_ids)
+
+    @staticmethod
+    def _after_rollback(session, previous_transaction) -> None:
+        session.info.pop(_SESSION_KEY, None)
+
+    def listen(self, session_factory) -> None:
+        if self._listening:
+            return
+        event.listen(session_factory, 'after_flush', self._after_flush)
+        event.listen(session_factory, 'after_commit', self._after_commit)
+        event.listen(session_factory, 'after_soft_rollback', self._after_rollback)
+        self._listening = True
+
+    def mark(self, order_days: Iterable[date] = (), order_ids: Iterable[int] = (),
+             balance_days: Iterable[date] = (), driver_ids: Iterable[int] = ()) -> None:
+        with self._lock:
+            self._order_days.update(order_days)
+            self._order_ids.update(order_ids)
+            self._balance_days.update(balance_days)
+            self._driver_ids.update(driver_ids)
+
+    def pending(self) -> int:
+        return len(self._order_days) + len(self._order_ids) + len(self._balance_days) + len(self._driver_ids)
+
+    # --- Пересчёт ---
+
+    def _take(self) -> Tuple[Set[date], Set[int], Set[date], Set[int]]:
+        with self._lock:
+            taken = (self._order_days, self._order_ids, self._balance_days, self._driver_ids)
+            self._order_days, self._order_ids, self._balance_days, self._driver_ids = set(), set(), set(), set()
+        return taken
+
+    def refresh(self) -> int:
+        """Пересчитывает отмеченные дни одной транзакцией, возвращает число пересчитанных дней"""
+        from app.database import SessionLocal
+        from app import models
+
+        order_days, order_ids, balance_days, driver_ids = self._take()
+        if not (order_days or order_ids or balance_days or driver_ids):
+            return 0
+
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            connection = db.connection()
+            lock_rebuilds(connection)
+            for column, ids in ((models.Order.id, order_ids), (models.Order.driver_id, driver_ids)):
+                if ids:
+                    rows = db.query(func.date(models.Order.created_at)).filter(column.in_(ids)).distinct().all()
+                    order_days |= {as_date(value) for (value,) in rows if value is not None}
+            for day in order_days:
+                rebuild_orders(connection, day, day + timedelta(days=1))
+            for day in balance_days:
+                rebuild_balance(connection, day, day + timedelta(days=1))
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            # Дни остаются отмеченными - пересчёт повторится на следующем такте
+            self.mark(order_days, order_ids, balance_days, driver_ids)
+            self.failures += 1
+            logger.warning(f"⚠️ Пересчёт дневных сводок аналитики не удался, повтор позже: {e}")
+            return 0
+        finally:
+            db.close()
+
+        refreshed = len(order_days) + len(balance_days)
+        self.refreshed_days += refreshed
+        self.last_refresh_stats = {
+            'order_days': len(order_days),
+            'balance_days': len(balance_days),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+        return refreshed
+
+    def backfill(self, since: Optional[date] = None, until: Optional[date] = None, connection=None) -> int:
+        """
+        Заполняет сводки из истории по ANALYTICS_BACKFILL_CHUNK_DAYS дней за транзакцию.
+        Без since - с первого заказа/транзакции, сводки за более ранние дни удаляются.
+        Повторный запуск даёт тот же результат. Возвращает число обработанных дней.
+        """
+        from app.database import engine
+        from app import models
+
+        if connection is None:
+            with engine.connect() as connection:
+                return self.backfill(since, until, connection)
+
+        until = until or date.today() + timedelta(days=1)
+        try:
+            if since is None:
+                first = [
+                    as_date(connection.execute(select(func.min(func.date(model.created_at)))).scalar())
+                    for model in (models.Order, models.BalanceTransaction)
+                ]
+                since = min((day for day in first if day is not None), default=until)
+                lock_rebuilds(connection)
+                for model in (models.OrderDailyStats, models.BalanceDailyStats):
+                    table = model.__table__
+                    connection.execute(delete(table).where(or_(table.c.day < since, table.c.day >= until)))
+                connection.commit()
+
+            chunk = timedelta(days=settings.ANALYTICS_BACKFILL_CHUNK_DAYS)
+            start = since
+            while start < until:
+                end = min(start + chunk, until)
+                lock_rebuilds(connection)
+                rebuild_orders(connection, start, end)
+                rebuild_balance(connection, start, end)
+                connection.commit()
+                start = end
+        except Exception:
+            connection.rollback()
+            raise
+
+        days = max(0, (until - since).days)
+        logger.info(f"📊 Дневные сводки аналитики заполнены: {since} - {until}, дней: {days}")
+        return days
+
+    @staticmethod
+    def needs_backfill(connection) -> bool:
+        """Заказы есть, а сводок ещё нет (первый запуск после миграции)"""
+        from app import models
+
+        has_stats = connection.execute(select(models.OrderDailyStats.day).limit(1)).first() is not None
+        has_orders = connection.execute(select(models.Order.id).limit(1)).first() is not None
+        return has_orders and not has_stats
+
+    def backfill_if_needed(self) -> int:
+        """
+        Заполнение истории при старте. Его запускают все воркеры всех реплик,
+        а выполняет один: держатель сессионной pg_try_advisory_lock на том же
+        ключе, что и пересчёты. Остальные пропускают заполнение, их пересчёты
+        ждут его окончания на lock_rebuilds. Возвращает число обработанных дней.
+        """
+        from app.database import engine
+
+        key = {'key': settings.ANALYTICS_ROLLUP_LOCK_KEY}
+        with engine.connect() as connection:
+            postgresql = connection.dialect.name == 'postgresql'
+            if postgresql:
+                acquired = connection.execute(text('SELECT pg_try_advisory_lock(:key)'), key).scalar()
+                connection.commit()
+                if not acquired:
+                    logger.info("📊 Сводки аналитики заполняет другой воркер")
+                    return 0
+            try:
+                # Проверяем под блокировкой: другой воркер мог успеть заполнить сводки
+                needed = self.needs_backfill(connection)
+                connection.rollback()
+                return self.backfill(connection=connection) if needed else 0
+            finally:
+                if postgresql:
+                    connection.execute(text('SELECT pg_advisory_unlock(:key)'), key)
+                    connection.commit()
+
+    def _reconcile_if_due(self) -> None:
+        now = time.monotonic()
+        if now - self._last_reconcile < settings.ANALYTICS_ROLLUP_RECONCILE:
+            return
+        self._last_reconcile = now
+        today = date.today()
+        days = [today - timedelta(days=i) for i in range(settings.ANALYTICS_ROLLUP_RECENT_DAYS)]
+        self.mark(order_days=days, balance_days=days)
+
+    async def _loop(self) -> None:
+        try:
+            await asyncio.to_thread(self.backfill_if_needed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка заполнения дневных сводок аналитики: {e}")
+        self._last_reconcile = time.monotonic()
+        while True:
+            await asyncio.sleep(settings.ANALYTICS_ROLLUP_INTERVAL)
+            try:
+                self._reconcile_if_due()
+                await asyncio.to_thread(self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка фонового пересчёта сводок аналитики: {e}")
+
+    def start(self) -> None:
+        from app.database import SessionLocal
+
+        self.listen(SessionLocal)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"🚀 Пересчёт дневных сводок аналитики раз в {settings.ANALYTICS_ROLLUP_INTERVAL} с")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Изменения последних секунд не должны остаться без пересчёта
+        await asyncio.to_thread(self.refresh)
+
+    def stats(self) -> Dict:
+        return {
+            'pending': self.pending(),
+            'refreshed_days': self.refreshed_days,
+            'failures': self.failures,
+            'last_refresh': self.last_refresh_stats
+        }
+
+
+def chart_buckets(period: str, today: Optional[date] = None,
+                  first_day: Optional[date] = None) -> List[Tuple[str, date, date]]:
+    """
+    Интервалы графика за период: (подпись, начало, конец) с концом не включительно.
+    7 - по дням недели, 30 - по 5 дней, 365 - по месяцам, иначе - по годам с first_day.
+    """
+    today = today or date.today()
+    tomorrow = today + timedelta(days=1)
+    if period == '7':
+        return [
+            (WEEKDAYS[day.weekday()], day, day + timedelta(days=1))
+            for day in (today - timedelta(days=i) for i in range(6, -1, -1))
+        ]
+    if period == '30':
+        buckets = []
+        for i in range(5, -1, -1):
+            end = tomorrow - timedelta(days=5 * i)
+            start = end - timedelta(days=5)
+            last = end - timedelta(days=1)
+            buckets.append((f"{start:%d.%m}-{last:%d.%m}", start, end))
+        return buckets
+    if period == '365':
+        buckets = []
+        year, month = today.year, today.month
+        for _ in range(12):
+            start = date(year, month, 1)
+            end = date(year + (month == 12), month % 12 + 1, 1)
+            buckets.append((MONTHS[month - 1], start, min(end, tomorrow)))
+            year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+        return buckets[::-1]
+    first_year = (first_day or today).year
+    return [
+        (str(year), date(year, 1, 1), min(date(year + 1, 1, 1), tomorrow))
+        for year in range(first_year, today.year + 1)
+    ]
+
+
+def bucket_series(buckets: List[Tuple[str, date, date]], series: Dict[date, float]) -> Dict:
+    """Суммирует дневной ряд по интервалам графика"""
+    data = [0.0] * len(buckets)
+    for day, value in series.items():
+        for index, (_, start, end) in enumerate(buckets):
+            if start <= day < end:
+                data[index] += value
+                break
+    return {
+        'labels': [label for label, _, _ in buckets],
+        'data': [round(value) for value in data]
+    }
+
+
+def build_chart(period: str, load_series: Callable[[Optional[date]], Dict[date, float]],
+                today: Optional[date] = None) -> Dict:
+    """Данные графика {labels, data}: load_series(since) возвращает дневной ряд из сводки"""
+    buckets = chart_buckets(period, today)
+    if period in CHART_PERIODS:
+        return bucket_series(buckets, load_series(buckets[0][1]))
+    # За всё время - по годам с первого дня в сводке
+    series = load_series(None)
+    return bucket_series(chart_buckets(period, today, first_day=min(series, default=None)), series)
+
+
+analytics_rollup = AnalyticsRollup()
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import uuid
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy.engine import make_url
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Предел payload у NOTIFY в PostgreSQL - 8000 байт, оставляем запас
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+class ClusterBus:
+    """
+    Рассылка событий между воркерами и репликами через PostgreSQL LISTEN/NOTIFY.
+
+    WebSocket водителя открыт на одном процессе из многих (реплики × воркеры
+    за round-robin), а событие для него возникает на любом: в обработчике
+    запроса или в такте диспетчера на лидере. Событие, адресат которого не
+    подключен к этому воркеру, публикуется в канал CLUSTER_BUS_CHANNEL.
+    Каждый воркер слушает канал отдельным соединением asyncpg и отдаёт
+    события слушателю (set_listener); свои уведомления пропускает по node_id.
+
+    NOTIFY не хранит события: пока соединение переподключается, они теряются,
+    и водитель получает их опросом new-orders. На других БД (SQLite при
+    разработке) канала нет - приложение работает одним процессом.
+    """
+
+    def __init__(self, channel: str = None):
+        self.channel = channel or settings.CLUSTER_BUS_CHANNEL
+        self.node_id = uuid.uuid4().hex[:12]
+        self._listener: Optional[Callable[[Dict], Awaitable[None]]] = None
+        self._connection = None
+        self._send_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None and not self._connection.is_closed()
+
+    def set_listener(self, listener: Callable[[Dict], Awaitable[None]]) -> None:
+        """Корутина, получающая события других воркеров"""
+        self._listener = listener
+
+    async def publish(self, data: Dict) -> bool:
+        """Отправляет событие остальным воркерам; False - канал недоступен"""
+        if not self.connected:
+            return False
+        payload = json.dumps({'node': self.node_id, 'data': data}, ensure_ascii=False, default=str)
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            self.dropped += 1
+            logger.warning(f"⚠️ Событие для других воркеров больше {NOTIFY_PAYLOAD_LIMIT} байт и не отправлено")
+            return False
+        try:
+            # Одно соединение asyncpg не выполняет запросы параллельно
+            async with self._send_lock:
+                await self._connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            self.published += 1
+            return True
+        except Exception as e:
+            self.dropped += 1
+            logger.warning(f"⚠️ Не удалось отправить событие другим воркерам: {e}")
+            return False
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get('node') == self.node_id or self._listener is None:
+            return
+        self.received += 1
+        asyncio.get_running_loop().create_task(self._deliver(message.get('data') or {}))
+
+    async def _deliver(self, data: Dict) -> None:
+        try:
+            await self._listener(data)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка обработки события другого воркера: {e}")
+
+    async def _connect(self):
+        import asyncpg
+        from app.database import SQLALCHEMY_DATABASE_URL
+
+        dsn = make_url(SQLALCHEMY_DATABASE_URL).set(drivername='postgresql').render_as_string(hide_password=False)
+        connection = await asyncpg.connect(dsn)
+        await connection.add_listener(self.channel, self._on_notify)
+        return connection
+
+    async def _close(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            try:
+                await connection.close()
+            except Exception:
+                pass
+
+    async def _run(self) -> None:
+        """Держит слушающее соединение и переподключается после обрыва"""
+        while True:
+            try:
+                self._connection = await self._connect()
+                logger.info(f"📡 Воркер {self.node_id} слушает канал {self.channel}")
+                while not self._connection.is_closed():
+                    await asyncio.sleep(settings.CLUSTER_BUS_PING_INTERVAL)
+                    # Без трафика обрыв соединения не заметен - проверяем запросом
+                    async with self._send_lock:
+                        await self._connection.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Канал событий воркеров недоступен: {e}")
+            await self._close()
+            await asyncio.sleep(settings.CLUSTER_BUS_RECONNECT_DELAY)
+
+    async def start(self) -> None:
+        from app.database import engine
+
+        if engine.dialect.name != 'postgresql':
+            logger.info(f"📡 БД {engine.dialect.name}: события водителям доставляются только в пределах воркера")
+            return
+        self._send_lock = asyncio.Lock()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close()
+
+    def stats(self) -> Dict:
+        return {
+            'node_id': self.node_id,
+            'connected': self.connected,
+            'published': self.published,
+            'received': self.received,
+            'dropped': self.dropped
+        }
+
+
+# Создаем экземпляр канала событий между воркерами
+cluster_bus = ClusterBus()
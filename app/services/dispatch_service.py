@@ -0,0 +1,479 @@
+import asyncio
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text, update
+
+from app.config import settings
+from app.services.driver_index import DriverSpatialIndex, driver_index, normalize_tariff
+
+logger = logging.getLogger(__name__)
+
+# Статусы заказов, ожидающих назначения водителя
+PENDING_ORDER_STATUSES = ["Ожидает водителя", "Ожидает принятия"]
+
+# Статус заказа, предложенного водителю (диспетчером или вручную) до принятия
+OFFERED_ORDER_STATUS = "Назначен"
+
+# Водитель с заказом в этих статусах не получает новых предложений
+ENGAGED_ORDER_STATUSES = [OFFERED_ORDER_STATUS, "Принят", "Выполняется"]
+
+# cost_fn(order, driver, distance_km) -> стоимость назначения или None, если пара недопустима
+CostFunction = Callable[[Dict, Dict, float], Optional[float]]
+
+# eta_provider([((lat, lng) подачи, [(driver_id, lat, lng), ...]), ...]) -> [{driver_id: ETA в секундах}, ...]
+EtaProvider = Callable[[List[Tuple[Tuple[float, float], List[Tuple[int, float, float]]]]], List[Dict[int, float]]]
+
+# listener(новые предложения [(order_id, driver_id, km)], истёкшие [(driver_id, order_id)])
+OfferListener = Callable[[List[Tuple[int, int, float]], List[Tuple[int, int]]], Awaitable[None]]
+
+
+def default_cost(order: Dict, driver: Dict, distance_km: float) -> Optional[float]:
+    """
+    Стоимость назначения по умолчанию: расстояние до подачи, уменьшенное
+    для водителей с высокой активностью. Несовместимый тариф - пара недопустима.
+    """
+    order_tariff = order.get('tariff')
+    driver_tariff = driver.get('tariff')
+    if order_tariff and driver_tariff and order_tariff != driver_tariff:
+        return None
+    activity = max(0, min(100, driver.get('activity') or 0))
+    return distance_km * (1.0 - settings.DISPATCH_ACTIVITY_WEIGHT * activity / 100.0)
+
+
+def claim_order(order_id: int, driver_id: int, **values):
+    """
+    UPDATE, закрепляющий ожидающий заказ за водителем. Срабатывает только у
+    первого из конкурирующих процессов (rowcount 1), остальные получают 0.
+    """
+    from app import models
+
+    Order = models.Order
+    return update(Order).where(
+        Order.id == order_id,
+        Order.driver_id.is_(None),
+        Order.status.in_(PENDING_ORDER_STATUSES)
+    ).values(driver_id=driver_id, **values)
+
+
+def release_offer(order_id: int, driver_id: int):
+    """UPDATE, возвращающий предложенный диспетчером заказ в ожидание"""
+    from app import models
+
+    Order = models.Order
+    return update(Order).where(
+        Order.id == order_id,
+        Order.driver_id == driver_id,
+        Order.status == OFFERED_ORDER_STATUS,
+        Order.offer_expires_at.isnot(None)
+    ).values(driver_id=None, status=PENDING_ORDER_STATUSES[0], offer_expires_at=None)
+
+
+def eta_cost(order: Dict, driver: Dict, distance_km: float) -> Optional[float]:
+    """
+    Стоимость по времени подачи (ETA, сек) вместо расстояния: водитель за
+    рекой или в пробке проигрывает более дальнему, но быстрому. Без ETA -
+    расстояние по умолчанию, пересчитанное в секунды по средней скорости.
+    """
+    base = default_cost(order, driver, distance_km)
+    if base is None:
+        return None
+    eta = driver.get('eta')
+    if eta is None:
+        return base / settings.ETA_FALLBACK_SPEED_KMH * 3600
+    activity = max(0, min(100, driver.get('activity') or 0))
+    return eta * (1.0 - settings.DISPATCH_ACTIVITY_WEIGHT * activity / 100.0)
+
+
+class DispatchEngine:
+    """
+    Пакетное распределение заказов по водителям.
+
+    Раз в DISPATCH_TICK_MS собирает все ожидающие заказы и свободных водителей
+    из пространственного индекса, строит для каждого заказа ограниченный набор
+    ближайших кандидатов и жадно назначает пары с минимальной стоимостью.
+    Предложение сохраняется в самом заказе: driver_id водителя, статус
+    "Назначен" и offer_expires_at, поэтому его видят new-orders и accept-order
+    любого воркера. Отказы хранятся в order_offer_declines.
+
+    Такты ведёт один процесс на все реплики - держатель pg_advisory_lock
+    (DISPATCH_LEADER_LOCK_KEY) на отдельном соединении; остальные воркеры
+    пропускают такт. Упал лидер - соединение закрылось, блокировку берёт
+    другой воркер. Пространственный индекс лидера дополняется позициями из
+    drivers, которые записали остальные воркеры.
+    """
+
+    def __init__(self, index: DriverSpatialIndex = None, cost_fn: CostFunction = None,
+                 candidates_per_order: int = None, offer_ttl: float = None):
+        self.index = index or driver_index
+        self.cost_fn = cost_fn or default_cost
+        self.candidates_per_order = candidates_per_order or settings.DISPATCH_CANDIDATES_PER_ORDER
+        self.offer_ttl = offer_ttl if offer_ttl is not None else settings.DISPATCH_OFFER_TTL
+
+        # Предложения, выданные этим процессом: driver_id -> (order_id, истекает в) и order_id -> driver_id.
+        # Источник истины - заказы в БД. Меняют поток такта и цикл событий (accept/decline)
+        self._offers: Dict[int, Tuple[int, float]] = {}
+        self._offered_orders: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        # Соединение, держащее блокировку лидера (PostgreSQL)
+        self._leader_connection = None
+
+        # События последнего такта для push-уведомлений водителям
+        self._new_offers: List[Tuple[int, int, float]] = []
+        self._expired_offers: List[Tuple[int, int]] = []
+        self._offer_listener: Optional[OfferListener] = None
+        self._eta_provider: Optional[EtaProvider] = None
+
+        self._task: Optional[asyncio.Task] = None
+        self.last_tick_stats: Dict = {}
+
+    def set_cost_function(self, cost_fn: CostFunction) -> None:
+        """Подменяет функцию стоимости (например, на ETA из матрицы 2GIS)"""
+        self.cost_fn = cost_fn
+
+    def set_eta_provider(self, provider: Optional[EtaProvider]) -> None:
+        """Источник ETA кандидатов (матрица 2GIS), значения попадают в driver['eta'] для cost_fn"""
+        self._eta_provider = provider
+
+    def set_offer_listener(self, listener: Optional[OfferListener]) -> None:
+        """Подписка на новые и истёкшие предложения (например, push по WebSocket)"""
+        self._offer_listener = listener
+
+    # --- Сопоставление ---
+
+    def match(self, orders: Iterable[Dict],
+              activity_lookup: Optional[Callable[[Set[int]], Dict[int, int]]] = None,
+              exclude_drivers: Optional[Set[int]] = None,
+              declined: Optional[Dict[int, Set[int]]] = None) -> List[Tuple[int, int, float]]:
+        """
+        Пакетное сопоставление заказов и водителей.
+
+        Args:
+            orders: Заказы вида {'id', 'lat', 'lng', 'tariff'}
+            activity_lookup: Функция, возвращающая активность водителей по их id
+            exclude_drivers: Водители, которых нельзя назначать (уже есть предложение или поездка)
+            declined: order_id -> водители, отказавшиеся от заказа
+
+        Returns:
+            Список (order_id, driver_id, distance_km)
+        """
+        exclude_drivers = exclude_drivers or set()
+        declined = declined or {}
+        candidates: List[Tuple[Dict, int, float]] = []
+        driver_ids: Set[int] = set()
+        eta_requests = []
+
+        for order in orders:
+            excluded = exclude_drivers | declined.get(order['id'], set())
+            nearest = self.index.nearest(
+                order['lat'], order['lng'],
+                k=self.candidates_per_order,
+                tariff=order.get('tariff'),
+                exclude=excluded
+            )
+            for driver_id, distance in nearest:
+                candidates.append((order, driver_id, distance))
+                driver_ids.add(driver_id)
+            if self._eta_provider and nearest:
+                points = []
+                for driver_id, _ in nearest:
+                    entry = self.index.get(driver_id)
+                    if entry:
+                        points.append((driver_id, entry['lat'], entry['lng']))
+                eta_requests.append((order['id'], (order['lat'], order['lng']), points))
+
+        activity = activity_lookup(driver_ids) if activity_lookup and driver_ids else {}
+
+        # Один запрос матрицы на заказ: ETA всех его кандидатов
+        etas: Dict[Tuple[int, int], float] = {}
+        if eta_requests:
+            answers = self._eta_provider([(pickup, points) for _, pickup, points in eta_requests])
+            for (order_id, _, _), answer in zip(eta_requests, answers):
+                for driver_id, seconds in answer.items():
+                    etas[(order_id, driver_id)] = seconds
+
+        edges: List[Tuple[float, float, int, int]] = []
+        for order, driver_id, distance in candidates:
+            entry = self.index.get(driver_id)
+            driver = {
+                'id': driver_id,
+                'tariff': entry['tariff'] if entry else None,
+                'activity': activity.get(driver_id, 0),
+                'eta': etas.get((order['id'], driver_id))
+            }
+            cost = self.cost_fn(
+                {'id': order['id'], 'lat': order['lat'], 'lng': order['lng'],
+                 'tariff': normalize_tariff(order.get('tariff'))},
+                driver, distance
+            )
+            if cost is not None:
+                edges.append((cost, distance, order['id'], driver_id))
+
+        # Жадное назначение: самые дешёвые пары первыми
+        edges.sort()
+        assigned_orders: Set[int] = set()
+        assigned_drivers: Set[int] = set()
+        assignments: List[Tuple[int, int, float]] = []
+        for cost, distance, order_id, driver_id in edges:
+            if order_id in assigned_orders or driver_id in assigned_drivers:
+                continue
+            assigned_orders.add(order_id)
+            assigned_drivers.add(driver_id)
+            assignments.append((order_id, driver_id, distance))
+
+        return assignments
+
+    # --- Предложения ---
+
+    def decline(self, driver_id: int, order_id: int) -> None:
+        """Водитель отказался от заказа (отказ в БД записывает обработчик) - предложение закрыто"""
+        with self._lock:
+            self._drop_offer(driver_id, order_id)
+
+    def accept(self, driver_id: int, order_id: int) -> None:
+        """Водитель принял заказ - предложение закрыто"""
+        with self._lock:
+            self._drop_offer(driver_id, order_id)
+
+    def _drop_offer(self, driver_id: int, order_id: int) -> None:
+        offer = self._offers.get(driver_id)
+        if offer is not None and offer[0] == order_id:
+            del self._offers[driver_id]
+        if self._offered_orders.get(order_id) == driver_id:
+            del self._offered_orders[order_id]
+
+    # --- Лидер ---
+
+    def _is_leader(self) -> bool:
+        """
+        Ведёт ли этот процесс такты. В PostgreSQL - держатель сессионной
+        pg_advisory_lock на отдельном соединении; в остальных СУБД (разработка,
+        один процесс) - всегда.
+        """
+        from app.database import engine
+
+        if engine.dialect.name != 'postgresql':
+            return True
+        if self._leader_connection is not None:
+            try:
+                self._leader_connection.exec_driver_sql('SELECT 1')
+                self._leader_connection.commit()
+                return True
+            except Exception as e:
+                # Соединение потеряно - блокировка снята сервером, лидерство надо взять заново
+                logger.warning(f"⚠️ Соединение лидера диспетчера потеряно: {e}")
+                self._leader_connection.invalidate()
+                self._leader_connection = None
+
+        connection = engine.connect()
+        try:
+            acquired = connection.execute(
+                text('SELECT pg_try_advisory_lock(:key)'), {'key': settings.DISPATCH_LEADER_LOCK_KEY}
+            ).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+        if not acquired:
+            connection.close()
+            return False
+        self._leader_connection = connection
+        logger.info("👑 Такты диспетчера ведёт этот воркер")
+        return True
+
+    def _resign(self) -> None:
+        """Снимает блокировку лидера. invalidate, а не close: сессионная блокировка пережила бы возврат соединения в пул"""
+        connection, self._leader_connection = self._leader_connection, None
+        if connection is None:
+            return
+        try:
+            connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': settings.DISPATCH_LEADER_LOCK_KEY})
+            connection.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось снять блокировку лидера диспетчера: {e}")
+        connection.invalidate()
+
+    # --- Такт диспетчеризации ---
+
+    def _release_expired(self, db, now: float) -> List[Tuple[int, int]]:
+        """Возвращает в ожидание заказы с истёкшим предложением, водитель считается отказавшимся"""
+        from app import models
+
+        Order = models.Order
+        rows = db.query(Order.id, Order.driver_id).filter(
+            Order.offer_expires_at < datetime.fromtimestamp(now),
+            Order.status == OFFERED_ORDER_STATUS
+        ).all()
+        expired = []
+        for order_id, driver_id in rows:
+            # Водитель мог принять заказ после выборки - тогда UPDATE ничего не меняет
+            if db.execute(release_offer(order_id, driver_id)).rowcount:
+                db.merge(models.OrderOfferDecline(order_id=order_id, driver_id=driver_id))
+                expired.append((driver_id, order_id))
+        return expired
+
+    def _sync_index(self, db, now: float) -> Set[int]:
+        """
+        Дополняет индекс позициями из drivers (их пишут все воркеры) и
+        возвращает водителей с предложением или поездкой.
+        """
+        from app import models
+
+        Driver, Order = models.Driver, models.Order
+        drivers = db.query(
+            Driver.id, Driver.current_lat, Driver.current_lng, Driver.tariff, Driver.last_location_update
+        ).filter(
+            Driver.last_location_update >= datetime.fromtimestamp(now - self.index.ttl),
+            Driver.current_lat.isnot(None),
+            Driver.current_lng.isnot(None)
+        ).all()
+        driver_ids = {row.id for row in drivers} | set(self.index.driver_ids())
+        engaged: Set[int] = set()
+        if driver_ids:
+            engaged = {driver_id for (driver_id,) in db.query(Order.driver_id).filter(
+                Order.driver_id.in_(driver_ids),
+                Order.status.in_(ENGAGED_ORDER_STATUSES)
+            ).distinct()}
+
+        for row in drivers:
+            timestamp = row.last_location_update.timestamp()
+            entry = self.index.get(row.id)
+            # Позиция, пришедшая в этот воркер позже записи в БД, свежее
+            if entry is None or entry['updated_at'] < timestamp:
+                self.index.update(row.id, row.current_lat, row.current_lng, tariff=row.tariff,
+                                  busy=row.id in engaged, timestamp=timestamp)
+        for driver_id in driver_ids:
+            self.index.set_busy(driver_id, driver_id in engaged)
+        return engaged
+
+    def run_tick(self) -> Dict:
+        """Один проход диспетчера: загрузка заказов, сопоставление, выдача предложений"""
+        from app.database import SessionLocal
+        from app import models
+        from app.services.analytics_rollup import analytics_rollup
+
+        started = time.perf_counter()
+        now = time.time()
+        if not self._is_leader():
+            self._new_offers, self._expired_offers = [], []
+            self.last_tick_stats = {'leader': False}
+            return self.last_tick_stats
+
+        Order = models.Order
+        db = SessionLocal()
+        try:
+            expired = self._release_expired(db, now)
+            engaged = self._sync_index(db, now)
+            self.index.purge_stale(now)
+
+            rows = db.query(
+                Order.id,
+                Order.origin_lat,
+                Order.origin_lng,
+                Order.tariff
+            ).filter(
+                Order.status.in_(PENDING_ORDER_STATUSES),
+                Order.driver_id.is_(None)
+            ).order_by(Order.created_at.desc()).limit(settings.DISPATCH_MAX_ORDERS).all()
+
+            # Заказы без координат подачи по расстоянию не распределить - их предлагает резервный подбор new-orders
+            orders = [
+                {'id': row.id, 'lat': row.origin_lat, 'lng': row.origin_lng, 'tariff': row.tariff}
+                for row in rows
+                if row.origin_lat is not None and row.origin_lng is not None
+            ]
+            declined: Dict[int, Set[int]] = {}
+            if orders:
+                for order_id, driver_id in db.query(
+                    models.OrderOfferDecline.order_id, models.OrderOfferDecline.driver_id
+                ).filter(models.OrderOfferDecline.order_id.in_([order['id'] for order in orders])):
+                    declined.setdefault(order_id, set()).add(driver_id)
+
+            def activity_lookup(driver_ids: Set[int]) -> Dict[int, int]:
+                return dict(db.query(models.Driver.id, models.Driver.activity).filter(
+                    models.Driver.id.in_(driver_ids)
+                ).all())
+
+            assignments = self.match(orders, activity_lookup, exclude_drivers=engaged, declined=declined)
+
+            expires_at = now + self.offer_ttl
+            offered = []
+            for order_id, driver_id, distance in assignments:
+                # Заказ мог принять водитель из резервного подбора - тогда предложения нет
+                claimed = db.execute(claim_order(
+                    order_id, driver_id,
+                    status=OFFERED_ORDER_STATUS, offer_expires_at=datetime.fromtimestamp(expires_at)
+                ))
+                if claimed.rowcount:
+                    offered.append((order_id, driver_id, distance))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        # UPDATE в обход ORM: дни этих заказов в сводках аналитики отмечаем сами
+        analytics_rollup.mark(order_ids=[order_id for _, order_id in expired] + [a[0] for a in offered])
+        with self._lock:
+            for driver_id, order_id in expired:
+                self._drop_offer(driver_id, order_id)
+            for order_id, driver_id, _ in offered:
+                self._offers[driver_id] = (order_id, expires_at)
+                self._offered_orders[order_id] = driver_id
+            active_offers = len(self._offers)
+        self._new_offers = offered
+        self._expired_offers = expired
+
+        self.last_tick_stats = {
+            'leader': True,
+            'pending_orders': len(rows),
+            'matched': len(offered),
+            'expired': len(expired),
+            'active_offers': active_offers,
+            'avg_pickup_km': round(sum(a[2] for a in offered) / len(offered), 3) if offered else None,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+        if offered:
+            logger.info(f"🚕 Диспетчер: назначено {len(offered)} заказов, {self.last_tick_stats}")
+        return self.last_tick_stats
+
+    async def _loop(self) -> None:
+        interval = settings.DISPATCH_TICK_MS / 1000.0
+        while True:
+            try:
+                await asyncio.to_thread(self.run_tick)
+                if self._offer_listener and (self._new_offers or self._expired_offers):
+                    await self._offer_listener(self._new_offers, self._expired_offers)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка такта диспетчера: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"🚀 Диспетчер запущен, такт {settings.DISPATCH_TICK_MS} мс")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await asyncio.to_thread(self._resign)
+            logger.info("🛑 Диспетчер остановлен")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+
+# Создаем экземпляр диспетчера
+dispatch_engine = DispatchEngine()
@@ -0,0 +1,89 @@
+"""
+Расстояния между координатами без итеративного geodesic.
+
+distance_km - быстрый путь: равнопромежуточная проекция с радиусами
+кривизны эллипсоида WGS84 (меридиан M и первый вертикал N) на средней
+широте пары. haversine_km - сфера среднего радиуса. Векторное ядро
+distance_one_to_many считает ту же формулу на NumPy для кандидатов
+индекса водителей (services/driver_index.py).
+
+Погрешность относительно geopy geodesic (WGS84) на широтах Оша (40.5°)
+и Бишкека (42.9°), случайные пары в квадрате со стороной 2R
+(см. benchmark_distance.py):
+
+    R, км         distance_km            haversine_km
+    1-5           < 0.0001% (< 1 см)     до 0.27%
+    20            < 0.0003% (0.15 м)     до 0.27%
+    50            < 0.002%  (2.3 м)      до 0.27%
+    200           < 0.03%   (140 м)      до 0.28%
+
+Ошибка haversine - сжатие Земли (в направлении запад-восток сфера
+короче на ~0.26%), ошибка проекции растёт с квадратом расстояния, поэтому
+для пар дальше MAX_LOCAL_DEGREES distance_km переходит на haversine.
+Векторное ядро такого переключения не делает: оно рассчитано на точки
+в пределах радиуса поиска водителей.
+"""
+
+import math
+from typing import Sequence, Union
+
+import numpy as np
+
+# Средний радиус Земли (IUGG) и эллипсоид WGS84
+EARTH_RADIUS_KM = 6371.0088
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+# Километров в градусе широты на сфере среднего радиуса
+KM_PER_DEGREE = math.pi / 180 * EARTH_RADIUS_KM
+
+# Дальше по широте/долготе локальная проекция уступает haversine
+MAX_LOCAL_DEGREES = 10.0
+
+ArrayLike = Union[Sequence[float], np.ndarray]
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Расстояние по большому кругу на сфере среднего радиуса, км"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Расстояние в км: локальная проекция на эллипсоиде, для дальних пар - haversine"""
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    if abs(dlat) > MAX_LOCAL_DEGREES or abs(dlng) > MAX_LOCAL_DEGREES:
+        return haversine_km(lat1, lng1, lat2, lng2)
+    phi = math.radians((lat1 + lat2) / 2)
+    sin_phi = math.sin(phi)
+    w = 1 - WGS84_E2 * sin_phi * sin_phi
+    n = WGS84_A_KM / math.sqrt(w)
+    m = WGS84_A_KM * (1 - WGS84_E2) / (w * math.sqrt(w))
+    x = math.radians(dlng) * n * math.cos(phi)
+    y = math.radians(dlat) * m
+    return math.sqrt(x * x + y * y)
+
+
+def _local_km(lat1: np.ndarray, lng1: np.ndarray, lat2: np.ndarray, lng2: np.ndarray) -> np.ndarray:
+    phi = np.radians((lat1 + lat2) * 0.5)
+    sin_phi = np.sin(phi)
+    w = 1 - WGS84_E2 * sin_phi * sin_phi
+    sqrt_w = np.sqrt(w)
+    x = np.radians(lng2 - lng1) * (WGS84_A_KM / sqrt_w) * np.cos(phi)
+    y = np.radians(lat2 - lat1) * (WGS84_A_KM * (1 - WGS84_E2) / (w * sqrt_w))
+    return np.hypot(x, y)
+
+
+def distance_one_to_many(lat: float, lng: float, lats: ArrayLike, lngs: ArrayLike) -> np.ndarray:
+    """Расстояния (км) от одной точки до массива точек"""
+    return _local_km(
+        np.float64(lat), np.float64(lng),
+        np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)
+    )
+
@@ -0,0 +1,306 @@
+import math
+import threading
+import time
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.distance import EARTH_RADIUS_KM, distance_one_to_many
+
+logger = logging.getLogger(__name__)
+
+# Приведение тарифов водителей (БД) и тарифов заказов (frontend) к общему классу
+TARIFF_CLASSES = {
+    'Бюджетный': 'economy',
+    'Эконом': 'economy',
+    'economy': 'economy',
+    'Стандартный': 'comfort',
+    'Стандарт': 'comfort',
+    'Комфорт': 'comfort',
+    'comfort': 'comfort',
+    'Комфорт+': 'comfort-plus',
+    'comfort-plus': 'comfort-plus',
+    'Бизнес': 'business',
+    'Люкс': 'business',
+    'business': 'business',
+    'premium': 'business',
+}
+
+
+def normalize_tariff(tariff: Optional[str]) -> Optional[str]:
+    """Возвращает класс тарифа или None, если тариф не указан/неизвестен"""
+    if not tariff:
+        return None
+    tariff = tariff.strip()
+    return TARIFF_CLASSES.get(tariff) or TARIFF_CLASSES.get(tariff.lower())
+
+
+class DriverSpatialIndex:
+    """
+    Пространственный индекс водителей на линии (равномерная сетка по lat/lng).
+
+    Ячейки ведутся отдельно по классам тарифа, каждая хранит множество
+    слотов водителей. Координаты, занятость и время обновления лежат в
+    массивах NumPy по слотам: кандидаты из собранных колец отбираются и
+    меряются одним вызовом distance_one_to_many (та же формула, что
+    distance_km). Поиск k ближайших идёт кольцами ячеек от точки запроса
+    и останавливается, как только следующее кольцо гарантированно дальше
+    найденных кандидатов или радиуса поиска.
+    """
+
+    def __init__(self, cell_deg: float = None, ttl: float = None):
+        self.cell_deg = cell_deg or settings.DRIVER_INDEX_CELL_DEG
+        self.ttl = ttl if ttl is not None else settings.DRIVER_LOCATION_TTL
+
+        # driver_id -> (lat, lng, tariff_class, busy, updated_at)
+        self._drivers: Dict[int, Tuple[float, float, Optional[str], bool, float]] = {}
+        # driver_id -> (tariff_class, row, col); ячейка -> слоты водителей
+        self._cell_of: Dict[int, Tuple[Optional[str], int, int]] = {}
+        self._cells: Dict[Tuple[Optional[str], int, int], Set[int]] = {}
+        self._tariff_classes: Dict[Optional[str], int] = {}
+        self._lock = threading.RLock()
+
+        # Слоты: driver_id -> номер строки в массивах, освободившиеся слоты
+        self._slot_of: Dict[int, int] = {}
+        self._free_slots: List[int] = []
+        self._slot_ids = np.zeros(0, dtype=np.int64)
+        self._lat = np.zeros(0)
+        self._lng = np.zeros(0)
+        self._busy = np.zeros(0, dtype=bool)
+        self._updated = np.zeros(0)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def _take_slot(self, driver_id: int) -> int:
+        if not self._free_slots:
+            size = len(self._lat)
+            grown = max(64, size * 2)
+            self._slot_ids = np.resize(self._slot_ids, grown)
+            self._lat = np.resize(self._lat, grown)
+            self._lng = np.resize(self._lng, grown)
+            self._busy = np.resize(self._busy, grown)
+            self._updated = np.resize(self._updated, grown)
+            self._free_slots = list(range(grown - 1, size - 1, -1))
+        slot = self._free_slots.pop()
+        self._slot_of[driver_id] = slot
+        self._slot_ids[slot] = driver_id
+        return slot
+
+    def __len__(self) -> int:
+        return len(self._drivers)
+
+    def __contains__(self, driver_id: int) -> bool:
+        return driver_id in self._drivers
+
+    def update(self, driver_id: int, lat: float, lng: float,
+               tariff: Optional[str] = None, busy: Optional[bool] = None,
+               timestamp: Optional[float] = None) -> None:
+        """Добавляет водителя или обновляет его позицию"""
+        now = timestamp if timestamp is not None else time.time()
+        row, col = self._cell(lat, lng)
+        with self._lock:
+            previous = self._drivers.get(driver_id)
+            if busy is None:
+                busy = previous[3] if previous else False
+            tariff_class = normalize_tariff(tariff) if tariff is not None else (previous[2] if previous else None)
+
+            slot = self._slot_of.get(driver_id)
+            if slot is None:
+                slot = self._take_slot(driver_id)
+            cell = (tariff_class, row, col)
+            old_cell = self._cell_of.get(driver_id)
+            if old_cell != cell:
+                if old_cell is not None:
+                    self._discard(slot, old_cell)
+                self._cells.setdefault(cell, set()).add(slot)
+                self._cell_of[driver_id] = cell
+                self._tariff_classes[tariff_class] = self._tariff_classes.get(tariff_class, 0) + 1
+
+            self._drivers[driver_id] = (lat, lng, tariff_class, busy, now)
+            self._lat[slot] = lat
+            self._lng[slot] = lng
+            self._busy[slot] = busy
+            self._updated[slot] = now
+
+    def driver_ids(self) -> List[int]:
+        with self._lock:
+            return list(self._drivers)
+
+    def set_busy(self, driver_id: int, busy: bool) -> None:
+        """Помечает водителя занятым/свободным (если он есть в индексе)"""
+        with self._lock:
+            entry = self._drivers.get(driver_id)
+            if entry is not None:
+                self._drivers[driver_id] = (entry[0], entry[1], entry[2], busy, entry[4])
+                self._busy[self._slot_of[driver_id]] = busy
+
+    def remove(self, driver_id: int) -> None:
+        """Удаляет водителя из индекса (ушёл с линии)"""
+        with self._lock:
+            self._drivers.pop(driver_id, None)
+            slot = self._slot_of.pop(driver_id, None)
+            if slot is None:
+                return
+            cell = self._cell_of.pop(driver_id, None)
+            if cell is not None:
+                self._discard(slot, cell)
+            self._free_slots.append(slot)
+
+    def _discard(self, slot: int, cell: Tuple[Optional[str], int, int]) -> None:
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.discard(slot)
+            if not bucket:
+                del self._cells[cell]
+        count = self._tariff_classes.get(cell[0], 0) - 1
+        if count > 0:
+            self._tariff_classes[cell[0]] = count
+        else:
+            self._tariff_classes.pop(cell[0], None)
+
+    def get(self, driver_id: int) -> Optional[Dict]:
+        entry = self._drivers.get(driver_id)
+        if entry is None:
+            return None
+        lat, lng, tariff_class, busy, updated_at = entry
+        return {'lat': lat, 'lng': lng, 'tariff': tariff_class, 'busy': busy, 'updated_at': updated_at}
+
+    def purge_stale(self, now: Optional[float] = None) -> int:
+        """Удаляет водителей без обновлений дольше TTL, возвращает их количество"""
+        now = now if now is not None else time.time()
+        with self._lock:
+            stale = [driver_id for driver_id, entry in self._drivers.items() if now - entry[4] > self.ttl]
+            for driver_id in stale:
+                self.remove(driver_id)
+        if stale:
+            logger.info(f"🧹 Из индекса водителей удалено неактивных: {len(stale)}")
+        return len(stale)
+
+    def nearest(self, lat: float, lng: float, k: int = 1,
+                radius_km: Optional[float] = None, tariff: Optional[str] = None,
+                free_only: bool = True, exclude: Optional[Set[int]] = None,
+                now: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        k ближайших водителей к точке.
+
+        Args:
+            lat, lng: Точка поиска (например, точка подачи)
+            k: Сколько водителей вернуть
+            radius_km: Максимальное расстояние (по умолчанию ORDER_OFFER_RADIUS_KM)
+            tariff: Тариф заказа; None - подходит любой водитель
+            free_only: Пропускать занятых водителей
+            exclude: id водителей, которых не нужно учитывать
+
+        Returns:
+            Список (driver_id, расстояние в км), отсортированный по расстоянию
+        """
+        if k <= 0:
+            return []
+        radius_km = radius_km if radius_km is not None else settings.ORDER_OFFER_RADIUS_KM
+        now = now if now is not None else time.time()
+        tariff_class = normalize_tariff(tariff)
+
+        # Размер ячейки в км (по долготе ячейка уже, берём меньшую сторону)
+        cell_km_lat = self.cell_deg * math.pi / 180 * EARTH_RADIUS_KM
+        cell_km = cell_km_lat * max(0.05, math.cos(math.radians(lat)))
+        max_ring = int(math.ceil(radius_km / cell_km)) + 1
+
+        # Км на градус по осям - только для границ колец. Расстояния считаются
+        # на эллипсоиде, по меридиану он короче сферы на ~0.2%: границы с запасом
+        km_per_deg_lat = math.pi / 180 * EARTH_RADIUS_KM
+        km_per_deg_lng = km_per_deg_lat * math.cos(math.radians(lat))
+        ring_margin = 0.99
+
+        center_row, center_col = self._cell(lat, lng)
+        found: List[Tuple[float, int]] = []
+
+        # Расстояние от точки до ближайшей границы её ячейки
+        edge_km = min(
+            (lat - center_row * self.cell_deg) * km_per_deg_lat,
+            ((center_row + 1) * self.cell_deg - lat) * km_per_deg_lat,
+            (lng - center_col * self.cell_deg) * km_per_deg_lng,
+            ((center_col + 1) * self.cell_deg - lng) * km_per_deg_lng
+        )
+
+        with self._lock:
+            # Водители без тарифа подходят к любому заказу, заказ без тарифа - любому водителю
+            if tariff_class:
+                classes = [c for c in (tariff_class, None) if c in self._tariff_classes]
+            else:
+                classes = list(self._tariff_classes)
+
+            # Кольца собираются пачками: пока k-й кандидат не найден - пока в пачке
+            # не наберётся k слотов, после - все кольца, которые могут оказаться
+            # ближе k-го. На запрос выходит 1-3 вызова векторного ядра
+            ring = 0
+            last_ring = max_ring
+            while ring <= last_ring:
+                slots: List[int] = []
+                self._collect(center_row, center_col, ring, classes, slots)
+                ring += 1
+                while ring <= last_ring and (len(found) >= k or len(slots) < k - len(found)):
+                    self._collect(center_row, center_col, ring, classes, slots)
+                    ring += 1
+                if slots:
+                    found.extend(self._within(lat, lng, radius_km, slots, free_only, exclude, now))
+                    found.sort()
+                    del found[k:]
+                if len(found) >= k:
+                    # Все точки кольца r (r >= 1) находятся не ближе edge_km + (r - 1) * cell_km
+                    reach = (found[k - 1][0] / ring_margin - edge_km) / cell_km
+                    last_ring = min(last_ring, int(math.floor(reach)) + 1)
+
+        return [(driver_id, round(distance, 3)) for distance, driver_id in found[:k]]
+
+    def _collect(self, center_row: int, center_col: int, ring: int,
+                 classes: List[Optional[str]], slots: List[int]) -> None:
+        """Добавляет в slots слоты водителей кольца ring"""
+        for row, col in self._ring_cells(center_row, center_col, ring):
+            for cls in classes:
+                bucket = self._cells.get((cls, row, col))
+                if bucket:
+                    slots.extend(bucket)
+
+    def _within(self, lat: float, lng: float, radius_km: float, slots: List[int],
+                free_only: bool, exclude: Optional[Set[int]], now: float) -> List[Tuple[float, int]]:
+        """(расстояние, driver_id) подходящих водителей из slots в радиусе"""
+        index = np.fromiter(slots, dtype=np.intp, count=len(slots))
+        keep = now - self._updated[index] <= self.ttl
+        if free_only:
+            keep &= ~self._busy[index]
+        index = index[keep]
+        distances = distance_one_to_many(lat, lng, self._lat[index], self._lng[index])
+        inside = distances <= radius_km
+        pairs = zip(distances[inside].tolist(), self._slot_ids[index[inside]].tolist())
+        if exclude:
+            return [(distance, driver_id) for distance, driver_id in pairs if driver_id not in exclude]
+        return list(pairs)
+
+    @staticmethod
+    def _ring_cells(row: int, col: int, ring: int):
+        if ring == 0:
+            yield (row, col)
+            return
+        for dc in range(-ring, ring + 1):
+            yield (row - ring, col + dc)
+            yield (row + ring, col + dc)
+        for dr in range(-ring + 1, ring):
+            yield (row + dr, col - ring)
+            yield (row + dr, col + ring)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            busy = sum(1 for entry in self._drivers.values() if entry[3])
+            return {
+                'drivers': len(self._drivers),
+                'busy': busy,
+                'free': len(self._drivers) - busy,
+                'cells': len(self._cells)
+            }
+
+
+# Создаем экземпляр индекса
+driver_index = DriverSpatialIndex()
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from fastapi import WebSocket
+
+from app.config import settings
+from app.services.cluster_bus import cluster_bus
+
+logger = logging.getLogger(__name__)
+
+
+class DriverConnectionManager:
+    """
+    Реестр WebSocket-соединений водителей в пределах одного воркера.
+
+    На водителя держится одно соединение: повторное подключение (reconnect)
+    вытесняет старое. Число соединений ограничено DRIVER_WS_MAX_CONNECTIONS,
+    сверх лимита клиент получает код 1013 и остаётся на HTTP-опросе.
+
+    Водитель может быть подключен к любому воркеру любой реплики: событие
+    для водителя, которого здесь нет, уходит остальным воркерам через
+    cluster_bus (deliver), а они доставляют его своим соединением (receive).
+    """
+
+    def __init__(self, max_connections: int = None):
+        self.max_connections = max_connections or settings.DRIVER_WS_MAX_CONNECTIONS
+        self._connections: Dict[int, WebSocket] = {}
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def is_connected(self, driver_id: int) -> bool:
+        return driver_id in self._connections
+
+    async def connect(self, driver_id: int, websocket: WebSocket) -> bool:
+        """Принимает соединение; False - лимит соединений воркера исчерпан"""
+        previous = self._connections.get(driver_id)
+        if previous is None and len(self._connections) >= self.max_connections:
+            logger.warning(f"⚠️ Лимит WebSocket-соединений ({self.max_connections}) исчерпан, водитель {driver_id} остаётся на опросе")
+            await websocket.close(code=1013)
+            return False
+
+        await websocket.accept()
+        self._connections[driver_id] = websocket
+
+        if previous is not None:
+            # Переподключение: закрываем устаревшее соединение
+            try:
+                await previous.close(code=4000)
+            except Exception:
+                pass
+        logger.info(f"🔌 Водитель {driver_id} подключился по WebSocket (всего: {len(self._connections)})")
+        return True
+
+    def disconnect(self, driver_id: int, websocket: WebSocket) -> None:
+        if self._connections.get(driver_id) is websocket:
+            del self._connections[driver_id]
+            logger.info(f"🔌 Водитель {driver_id} отключился от WebSocket (всего: {len(self._connections)})")
+
+    async def send(self, driver_id: int, message: Dict) -> bool:
+        """Отправляет событие водителю; False - водитель не подключен к этому воркеру"""
+        websocket = self._connections.get(driver_id)
+        if websocket is None:
+            return False
+        try:
+            await asyncio.wait_for(websocket.send_json(message), timeout=settings.DRIVER_WS_SEND_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось отправить событие водителю {driver_id}: {e}")
+            self.disconnect(driver_id, websocket)
+            return False
+
+    async def deliver(self, driver_id: int, message: Dict) -> bool:
+        """Отправляет событие водителю, к какому бы воркеру он ни был подключен"""
+        if driver_id in self._connections:
+            return await self.send(driver_id, message)
+        return await cluster_bus.publish({'driver_id': driver_id, 'message': message})
+
+    async def receive(self, data: Dict) -> None:
+        """Событие от другого воркера: доставляем, если водитель подключен сюда"""
+        driver_id = data.get('driver_id')
+        if driver_id in self._connections:
+            await self.send(driver_id, data['message'])
+
+    def notify(self, driver_id: Optional[int], message: Dict) -> None:
+        """Отправка события без ожидания (из синхронного кода обработчиков)"""
+        if driver_id is None:
+            return
+        try:
+            asyncio.get_running_loop().create_task(self.deliver(driver_id, message))
+        except RuntimeError:
+            # Нет активного цикла событий (вызов из потока) - водитель получит событие опросом
+            pass
+
+
+# Создаем экземпляр менеджера соединений
+driver_connections = DriverConnectionManager()
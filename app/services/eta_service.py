@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.services import geohash
+from app.services.distance import distance_km
+from app.services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# (driver_id, lat, lng)
+DriverPoint = Tuple[int, float, float]
+
+# Окна бюджета матриц: (scope в api_quota_usage, длина окна)
+QUOTA_MINUTE = ('eta_matrix:minute', timedelta(minutes=1))
+QUOTA_DAY = ('eta_matrix:day', timedelta(days=1))
+
+
+class EtaService:
+    """
+    Время подачи водителей-кандидатов к точке заказа.
+
+    Для одной точки подачи и N ближайших водителей делается один запрос
+    матрицы 2GIS. Результат кэшируется по (ячейка водителя, ячейка подачи,
+    интервал времени): соседние водители и повторные такты диспетчера
+    берут ETA из кэша.
+
+    Матрицы расходуют дневной лимит ключа 2GIS, общий с маршрутами и
+    геокодированием, поэтому у ETA свой бюджет - ETA_MATRIX_BUDGET_PER_MINUTE
+    и ETA_MATRIX_BUDGET_PER_DAY. Он считается в БД (api_quota_usage) и общий
+    для всех воркеров и реплик. Когда 2GIS недоступен, бюджет исчерпан или
+    ответ пришёл без нужной пары, ETA оценивается как расстояние по прямой x
+    ETA_DETOUR_FACTOR при ETA_FALLBACK_SPEED_KMH.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache('eta', settings.ETA_CACHE_SIZE, settings.ETA_TIME_BUCKET_SECONDS)
+        # Бюджет исчерпан до конца окна - БД до этого времени не спрашиваем
+        self._quota_blocked_until: Optional[datetime] = None
+        self._backoff_until = 0.0
+        self.matrix_calls = 0
+        self.quota_denied = 0
+        self.fallbacks = 0
+
+    def _key(self, lat: float, lng: float, pickup: Tuple[float, float], now: float) -> Tuple[str, str, int]:
+        precision = settings.ETA_CELL_PRECISION
+        return (
+            geohash.encode(lat, lng, precision),
+            geohash.encode(pickup[0], pickup[1], precision),
+            int(now // settings.ETA_TIME_BUCKET_SECONDS)
+        )
+
+    @staticmethod
+    def estimate(lat: float, lng: float, pickup: Tuple[float, float]) -> float:
+        """Оценка ETA в секундах без 2GIS"""
+        km = distance_km(lat, lng, pickup[0], pickup[1]) * settings.ETA_DETOUR_FACTOR
+        return km / settings.ETA_FALLBACK_SPEED_KMH * 3600
+
+    @staticmethod
+    def _window_start(now: datetime, length: timedelta) -> datetime:
+        if length >= timedelta(days=1):
+            return datetime.combine(now.date(), datetime.min.time())
+        return now.replace(second=0, microsecond=0)
+
+    @staticmethod
+    def _take_window(db, scope: str, start: datetime, limit: int) -> bool:
+        """Списывает запрос из окна бюджета; False - окно исчерпано"""
+        from app import models
+
+        usage = models.ApiQuotaUsage.__table__
+        window = (usage.c.scope == scope, usage.c.window_start == start)
+        take = update(usage).where(*window, usage.c.used < limit).values(used=usage.c.used + 1)
+        if db.execute(take).rowcount:
+            return True
+        if db.execute(select(usage.c.used).where(*window)).first() is not None:
+            return False
+        try:
+            with db.begin_nested():
+                db.execute(insert(usage).values(scope=scope, window_start=start, used=1))
+        except IntegrityError:
+            # Окно одновременно открыл другой воркер
+            return bool(db.execute(take).rowcount)
+        # Новое окно: прошлые окна этого бюджета больше не нужны
+        db.execute(delete(usage).where(usage.c.scope == scope, usage.c.window_start < start))
+        return True
+
+    def _take_quota(self) -> bool:
+        """Списывает запрос матрицы из общего бюджета ETA (минута и день)"""
+        from app.database import SessionLocal
+
+        now = datetime.now()
+        if self._quota_blocked_until is not None and now < self._quota_blocked_until:
+            return False
+        windows = (
+            (QUOTA_MINUTE, settings.ETA_MATRIX_BUDGET_PER_MINUTE),
+            (QUOTA_DAY, settings.ETA_MATRIX_BUDGET_PER_DAY),
+        )
+        db = SessionLocal()
+        try:
+            for (scope, length), limit in windows:
+                start = self._window_start(now, length)
+                if limit <= 0 or not self._take_window(db, scope, start, limit):
+                    db.rollback()
+                    self._quota_blocked_until = start + length
+                    return False
+            db.commit()
+            return True
+        except Exception as e:
+            db.rollback()
+            logger.error(f"❌ Ошибка учёта бюджета матриц ETA: {e}")
+            return False
+        finally:
+            db.close()
+
+    def _upstream_available(self) -> bool:
+        return settings.ETA_USE_MATRIX and time.time() >= self._backoff_until
+
+    async def _fetch_matrix(self, pickup: Tuple[float, float], drivers: Sequence[DriverPoint]) -> Optional[List[float]]:
+        from app.services.twogis_service import twogis_service
+
+        if not await asyncio.to_thread(self._take_quota):
+            self.quota_denied += 1
+            logger.warning("⚠️ Бюджет матриц 2GIS для ETA исчерпан, ETA по оценке")
+            return None
+        self.matrix_calls += 1
+        result = await twogis_service.get_distance_matrix(
+            [(lat, lng) for _, lat, lng in drivers], [pickup]
+        )
+        durations = (result or {}).get('durations') or []
+        if len(durations) != len(drivers):
+            # Ошибка или неполный ответ - не дёргаем 2GIS какое-то время
+            self._backoff_until = time.time() + settings.ETA_UPSTREAM_BACKOFF
+            return None
+        return [row[0] if isinstance(row, list) and row else row for row in durations]
+
+    async def etas(self, pickup: Tuple[float, float], drivers: Sequence[DriverPoint],
+                   allow_upstream: bool = True) -> Dict[int, float]:
+        """ETA (секунды) каждого водителя до точки подачи: кэш, одна матрица 2GIS на промахи, оценка"""
+        now = time.time()
+        result: Dict[int, float] = {}
+        missing: List[Tuple[DriverPoint, Tuple[str, str, int]]] = []
+        for driver in drivers:
+            key = self._key(driver[1], driver[2], pickup, now)
+            cached = self._cache.get(key)
+            if cached is not None:
+                result[driver[0]] = cached
+            else:
+                missing.append((driver, key))
+
+        durations = None
+        if missing and allow_upstream and self._upstream_available():
+            durations = await self._fetch_matrix(pickup, [driver for driver, _ in missing])
+
+        for index, (driver, key) in enumerate(missing):
+            seconds = durations[index] if durations else None
+            if isinstance(seconds, (int, float)) and seconds >= 0:
+                self._cache.set(key, float(seconds))
+            else:
+                seconds = self.estimate(driver[1], driver[2], pickup)
+                self.fallbacks += 1
+            result[driver[0]] = float(seconds)
+        return result
+
+    async def etas_for_orders(self, requests: Sequence[Tuple[Tuple[float, float], Sequence[DriverPoint]]]
+                              ) -> List[Dict[int, float]]:
+        """ETA для нескольких заказов; запросов матрицы не больше ETA_MAX_MATRIX_CALLS за раз"""
+        calls = settings.ETA_MAX_MATRIX_CALLS
+        return await asyncio.gather(*(
+            self.etas(pickup, drivers, allow_upstream=index < calls)
+            for index, (pickup, drivers) in enumerate(requests)
+        ))
+
+    def stats(self) -> Dict:
+        return {
+            'cache': self._cache.stats(),
+            'matrix_calls': self.matrix_calls,
+            'fallbacks': self.fallbacks,
+            'quota_denied': self.quota_denied,
+            'backoff': self._backoff_until > time.time()
+        }
+
+
+def thread_provider(service: 'EtaService', loop: asyncio.AbstractEventLoop):
+    """
+    Провайдер ETA для DispatchEngine: такт диспетчера идёт в потоке, а запросы
+    к 2GIS выполняются в цикле событий приложения. Не дождались - оценка.
+    """
+    def provider(requests):
+        future = asyncio.run_coroutine_threadsafe(service.etas_for_orders(requests), loop)
+        try:
+            return future.result(timeout=settings.ETA_TICK_TIMEOUT)
+        except Exception as e:
+            future.cancel()
+            logger.warning(f"⚠️ ETA для такта диспетчера не получены ({e!r}), используется оценка")
+            return [
+                {driver_id: service.estimate(lat, lng, pickup) for driver_id, lat, lng in drivers}
+                for pickup, drivers in requests
+            ]
+    return provider
+
+
+eta_service = EtaService()
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SPACES_RE = re.compile(r'\s+')
+_PUNCT_RE = re.compile(r'[^\w\s/-]+')
+
+# Длина колонки geo_cache.key
+MAX_KEY_LENGTH = 512
+
+
+def normalize_address(address: str) -> str:
+    """Приводит адрес к каноническому виду: регистр, ё, пунктуация, пробелы"""
+    text = address.lower().replace('ё', 'е')
+    text = _PUNCT_RE.sub(' ', text)
+    return _SPACES_RE.sub(' ', text).strip()
+
+
+def _bounded(key: str) -> str:
+    if len(key) <= MAX_KEY_LENGTH:
+        return key
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return f"{key[:MAX_KEY_LENGTH - len(digest) - 1]}#{digest}"
+
+
+def geocode_key(address: str, region: str) -> str:
+    return _bounded(f"geocode:{region}:{normalize_address(address)}")
+
+
+def route_key(origin: Tuple[float, float], destination: Tuple[float, float], transport_type: str) -> str:
+    # 5 знаков (~1 м): одна и та же точка с разной «шумной» точностью даёт один ключ
+    return (f"route:{transport_type}:{origin[0]:.5f},{origin[1]:.5f}:"
+            f"{destination[0]:.5f},{destination[1]:.5f}")
+
+
+class PersistentGeoCache:
+    """
+    Второй уровень кэша 2GIS в таблице geo_cache, общий для всех реплик.
+
+    Стоит за TTLCache воркера: промах в памяти читает таблицу, ответ 2GIS
+    пишется в обе. Ошибки БД не ломают геокодирование - запись считается
+    промахом. При старте warm_up() наполняет кэши воркера свежими записями.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        from app.database import SessionLocal
+        from app import models
+
+        db = SessionLocal()
+        try:
+            entry = db.query(models.GeoCacheEntry).filter(
+                models.GeoCacheEntry.key == key,
+                models.GeoCacheEntry.expires_at > datetime.utcnow()
+            ).first()
+            value = json.loads(entry.value) if entry is not None else None
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Ошибка чтения кэша geo_cache: {e}")
+            return None
+        finally:
+            db.close()
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, kind: str, value: Any, ttl: float) -> None:
+        from app.database import SessionLocal
+        from app import models
+
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            # merge: вставка или обновление по первичному ключу
+            db.merge(models.GeoCacheEntry(
+                key=key,
+                kind=kind,
+                value=json.dumps(value, ensure_ascii=False),
+                expires_at=now + timedelta(seconds=ttl),
+                updated_at=now
+            ))
+            db.commit()
+            self.writes += 1
+        except Exception as e:
+            # Чаще всего - другая реплика записала тот же ключ одновременно
+            db.rollback()
+            self.errors += 1
+            logger.warning(f"⚠️ Запись в geo_cache не удалась ({key}): {e}")
+        finally:
+            db.close()
+
+    def load_recent(self, limit: int) -> List[Tuple[str, str, Any, float]]:
+        """Удаляет устаревшие записи и возвращает свежие: (kind, key, value, оставшийся TTL)"""
+        from app.database import SessionLocal
+        from app import models
+
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.query(models.GeoCacheEntry).filter(
+                models.GeoCacheEntry.expires_at <= now
+            ).delete(synchronize_session=False)
+            db.commit()
+            entries = db.query(models.GeoCacheEntry).order_by(
+                models.GeoCacheEntry.updated_at.desc()
+            ).limit(limit).all()
+            return [
+                (entry.kind, entry.key, json.loads(entry.value), (entry.expires_at - now).total_seconds())
+                for entry in entries
+            ]
+        except Exception as e:
+            db.rollback()
+            self.errors += 1
+            logger.error(f"❌ Ошибка загрузки geo_cache: {e}")
+            return []
+        finally:
+            db.close()
+
+    async def aget(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, kind: str, value: Any, ttl: float) -> None:
+        if self.enabled:
+            await asyncio.to_thread(self.set, key, kind, value, ttl)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'errors': self.errors,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+geo_cache = PersistentGeoCache(enabled=settings.GEO_CACHE_ENABLED)
@@ -0,0 +1,82 @@
+import math
+from typing import List, Tuple
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: index for index, char in enumerate(_BASE32)}
+
+
+def encode(lat: float, lng: float, precision: int = 8) -> str:
+    """Geohash точки. Ячейка точности 8 - около 38 x 19 м"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if lng >= mid:
+                value = value * 2 + 1
+                lng_range[0] = mid
+            else:
+                value *= 2
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                value = value * 2 + 1
+                lat_range[0] = mid
+            else:
+                value *= 2
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Размер ячейки в градусах: (широта, долгота)"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def neighbours_radius_m(precision: int, lat: float) -> float:
+    """
+    Радиус (м), в котором ячейка точки и 8 соседних гарантированно содержат
+    все точки: точка может лежать у края своей ячейки, поэтому запас с
+    каждой стороны - одна ячейка по меньшему из измерений
+    """
+    dlat, dlng = cell_size(precision)
+    return min(dlat * 111320, dlng * 111320 * math.cos(math.radians(lat)))
+
+
+def decode(cell: str) -> Tuple[float, float]:
+    """Центр ячейки (lat, lng)"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lng_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            target[1 - bit] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
+def neighbours(cell: str) -> List[str]:
+    """Ячейка и 8 соседних той же точности"""
+    lat, lng = decode(cell)
+    dlat, dlng = cell_size(len(cell))
+    return [
+        encode(lat + i * dlat, lng + j * dlng, len(cell))
+        for i in (-1, 0, 1) for j in (-1, 0, 1)
+    ]
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import json
+import logging
+from datetime import datetime
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query, Session
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCursor(ValueError):
+    """Курсор повреждён или выдан для другого списка"""
+
+
+class KeysetPage(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str]
+    total: Optional[int] = None
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Непрозрачный курсор: значения ключа последней строки в base64url(JSON)"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, keys: Sequence) -> tuple:
+    """Значения ключа из курсора с приведением к типам колонок keys"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursor(f"Некорректный курсор: {cursor!r}") from e
+    if not isinstance(payload, list) or len(payload) != len(keys):
+        raise InvalidCursor(f"Курсор не подходит к списку: {cursor!r}")
+
+    values = []
+    for key, value in zip(keys, payload):
+        try:
+            if key.type.python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif key.type.python_type is int:
+                value = int(value)
+        except (TypeError, ValueError) as e:
+            raise InvalidCursor(f"Некорректное значение в курсоре: {value!r}") from e
+        values.append(value)
+    return tuple(values)
+
+
+def _after(keys: Sequence, values: Sequence, descending: bool):
+    """
+    Строки строго после values в порядке keys. Сравнение строк (a, b) < (x, y)
+    PostgreSQL и SQLite (3.15+) превращают в диапазон по составному индексу.
+    """
+    if len(keys) == 1:
+        return keys[0] < values[0] if descending else keys[0] > values[0]
+    row, bound = tuple_(*keys), tuple_(*values)
+    return row < bound if descending else row > bound
+
+
+def paginate(query: Query, keys: Sequence, cursor: Optional[str] = None, limit: int = 100,
+             descending: bool = False, skip: int = 0, with_total: bool = False) -> KeysetPage:
+    """
+    Страница query по ключу keys (последний ключ - уникальный, обычно id).
+
+    Вместо OFFSET берутся строки после ключа из курсора, поэтому глубокие
+    страницы стоят столько же, сколько первая, а новые строки не сдвигают
+    уже выданные. Колонки ключа должны быть NOT NULL: строки с NULL в ключе
+    в страницы не попадут. next_cursor = None - страница последняя.
+
+    skip - прежний OFFSET для старых клиентов, учитывается только без курсора.
+    with_total - добавить оценку общего числа строк (approximate_count).
+    """
+    total = approximate_count(query.session, query) if with_total else None
+    if cursor:
+        query = query.filter(_after(keys, decode_cursor(cursor, keys), descending))
+    query = query.order_by(*(key.desc() if descending else key.asc() for key in keys))
+    if skip and not cursor:
+        query = query.offset(skip)
+
+    rows = query.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, key.key) for key in keys])
+    return KeysetPage(items, next_cursor, total)
+
+
+def set_page_headers(response, page: KeysetPage):
+    """Курсор и оценка total в заголовках: тело списковых API остаётся прежним списком"""
+    if page.next_cursor:
+        response.headers['X-Next-Cursor'] = page.next_cursor
+    if page.total is not None:
+        response.headers['X-Total-Count'] = str(page.total)
+
+
+def approximate_count(db: Session, query: Query) -> int:
+    """
+    Оценка числа строк query. В PostgreSQL - по статистике планировщика
+    (EXPLAIN, без прохода по таблице), в остальных СУБД - точный COUNT(*).
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return query.order_by(None).count()
+
+    compiled = query.order_by(None).statement.compile(
+        dialect=bind.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    try:
+        # Точка сохранения: ошибка EXPLAIN не должна обрывать транзакцию запроса
+        with db.begin_nested():
+            plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.warning(f"⚠️ Оценка числа строк недоступна ({e!r}), считаем COUNT(*)")
+        return query.order_by(None).count()
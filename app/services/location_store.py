@@ -0,0 +1,207 @@
+import asyncio
+import threading
+import time
+import logging
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, or_
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LiveLocationStore:
+    """
+    Последние координаты водителей в памяти с пакетной записью в БД.
+
+    Позиции хранятся в компактных массивах (array('d')) по слотам, слот
+    водителя находится по словарю driver_id -> slot. update-location пишет
+    только в память и помечает слот «грязным»; раз в LOCATION_FLUSH_INTERVAL
+    секунд все изменённые позиции уходят в drivers одним пакетным UPDATE.
+    При остановке приложения буфер сбрасывается в БД.
+    """
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval if flush_interval is not None else settings.LOCATION_FLUSH_INTERVAL
+
+        self._slots: Dict[int, int] = {}
+        self._driver_ids = array('q')
+        self._lats = array('d')
+        self._lngs = array('d')
+        self._timestamps = array('d')
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_total = 0
+        self.last_flush_stats: Dict = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, driver_id: int) -> bool:
+        return driver_id in self._slots
+
+    def update(self, driver_id: int, lat: float, lng: float, timestamp: Optional[float] = None) -> None:
+        """Запоминает позицию водителя (без обращения к БД)"""
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self._lock:
+            slot = self._slots.get(driver_id)
+            if slot is None:
+                slot = len(self._driver_ids)
+                self._slots[driver_id] = slot
+                self._driver_ids.append(driver_id)
+                self._lats.append(lat)
+                self._lngs.append(lng)
+                self._timestamps.append(timestamp)
+            else:
+                self._lats[slot] = lat
+                self._lngs[slot] = lng
+                self._timestamps[slot] = timestamp
+            self._dirty.add(slot)
+
+    def get(self, driver_id: int) -> Optional[Dict]:
+        """Последняя позиция водителя: {'lat', 'lng', 'updated_at'} или None"""
+        slot = self._slots.get(driver_id)
+        if slot is None:
+            return None
+        return {
+            'lat': self._lats[slot],
+            'lng': self._lngs[slot],
+            'updated_at': datetime.fromtimestamp(self._timestamps[slot])
+        }
+
+    def latest(self, driver) -> Optional[Dict]:
+        """
+        Самая свежая позиция водителя: из памяти воркера или из drivers.
+
+        Водитель может слать позиции на другой воркер, тогда здесь лежит
+        устаревшая точка, а в БД - более новая из пакетной записи соседа.
+        """
+        local = self.get(driver.id)
+        stored = None
+        if driver.current_lat is not None and driver.current_lng is not None:
+            stored = {
+                'lat': driver.current_lat,
+                'lng': driver.current_lng,
+                'updated_at': driver.last_location_update
+            }
+        if local is None:
+            return stored
+        if stored is not None and stored['updated_at'] is not None and stored['updated_at'] > local['updated_at']:
+            return stored
+        return local
+
+    def get_many(self, driver_ids: Iterable[int]) -> Dict[int, Dict]:
+        result = {}
+        for driver_id in driver_ids:
+            position = self.get(driver_id)
+            if position is not None:
+                result[driver_id] = position
+        return result
+
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    # --- Запись в БД ---
+
+    def _take_dirty(self) -> List[Dict]:
+        with self._lock:
+            rows = [
+                {
+                    'driver_id': self._driver_ids[slot],
+                    'current_lat': self._lats[slot],
+                    'current_lng': self._lngs[slot],
+                    'last_location_update': datetime.fromtimestamp(self._timestamps[slot]),
+                    'is_online': True,
+                    'location_updated_at': datetime.fromtimestamp(self._timestamps[slot])
+                }
+                for slot in self._dirty
+            ]
+            self._dirty.clear()
+        return rows
+
+    def flush(self) -> int:
+        """Записывает изменённые позиции в drivers одним executemany, возвращает число строк"""
+        from app.database import SessionLocal
+        from app import models
+
+        rows = self._take_dirty()
+        if not rows:
+            return 0
+
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            # Один UPDATE ... WHERE id = :driver_id, выполняемый как executemany на весь пакет.
+            # Позицию, которую другой воркер уже записал новее, не перетираем
+            drivers = models.Driver.__table__
+            db.execute(drivers.update().where(
+                drivers.c.id == bindparam('driver_id'),
+                or_(
+                    drivers.c.last_location_update.is_(None),
+                    drivers.c.last_location_update < bindparam('location_updated_at')
+                )
+            ), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # Возвращаем водителей в буфер - следующая запись отправит их самые свежие позиции
+            with self._lock:
+                for row in rows:
+                    slot = self._slots.get(row['driver_id'])
+                    if slot is not None:
+                        self._dirty.add(slot)
+            logger.error(f"❌ Ошибка записи позиций водителей: {e}")
+            return 0
+        finally:
+            db.close()
+
+        self.flushed_total += len(rows)
+        self.last_flush_stats = {
+            'rows': len(rows),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+        return len(rows)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка фоновой записи позиций: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"🚀 Запись позиций водителей в БД раз в {self.flush_interval} с")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Последние позиции не должны потеряться при остановке
+        flushed = await asyncio.to_thread(self.flush)
+        logger.info(f"🛑 Запись позиций остановлена, сброшено при остановке: {flushed}")
+
+    def stats(self) -> Dict:
+        return {
+            'drivers': len(self._slots),
+            'pending': len(self._dirty),
+            'flushed_total': self.flushed_total,
+            'last_flush': self.last_flush_stats
+        }
+
+
+# Создаем экземпляр хранилища позиций
+location_store = LiveLocationStore()
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import time
+import uuid
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.services.location_store import location_store
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых поток событий заказа закрывается
+TERMINAL_ORDER_STATUSES = ["Завершен", "Отменен", "Отменен заказчиком"]
+
+# Статусы, в которых пассажиру интересна позиция водителя
+TRACKED_ORDER_STATUSES = ["Назначен", "Принят", "Выполняется"]
+
+
+def order_state(order) -> Dict[str, Any]:
+    """Текущее состояние заказа для пассажира: статус, водитель, прогресс"""
+    driver = None
+    if order.driver_id and order.driver is not None:
+        car = order.driver.cars[0] if order.driver.cars else None
+        position = location_store.latest(order.driver)
+        driver = {
+            "id": order.driver.id,
+            "full_name": order.driver.full_name,
+            "phone": order.driver.phone,
+            "rating": order.driver.rating,
+            "car_brand": car.brand if car else None,
+            "car_model": car.model if car else None,
+            "car_color": car.color if car else None,
+            "car_number": car.license_plate if car else None,
+            "lat": position['lat'] if position else None,
+            "lng": position['lng'] if position else None
+        }
+    return {
+        "order_id": order.id,
+        "order_number": order.order_number,
+        "status": order.status,
+        "driver_id": order.driver_id,
+        "driver": driver,
+        "price": order.price,
+        "actual_price": order.actual_price,
+        "progress_percentage": order.progress_percentage or 0.0
+    }
+
+
+class _OrderStream:
+    __slots__ = ('seq', 'events', 'subscribers', 'last_status', 'last_location', 'touched_at')
+
+    def __init__(self, buffer_size: int):
+        self.seq = 0
+        self.events: Deque[Tuple[int, str, Dict]] = deque(maxlen=buffer_size)
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.last_status: Optional[Tuple] = None
+        self.last_location: Optional[Tuple] = None
+        self.touched_at = time.time()
+
+
+class OrderEventHub:
+    """
+    Шина событий заказов для SSE-потоков пассажиров (в пределах воркера).
+
+    Поток заказа создаётся при первой подписке и хранит последние
+    ORDER_EVENTS_BUFFER событий - по ним клиент догоняет пропущенное после
+    переподключения (Last-Event-ID). Id события имеет вид "<epoch>-<seq>":
+    epoch меняется при рестарте воркера, и тогда клиент получает снимок
+    состояния вместо повтора. Публикация в заказ без подписчиков - no-op.
+    """
+
+    def __init__(self, buffer_size: int = None, idle_ttl: float = None):
+        self.buffer_size = buffer_size or settings.ORDER_EVENTS_BUFFER
+        self.idle_ttl = idle_ttl if idle_ttl is not None else settings.ORDER_EVENTS_IDLE_TTL
+        self.epoch = uuid.uuid4().hex[:8]
+        self._streams: Dict[int, _OrderStream] = {}
+        # driver_id -> order_id, за которым следит пассажир
+        self._driver_orders: Dict[int, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def is_watched(self, order_id: int) -> bool:
+        return order_id in self._streams
+
+    def order_for_driver(self, driver_id: int) -> Optional[int]:
+        return self._driver_orders.get(driver_id)
+
+    # --- Подписка ---
+
+    def subscribe(self, order_id: int, last_event_id: Optional[str] = None) -> Tuple[asyncio.Queue, Optional[List[Tuple[int, str, Dict]]], int]:
+        """
+        Подписка на события заказа.
+
+        Returns:
+            (очередь, события для повтора или None - нужен снимок состояния, текущий seq)
+        """
+        self._loop = asyncio.get_running_loop()
+        self._cleanup()
+        stream = self._streams.get(order_id)
+        if stream is None:
+            stream = self._streams[order_id] = _OrderStream(self.buffer_size)
+        stream.touched_at = time.time()
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.buffer_size)
+        stream.subscribers.add(queue)
+
+        replay = None
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition('-')
+            if epoch == self.epoch and seq.isdigit():
+                seq = int(seq)
+                oldest = stream.events[0][0] if stream.events else stream.seq + 1
+                # Догнать можно, только если буфер не потерял события после seq
+                if seq >= oldest - 1 and seq <= stream.seq:
+                    replay = [event for event in stream.events if event[0] > seq]
+        return queue, replay, stream.seq
+
+    def unsubscribe(self, order_id: int, queue: asyncio.Queue) -> None:
+        stream = self._streams.get(order_id)
+        if stream is not None:
+            stream.subscribers.discard(queue)
+            stream.touched_at = time.time()
+
+    def track_driver(self, driver_id: Optional[int], order_id: int) -> None:
+        """Позиции этого водителя публикуются в поток заказа"""
+        if driver_id:
+            self._driver_orders[driver_id] = order_id
+
+    # --- Публикация ---
+
+    def publish_order(self, order) -> None:
+        """Публикует изменение статуса заказа (ORM-объект), если за заказом следят"""
+        if order is None or order.id not in self._streams:
+            return
+        state = order_state(order)
+        if state["status"] in TRACKED_ORDER_STATUSES:
+            self.track_driver(order.driver_id, order.id)
+        self.publish(order.id, "status", state)
+
+    def publish_location(self, driver_id: int, lat: float, lng: float,
+                         order_id: Optional[int] = None,
+                         progress_percentage: Optional[float] = None) -> None:
+        """Публикует позицию водителя (и прогресс) в поток его заказа"""
+        order_id = order_id or self._driver_orders.get(driver_id)
+        if order_id is None or order_id not in self._streams:
+            return
+        data = {"order_id": order_id, "driver_id": driver_id, "lat": lat, "lng": lng}
+        if progress_percentage is not None:
+            data["progress_percentage"] = progress_percentage
+        self.publish(order_id, "location", data)
+
+    def publish(self, order_id: int, event: str, data: Dict) -> None:
+        if order_id not in self._streams or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._dispatch(order_id, event, data)
+        elif not self._loop.is_closed():
+            # Синхронные обработчики работают в пуле потоков - передаём событие в цикл
+            self._loop.call_soon_threadsafe(self._dispatch, order_id, event, data)
+
+    def _dispatch(self, order_id: int, event: str, data: Dict) -> None:
+        stream = self._streams.get(order_id)
+        if stream is None:
+            return
+
+        # Не рассылаем повторы: статус без изменений, та же позиция
+        if event == "status":
+            key = (data.get("status"), data.get("driver_id"), data.get("progress_percentage"))
+            if key == stream.last_status:
+                return
+            stream.last_status = key
+            if data.get("status") not in TRACKED_ORDER_STATUSES and self._driver_orders.get(data.get("driver_id")) == order_id:
+                del self._driver_orders[data["driver_id"]]
+        elif event == "location":
+            key = (data["lat"], data["lng"], data.get("progress_percentage"))
+            if key == stream.last_location:
+                return
+            stream.last_location = key
+
+        stream.seq += 1
+        item = (stream.seq, event, data)
+        stream.events.append(item)
+        stream.touched_at = time.time()
+        for queue in stream.subscribers:
+            if queue.full():
+                # Медленный клиент: теряем самое старое, остальное он догонит снимком
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+    def _cleanup(self) -> None:
+        now = time.time()
+        for order_id, stream in list(self._streams.items()):
+            if not stream.subscribers and now - stream.touched_at > self.idle_ttl:
+                del self._streams[order_id]
+                for driver_id, tracked in list(self._driver_orders.items()):
+                    if tracked == order_id:
+                        del self._driver_orders[driver_id]
+
+    # --- Формат SSE ---
+
+    def snapshot(self, order_id: int, state: Dict) -> str:
+        """Снимок состояния заказа с id текущего события потока"""
+        stream = self._streams.get(order_id)
+        seq = 0
+        if stream is not None:
+            stream.last_status = (state.get("status"), state.get("driver_id"), state.get("progress_percentage"))
+            seq = stream.seq
+        return self.format(seq, "snapshot", state)
+
+    def format(self, seq: int, event: str, data: Dict) -> str:
+        return f"id: {self.event_id(seq)}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def stats(self) -> Dict:
+        return {
+            'streams': len(self._streams),
+            'subscribers': sum(len(stream.subscribers) for stream in self._streams.values()),
+            'tracked_drivers': len(self._driver_orders)
+        }
+
+
+# Создаем экземпляр шины событий
+order_events = OrderEventHub()
@@ -0,0 +1,16 @@
+from typing import Iterable
+
+from sqlalchemy.orm import attributes
+
+
+def fields_changed(obj, fields: Iterable[str]) -> bool:
+    """
+    Изменено ли в объекте сессии хоть одно из полей fields (для after_flush).
+
+    Незагруженные атрибуты не подгружаются из БД: если поле не читали и не
+    присваивали, оно считается неизменённым.
+    """
+    return any(
+        attributes.get_history(obj, field, passive=attributes.PASSIVE_NO_INITIALIZE).has_changes()
+        for field in fields
+    )
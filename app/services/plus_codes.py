@@ -0,0 +1,244 @@
+"""
+Open Location Code (Plus Codes): кодирование, декодирование и
+восстановление коротких кодов относительно опорной точки.
+
+Полный код - 8 символов до '+' (пары широта/долгота: 20°, 1°, 0.05°, 0.0025°)
+и уточнение после '+'. Короткий код (HQCQ+XCV) - полный без первых 2/4/6
+символов; он восстанавливается по ближайшей к опорной точке ячейке, поэтому
+опорная точка должна быть не дальше половины размера отброшенной ячейки
+(для 4 отброшенных символов - 0.5°, ~50 км).
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from app.config import settings
+
+SEPARATOR = '+'
+SEPARATOR_POSITION = 8
+PADDING = '0'
+ALPHABET = '23456789CFGHJMPQRVWX'
+BASE = len(ALPHABET)
+PAIR_LENGTH = 10
+GRID_ROWS = 5
+GRID_COLUMNS = 4
+MAX_DIGITS = 15
+LATITUDE_MAX = 90
+LONGITUDE_MAX = 180
+
+_DIGITS = {char: index for index, char in enumerate(ALPHABET)}
+
+# Разрешение пар: 20, 1, 0.05, 0.0025, 0.000125 градуса
+_PAIR_RESOLUTIONS = tuple(20.0 / BASE ** i for i in range(PAIR_LENGTH // 2))
+# Число самых мелких ячеек в одном градусе
+_FINAL_LAT_PRECISION = BASE ** 3 * GRID_ROWS ** (MAX_DIGITS - PAIR_LENGTH)
+_FINAL_LNG_PRECISION = BASE ** 3 * GRID_COLUMNS ** (MAX_DIGITS - PAIR_LENGTH)
+
+# Код в тексте адреса: "HQCQ+XCV Газалкент", "8MHFHQCQ+XCV", "GP2Q+VX"
+_CODE_IN_TEXT_RE = re.compile(
+    rf'(?<![0-9A-Z])((?:[{ALPHABET}]{{2}}){{1,4}}(?:{PADDING}{{2}}){{0,3}}\{SEPARATOR}[{ALPHABET}]{{0,7}})(?![0-9A-Z])'
+)
+
+# Опорные населённые пункты для восстановления коротких кодов: варианты написания -> центр
+REFERENCE_LOCALITIES: Dict[Tuple[str, ...], Tuple[float, float]] = {
+    ('ош', 'osh'): (40.5283, 72.7985),
+    ('бишкек', 'bishkek'): (42.8746, 74.5698),
+    ('джалал-абад', 'жалал-абад', 'jalal-abad', 'jalalabad'): (40.9333, 73.0000),
+    ('кара-суу', 'kara-suu', 'karasuu'): (40.7040, 72.8830),
+    ('узген', 'өзгөн', 'uzgen', 'ozgon'): (40.7699, 73.3007),
+    ('ноокат', 'nookat'): (40.2656, 72.6189),
+    ('газалкент', "g'azalkent", 'gazalkent'): (41.5586, 69.7709),
+    ('ташкент', 'toshkent', 'tashkent'): (41.2995, 69.2401),
+}
+
+_LOCALITY_RE = re.compile(
+    r'(?<!\w)(' + '|'.join(
+        re.escape(name) for names in REFERENCE_LOCALITIES for name in sorted(names, key=len, reverse=True)
+    ) + r')(?!\w)',
+    re.IGNORECASE
+)
+_LOCALITY_POINTS = {name: point for names, point in REFERENCE_LOCALITIES.items() for name in names}
+
+
+class CodeArea(NamedTuple):
+    south: float
+    west: float
+    north: float
+    east: float
+    code_length: int
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        return (
+            min((self.south + self.north) / 2, LATITUDE_MAX),
+            min((self.west + self.east) / 2, LONGITUDE_MAX)
+        )
+
+
+def _clip_latitude(lat: float) -> float:
+    return min(LATITUDE_MAX, max(-LATITUDE_MAX, lat))
+
+
+def _normalize_longitude(lng: float) -> float:
+    while lng < -LONGITUDE_MAX:
+        lng += 2 * LONGITUDE_MAX
+    while lng >= LONGITUDE_MAX:
+        lng -= 2 * LONGITUDE_MAX
+    return lng
+
+
+def is_valid(code: str) -> bool:
+    if not code or len(code) == 1 or code.count(SEPARATOR) != 1:
+        return False
+    separator = code.index(SEPARATOR)
+    if separator > SEPARATOR_POSITION or separator % 2 == 1:
+        return False
+    padding = code.find(PADDING)
+    if padding != -1:
+        # Заполнитель только в полном коде, чётной длины, сразу перед '+'
+        if separator < SEPARATOR_POSITION or padding == 0:
+            return False
+        pads = code[padding:code.rfind(PADDING) + 1]
+        if len(pads) % 2 == 1 or pads.count(PADDING) != len(pads) or not code.endswith(SEPARATOR):
+            return False
+    if len(code) - separator - 1 == 1:
+        return False
+    return all(char.upper() in _DIGITS or char in (SEPARATOR, PADDING) for char in code)
+
+
+def is_short(code: str) -> bool:
+    return is_valid(code) and code.index(SEPARATOR) < SEPARATOR_POSITION
+
+
+def is_full(code: str) -> bool:
+    if not is_valid(code) or is_short(code):
+        return False
+    code = code.upper()
+    if _DIGITS[code[0]] * 20 >= 2 * LATITUDE_MAX:
+        return False
+    return len(code) < 2 or _DIGITS[code[1]] * 20 < 2 * LONGITUDE_MAX
+
+
+def _latitude_precision(code_length: int) -> float:
+    if code_length <= PAIR_LENGTH:
+        return BASE ** (code_length // -2 + 2)
+    return BASE ** -3 / GRID_ROWS ** (code_length - PAIR_LENGTH)
+
+
+def encode(lat: float, lng: float, code_length: int = PAIR_LENGTH) -> str:
+    """Полный код точки (длина 10 - ячейка ~14 x 14 м, 11 - ~3 x 3 м)"""
+    if code_length < 2 or (code_length < PAIR_LENGTH and code_length % 2 == 1):
+        raise ValueError(f"Недопустимая длина Plus кода: {code_length}")
+    code_length = min(code_length, MAX_DIGITS)
+    lat = _clip_latitude(lat)
+    lng = _normalize_longitude(lng)
+    if lat == LATITUDE_MAX:
+        # Северный полюс попадает в ячейку ниже
+        lat -= _latitude_precision(code_length)
+
+    # Целочисленная арифметика в единицах самой мелкой ячейки - без накопления ошибки округления
+    lat_value = int(round((lat + LATITUDE_MAX) * _FINAL_LAT_PRECISION, 6))
+    lng_value = int(round((lng + LONGITUDE_MAX) * _FINAL_LNG_PRECISION, 6))
+
+    code = ''
+    if code_length > PAIR_LENGTH:
+        for _ in range(MAX_DIGITS - PAIR_LENGTH):
+            code = ALPHABET[(lat_value % GRID_ROWS) * GRID_COLUMNS + lng_value % GRID_COLUMNS] + code
+            lat_value //= GRID_ROWS
+            lng_value //= GRID_COLUMNS
+    else:
+        lat_value //= GRID_ROWS ** (MAX_DIGITS - PAIR_LENGTH)
+        lng_value //= GRID_COLUMNS ** (MAX_DIGITS - PAIR_LENGTH)
+    for _ in range(PAIR_LENGTH // 2):
+        code = ALPHABET[lat_value % BASE] + ALPHABET[lng_value % BASE] + code
+        lat_value //= BASE
+        lng_value //= BASE
+
+    code = code[:SEPARATOR_POSITION] + SEPARATOR + code[SEPARATOR_POSITION:]
+    if code_length >= SEPARATOR_POSITION:
+        return code[:code_length + 1]
+    return code[:code_length] + PADDING * (SEPARATOR_POSITION - code_length) + SEPARATOR
+
+
+@lru_cache(maxsize=4096)
+def decode(code: str) -> CodeArea:
+    """Область полного кода"""
+    if not is_full(code):
+        raise ValueError(f"Не полный Plus код: {code}")
+    digits = code.upper().replace(SEPARATOR, '').replace(PADDING, '')[:MAX_DIGITS]
+
+    south = -LATITUDE_MAX
+    west = -LONGITUDE_MAX
+    lat_size = lng_size = 0.0
+    for index in range(0, min(len(digits), PAIR_LENGTH), 2):
+        lat_size = lng_size = _PAIR_RESOLUTIONS[index // 2]
+        south += _DIGITS[digits[index]] * lat_size
+        west += _DIGITS[digits[index + 1]] * lng_size
+    for char in digits[PAIR_LENGTH:]:
+        lat_size /= GRID_ROWS
+        lng_size /= GRID_COLUMNS
+        value = _DIGITS[char]
+        south += (value // GRID_COLUMNS) * lat_size
+        west += (value % GRID_COLUMNS) * lng_size
+    return CodeArea(south, west, south + lat_size, west + lng_size, len(digits))
+
+
+def recover_nearest(short_code: str, reference_lat: float, reference_lng: float) -> str:
+    """Полный код для короткого: ближайшая к опорной точке ячейка с этим окончанием"""
+    if not is_short(short_code):
+        if is_full(short_code):
+            return short_code.upper()
+        raise ValueError(f"Недопустимый короткий Plus код: {short_code}")
+    short_code = short_code.upper()
+    reference_lat = _clip_latitude(reference_lat)
+    reference_lng = _normalize_longitude(reference_lng)
+
+    padding_length = SEPARATOR_POSITION - short_code.index(SEPARATOR)
+    resolution = 20.0 / BASE ** (padding_length // 2 - 1)
+    half = resolution / 2
+
+    prefix = encode(reference_lat, reference_lng)[:padding_length]
+    area = decode(prefix + short_code)
+    lat, lng = area.center
+
+    # Ячейка с тем же окончанием, но в соседнем квадрате может оказаться ближе
+    if reference_lat + half < lat and lat - resolution >= -LATITUDE_MAX:
+        lat -= resolution
+    elif reference_lat - half > lat and lat + resolution <= LATITUDE_MAX:
+        lat += resolution
+    if reference_lng + half < lng:
+        lng -= resolution
+    elif reference_lng - half > lng:
+        lng += resolution
+    return encode(lat, lng, area.code_length)
+
+
+@lru_cache(maxsize=256)
+def reference_point(text: str) -> Tuple[float, float]:
+    """Опорная точка по названию населённого пункта в адресе, иначе центр города из настроек"""
+    match = _LOCALITY_RE.search(text or '')
+    if match:
+        return _LOCALITY_POINTS[match.group(1).lower()]
+    return settings.DEFAULT_LAT, settings.DEFAULT_LON
+
+
+def find_code(text: str) -> Optional[str]:
+    if not text:
+        return None
+    for match in _CODE_IN_TEXT_RE.finditer(text.upper()):
+        if is_valid(match.group(1)):
+            return match.group(1)
+    return None
+
+
+def coordinates_from_text(text: str) -> Tuple[Optional[float], Optional[float]]:
+    """Координаты центра Plus кода из адреса; короткий код восстанавливается по населённому пункту"""
+    code = find_code(text)
+    if code is None:
+        return None, None
+    if is_short(code):
+        code = recover_nearest(code, *reference_point(text))
+    elif not is_full(code):
+        return None, None
+    return decode(code).center
@@ -0,0 +1,280 @@
+import asyncio
+import math
+import re
+import logging
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from app.config import settings
+from app.services import polyline
+from app.services.distance import KM_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+_LINESTRING_RE = re.compile(r'LINESTRING\s*\(([^)]*)\)', re.IGNORECASE)
+
+
+def extract_route_points(route: Dict) -> List[Tuple[float, float]]:
+    """
+    Точки (lat, lng) маршрута из ответа TwoGISService.get_route.
+
+    Геометрия 2GIS 7.0 лежит в манёврах: outcoming_path.geometry[].selection
+    в формате WKT "LINESTRING(lon lat, lon lat, ...)".
+    """
+    points: List[Tuple[float, float]] = []
+    for maneuver in route.get('geometry') or []:
+        path = maneuver.get('outcoming_path') or {}
+        for piece in path.get('geometry') or []:
+            match = _LINESTRING_RE.search(piece.get('selection') or '')
+            if not match:
+                continue
+            for pair in match.group(1).split(','):
+                parts = pair.split()
+                if len(parts) < 2:
+                    continue
+                point = (float(parts[1]), float(parts[0]))
+                # Соседние участки делят общую вершину
+                if not points or points[-1] != point:
+                    points.append(point)
+    return points
+
+
+def _planar(points: Sequence[Sequence[float]], lat0: float) -> Tuple[List[float], List[float]]:
+    """Локальная равнопромежуточная проекция в км - для городских масштабов погрешность доли процента"""
+    k_lng = KM_PER_DEGREE * math.cos(math.radians(lat0))
+    return [p[1] * k_lng for p in points], [p[0] * KM_PER_DEGREE for p in points]
+
+
+def simplify(points: Sequence[Tuple[float, float]], tolerance_m: float = None) -> List[Tuple[float, float]]:
+    """Упрощение линии алгоритмом Дугласа-Пекера (без рекурсии)"""
+    tolerance_m = settings.ROUTE_SIMPLIFY_TOLERANCE_M if tolerance_m is None else tolerance_m
+    n = len(points)
+    if n < 3:
+        return list(points)
+
+    xs, ys = _planar(points, points[0][0])
+    tolerance_sq = (tolerance_m / 1000) ** 2
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length_sq = dx * dx + dy * dy
+        worst, worst_index = -1.0, -1
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            if length_sq > 0:
+                t = max(0.0, min(1.0, (px * dx + py * dy) / length_sq))
+                px, py = px - t * dx, py - t * dy
+            dist_sq = px * px + py * py
+            if dist_sq > worst:
+                worst, worst_index = dist_sq, i
+        if worst > tolerance_sq:
+            keep[worst_index] = True
+            stack.append((first, worst_index))
+            stack.append((worst_index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+class RouteLine:
+    """
+    Маршрут заказа, подготовленный для проекции позиций водителя.
+
+    Хранит вершины в локальной проекции и накопленную длину до каждой
+    вершины. Сегмент для очередного пинга ищется бинарным поиском по
+    накопленной длине в окне вокруг прошлой позиции на маршруте, поэтому
+    пинг стоит O(log n) плюс несколько сегментов окна. Полный проход по
+    линии нужен только при сходе с маршрута.
+    """
+
+    __slots__ = ('xs', 'ys', 'cumulative', 'length_km', 'k_lng')
+
+    def __init__(self, points: Sequence[Sequence[float]]):
+        lat0 = sum(p[0] for p in points) / len(points)
+        self.k_lng = KM_PER_DEGREE * math.cos(math.radians(lat0))
+        self.xs = [p[1] * self.k_lng for p in points]
+        self.ys = [p[0] * KM_PER_DEGREE for p in points]
+        self.cumulative = [0.0]
+        for i in range(1, len(points)):
+            self.cumulative.append(self.cumulative[-1] + math.hypot(
+                self.xs[i] - self.xs[i - 1], self.ys[i] - self.ys[i - 1]
+            ))
+        self.length_km = self.cumulative[-1]
+
+    def __len__(self) -> int:
+        return len(self.xs)
+
+    def _scan(self, px: float, py: float, first: int, last: int) -> Tuple[float, float]:
+        """Ближайшая точка на сегментах [first, last): (расстояние до линии км, позиция на маршруте км)"""
+        xs, ys, cumulative = self.xs, self.ys, self.cumulative
+        best_sq, best_along = float('inf'), 0.0
+        for i in range(first, last):
+            ax, ay = xs[i], ys[i]
+            dx, dy = xs[i + 1] - ax, ys[i + 1] - ay
+            length_sq = dx * dx + dy * dy
+            t = 0.0
+            if length_sq > 0:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+            ex, ey = ax + t * dx - px, ay + t * dy - py
+            dist_sq = ex * ex + ey * ey
+            if dist_sq < best_sq:
+                best_sq = dist_sq
+                best_along = cumulative[i] + t * (cumulative[i + 1] - cumulative[i])
+        return math.sqrt(best_sq), best_along
+
+    def project(self, lat: float, lng: float, hint_km: Optional[float] = None) -> Tuple[float, float]:
+        """
+        Проекция позиции на маршрут.
+
+        Args:
+            hint_km: Прошлая позиция на маршруте (км от начала), задаёт окно поиска
+
+        Returns:
+            (позиция на маршруте в км от начала линии, расстояние от маршрута в км)
+        """
+        if len(self.xs) < 2:
+            return 0.0, 0.0
+        px, py = lng * self.k_lng, lat * KM_PER_DEGREE
+        segments = len(self.xs) - 1
+
+        if hint_km is not None:
+            first = max(0, bisect_right(self.cumulative, hint_km - settings.ROUTE_SEARCH_BACK_KM) - 1)
+            last = min(segments, bisect_left(self.cumulative, hint_km + settings.ROUTE_SEARCH_AHEAD_KM))
+            if last > first:
+                offset_km, along_km = self._scan(px, py, first, last)
+                if offset_km * 1000 <= settings.ROUTE_OFF_ROUTE_M:
+                    return along_km, offset_km
+
+        # Нет подсказки или водитель вне окна (объезд, пропущенные пинги)
+        offset_km, along_km = self._scan(px, py, 0, segments)
+        return along_km, offset_km
+
+
+_routes: "OrderedDict[int, Tuple[str, RouteLine]]" = OrderedDict()
+
+
+def route_line(order_id: int, encoded: str) -> Optional[RouteLine]:
+    """Декодированный маршрут заказа из LRU-кэша воркера"""
+    cached = _routes.get(order_id)
+    if cached is not None and cached[0] == encoded:
+        _routes.move_to_end(order_id)
+        return cached[1]
+    points = polyline.decode(encoded)
+    if len(points) < 2:
+        return None
+    line = RouteLine(points)
+    _routes[order_id] = (encoded, line)
+    while len(_routes) > settings.ROUTE_CACHE_SIZE:
+        _routes.popitem(last=False)
+    return line
+
+
+def forget_route(order_id: int) -> None:
+    _routes.pop(order_id, None)
+
+
+def route_progress(order, lat: float, lng: float) -> Optional[Dict]:
+    """
+    Прогресс заказа вдоль сохранённого маршрута или None, если маршрута нет.
+
+    Длина упрощённой линии чуть меньше реальной, поэтому пройденное
+    расстояние масштабируется на total_distance из 2GIS.
+    """
+    if not getattr(order, 'route_polyline', None):
+        return None
+    line = route_line(order.id, order.route_polyline)
+    if line is None or line.length_km <= 0:
+        return None
+
+    total_distance = order.total_distance or line.length_km
+    scale = line.length_km / total_distance
+    hint_km = (order.completed_distance or 0.0) * scale
+    along_km, offset_km = line.project(lat, lng, hint_km)
+
+    progress = min(100.0, along_km / line.length_km * 100)
+    completed_distance = total_distance * progress / 100
+    return {
+        "progress": round(progress, 2),
+        "completed_distance": round(completed_distance, 3),
+        "remaining_distance": round(max(0.0, total_distance - completed_distance), 3),
+        "total_distance": round(total_distance, 3),
+        "off_route_distance": round(offset_km, 3)
+    }
+
+
+def build_route(route: Dict) -> Optional[Tuple[str, float]]:
+    """Упрощённая линия маршрута (encoded polyline) и его длина в км"""
+    points = extract_route_points(route)
+    if len(points) < 2:
+        return None
+    simplified = simplify(points)
+    distance_km = (route.get('distance') or 0) / 1000 or RouteLine(simplified).length_km
+    return polyline.encode(simplified), round(distance_km, 3)
+
+
+async def attach_order_route(order_id: int) -> bool:
+    """Один раз получает маршрут заказа из 2GIS и сохраняет его в заказ"""
+    from app.database import SessionLocal
+    from app import models
+    from app.services.twogis_service import twogis_service
+
+    def load():
+        db = SessionLocal()
+        try:
+            order = db.query(models.Order).filter(models.Order.id == order_id).first()
+            if order is None or order.route_polyline:
+                return None
+            if not all([order.origin_lat, order.origin_lng, order.destination_lat, order.destination_lng]):
+                return None
+            return (order.origin_lat, order.origin_lng), (order.destination_lat, order.destination_lng)
+        finally:
+            db.close()
+
+    def save(encoded: str, distance_km: float) -> None:
+        db = SessionLocal()
+        try:
+            db.query(models.Order).filter(models.Order.id == order_id).update(
+                {"route_polyline": encoded, "total_distance": distance_km},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    endpoints = await asyncio.to_thread(load)
+    if endpoints is None:
+        return False
+    route = await twogis_service.get_route(*endpoints)
+    if not route:
+        logger.warning(f"⚠️ Маршрут для заказа {order_id} не получен, прогресс считается по прямой")
+        return False
+    built = build_route(route)
+    if built is None:
+        logger.warning(f"⚠️ В ответе 2GIS нет геометрии маршрута заказа {order_id}")
+        return False
+    encoded, distance_km = built
+    await asyncio.to_thread(save, encoded, distance_km)
+    logger.info(f"🗺️ Маршрут заказа {order_id} сохранён: {distance_km} км, {len(encoded)} байт")
+    return True
+
+
+_pending: Set[asyncio.Task] = set()
+
+
+def schedule_route_fetch(order_id: int) -> None:
+    """Запуск attach_order_route в фоне (ответ водителю не ждёт 2GIS)"""
+    try:
+        task = asyncio.get_running_loop().create_task(attach_order_route(order_id))
+    except RuntimeError:
+        return
+    _pending.add(task)
+    task.add_done_callback(_route_task_done)
+
+
+def _route_task_done(task: asyncio.Task) -> None:
+    _pending.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"❌ Ошибка получения маршрута заказа: {task.exception()}")
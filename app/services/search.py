@@ -0,0 +1,380 @@
+"""
+Поиск водителей и заказов по подстроке.
+
+Для каждого водителя и заказа в search_documents хранится нормализованный
+текст: поля в нижнем регистре через " | ", телефоны - только цифрами, госномера -
+латиницей без пробелов. Номера автомобилей входят в текст водителя, поэтому
+поиск не требует JOIN с cars и не размножает строки в COUNT.
+
+Индекс подстрок: в PostgreSQL - триграммный GIN (pg_trgm) на content, он
+обслуживает LIKE '%...%'; в SQLite - FTS5-таблица с триграммным токенизатором
+(запросы от 3 символов). Ранжирование одинаковое в обеих БД: начало текста,
+затем начало поля/слова, затем вхождение в середину.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import case, delete, func, literal_column, or_, select, table, union_all
+from sqlalchemy.orm import attributes
+
+from app.services.orm_history import fields_changed
+
+logger = logging.getLogger(__name__)
+
+ENTITY_DRIVER = 'driver'
+ENTITY_ORDER = 'order'
+FIELD_SEPARATOR = ' | '
+MIN_INDEXED_TERM = 3  # короче - FTS5 с триграммами не ищет, в SQLite используется LIKE
+
+DRIVER_FIELDS = ('full_name', 'callsign', 'phone', 'driver_license_number')
+ORDER_FIELDS = ('order_number', 'origin', 'destination')
+
+_NON_WORD_RE = re.compile(r'[^\w]+')
+_PHONE_TERM_RE = re.compile(r'[\d\s+()\-]+')
+# Кириллические буквы, совпадающие по написанию с латинскими в госномерах
+_PLATE_LOOKALIKES = str.maketrans('АВЕКМНОРСТУХ', 'ABEKMHOPCTYX')
+
+_FTS = table('search_documents_fts')
+
+
+def normalize_text(value: Optional[str]) -> str:
+    """Нижний регистр, ё -> е, пунктуация -> пробел"""
+    if not value:
+        return ''
+    return ' '.join(_NON_WORD_RE.sub(' ', str(value).lower().replace('ё', 'е')).split())
+
+
+def normalize_phone(value: Optional[str]) -> str:
+    """Только цифры: '+996 (555) 12-34-56' -> '996555123456'"""
+    return ''.join(char for char in str(value or '') if char.isdigit())
+
+
+def normalize_plate(value: Optional[str]) -> str:
+    """Госномер латиницей без пробелов и дефисов: '01 КG 123 АВС' -> '01kg123abc'"""
+    if not value:
+        return ''
+    return ''.join(char for char in str(value).upper().translate(_PLATE_LOOKALIKES) if char.isalnum()).lower()
+
+
+def driver_document(full_name=None, callsign=None, phone=None, driver_license_number=None,
+                    plates: Iterable[str] = ()) -> str:
+    parts = [normalize_text(full_name), normalize_text(callsign), normalize_phone(phone),
+             normalize_plate(driver_license_number)]
+    parts += [normalize_plate(plate) for plate in plates]
+    return FIELD_SEPARATOR.join(part for part in parts if part)
+
+
+def order_document(order_number=None, origin=None, destination=None) -> str:
+    parts = [normalize_text(order_number), normalize_text(origin), normalize_text(destination)]
+    return FIELD_SEPARATOR.join(part for part in parts if part)
+
+
+def term_variants(term: Optional[str]) -> List[str]:
+    """Варианты строки поиска в форме документа: текст, цифры телефона, госномер"""
+    text = normalize_text(term)
+    if not text:
+        return []
+    variants = [text]
+    digits = normalize_phone(term)
+    if len(digits) >= MIN_INDEXED_TERM and _PHONE_TERM_RE.fullmatch(term.strip()) and digits not in variants:
+        variants.append(digits)
+    plate = normalize_plate(term)
+    if len(plate) >= MIN_INDEXED_TERM and plate not in variants:
+        variants.append(plate)
+    return variants
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SearchIndex:
+    """
+    Ведение search_documents и запросы к нему.
+
+    Документы обновляются в той же транзакции, что и изменения водителей,
+    их автомобилей и заказов (событие after_flush сессии). Изменения в обход
+    ORM и существующие данные догоняет rebuild(): на первом запуске, когда
+    индекс пуст, и вручную через rebuild_search_index.py.
+    """
+
+    def __init__(self):
+        self._listening = False
+        self._task: Optional[asyncio.Task] = None
+        self.indexed_total = 0
+        self.last_rebuild_stats: Dict = {}
+
+    # --- Запросы ---
+
+    def matches(self, db, entity: str, term: Optional[str]):
+        """
+        Подзапрос (entity_id, rank) документов, содержащих term; None - пустой запрос.
+        rank: 0 - совпадение с начала текста, 1 - с начала поля или слова, 2 - в середине.
+        """
+        from app.models import SearchDocument
+
+        variants = term_variants(term)
+        if not variants:
+            return None
+        sqlite = db.get_bind().dialect.name == 'sqlite'
+        content = SearchDocument.content
+        conditions = []
+        for variant in variants:
+            if sqlite and len(variant) >= MIN_INDEXED_TERM:
+                phrase = '"' + variant.replace('"', '""') + '"'
+                conditions.append(SearchDocument.id.in_(
+                    select(literal_column('rowid')).select_from(_FTS).where(
+                        literal_column('search_documents_fts').op('MATCH')(phrase)
+                    )
+                ))
+            else:
+                conditions.append(content.like(f"%{_escape_like(variant)}%", escape='\\'))
+        rank = case(
+            (or_(*(content.like(f"{_escape_like(v)}%", escape='\\') for v in variants)), 0),
+            (or_(*(content.like(f"% {_escape_like(v)}%", escape='\\') for v in variants)), 1),
+            else_=2
+        )
+        return select(SearchDocument.entity_id, rank.label('rank')).where(
+            SearchDocument.entity == entity, or_(*conditions)
+        ).subquery()
+
+    def order_matches(self, db, term: Optional[str]):
+        """Заказы, найденные по своему тексту или по тексту назначенного водителя: (entity_id, rank)"""
+        from app.models import Order
+
+        orders = self.matches(db, ENTITY_ORDER, term)
+        if orders is None:
+            return None
+        drivers = self.matches(db, ENTITY_DRIVER, term)
+        by_driver = select(Order.id.label('entity_id'), drivers.c.rank).join(
+            drivers, Order.driver_id == drivers.c.entity_id
+        )
+        combined = union_all(select(orders.c.entity_id, orders.c.rank), by_driver).subquery()
+        return select(
+            combined.c.entity_id, func.min(combined.c.rank).label('rank')
+        ).group_by(combined.c.entity_id).subquery()
+
+    def apply(self, query, db, entity: str, id_column, term: Optional[str], ranked: bool = True):
+        """
+        Ограничивает запрос найденными по term объектами (JOIN с подзапросом
+        совпадений, по строке на объект). ranked - сортировка по релевантности, затем по id.
+        """
+        found = self.order_matches(db, term) if entity == ENTITY_ORDER else self.matches(db, entity, term)
+        if found is None:
+            return query
+        query = query.join(found, id_column == found.c.entity_id)
+        if ranked:
+            query = query.order_by(found.c.rank, id_column)
+        return query
+
+    # --- Ведение документов ---
+
+    @staticmethod
+    def _upsert(connection, rows: List[Dict]) -> None:
+        from app.models import SearchDocument
+
+        if not rows:
+            return
+        if connection.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(SearchDocument.__table__)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['entity', 'entity_id'],
+            set_={'content': statement.excluded.content}
+        ), rows)
+
+    @staticmethod
+    def _delete(connection, entity: str, ids: Iterable[int]) -> None:
+        from app.models import SearchDocument
+
+        ids = list(ids)
+        if ids:
+            documents = SearchDocument.__table__
+            connection.execute(delete(documents).where(documents.c.entity == entity, documents.c.entity_id.in_(ids)))
+
+    @staticmethod
+    def _driver_rows(connection, driver_ids: Iterable[int]) -> List[Dict]:
+        """Документы водителей из БД вместе с номерами их автомобилей"""
+        from app.models import Car, Driver
+
+        driver_ids = list(driver_ids)
+        if not driver_ids:
+            return []
+        plates: Dict[int, List[str]] = {}
+        for driver_id, plate in connection.execute(
+            select(Car.driver_id, Car.license_plate).where(Car.driver_id.in_(driver_ids))
+        ):
+            plates.setdefault(driver_id, []).append(plate)
+        rows = connection.execute(
+            select(Driver.id, *(getattr(Driver, field) for field in DRIVER_FIELDS)).where(Driver.id.in_(driver_ids))
+        )
+        return [
+            {
+                'entity': ENTITY_DRIVER,
+                'entity_id': row[0],
+                'content': driver_document(*row[1:], plates=plates.get(row[0], ()))
+            }
+            for row in rows
+        ]
+
+    def reindex_drivers(self, connection, driver_ids: Iterable[int]) -> None:
+        driver_ids = set(driver_ids)
+        rows = self._driver_rows(connection, driver_ids)
+        self._upsert(connection, rows)
+        self._delete(connection, ENTITY_DRIVER, driver_ids - {row['entity_id'] for row in rows})
+        self.indexed_total += len(rows)
+
+    def _after_flush(self, session, flush_context) -> None:
+        from app.models import Car, Driver, Order
+
+        drivers: Set[int] = set()
+        orders: List = []
+        deleted_orders: Set[int] = set()
+        new, dirty, deleted = session.new, session.dirty, session.deleted
+        for obj in chain(new, dirty, deleted):
+            if isinstance(obj, Driver):
+                if obj in deleted or obj in new or fields_changed(obj, DRIVER_FIELDS):
+                    drivers.add(obj.id)
+            elif isinstance(obj, Car):
+                if obj in deleted or obj in new or fields_changed(obj, ('license_plate', 'driver_id')):
+                    history = attributes.get_history(obj, 'driver_id')
+                    drivers.update(value for value in chain([obj.driver_id], history.deleted or ()) if value)
+            elif isinstance(obj, Order):
+                if obj in deleted:
+                    deleted_orders.add(obj.id)
+                elif obj in new or fields_changed(obj, ORDER_FIELDS):
+                    orders.append(obj)
+
+        if not (drivers or orders or deleted_orders):
+            return
+        connection = session.connection()
+        if drivers:
+            self.reindex_drivers(connection, drivers)
+        if orders:
+            self._upsert(connection, [
+                {
+                    'entity': ENTITY_ORDER,
+                    'entity_id': order.id,
+                    'content': order_document(*(getattr(order, field) for field in ORDER_FIELDS))
+                }
+                for order in orders
+            ])
+            self.indexed_total += len(orders)
+        self._delete(connection, ENTITY_ORDER, deleted_orders)
+
+    def listen(self, session_factory) -> None:
+        from sqlalchemy import event
+
+        if not self._listening:
+            event.listen(session_factory, 'after_flush', self._after_flush)
+            self._listening = True
+
+    # --- Полное построение ---
+
+    def rebuild(self, chunk_size: int = 10000) -> Dict:
+        """
+        Строит документы всех водителей и заказов заново (пакетами по chunk_size),
+        удаляет документы удалённых объектов. Повторный запуск даёт тот же результат.
+        """
+        from app.database import SessionLocal
+        from app.models import Driver, Order, SearchDocument
+
+        started = time.perf_counter()
+        counts = {}
+        db = SessionLocal()
+        try:
+            for entity, model in ((ENTITY_DRIVER, Driver), (ENTITY_ORDER, Order)):
+                last_id, count = 0, 0
+                while True:
+                    connection = db.connection()
+                    if entity == ENTITY_DRIVER:
+                        ids = connection.execute(
+                            select(Driver.id).where(Driver.id > last_id).order_by(Driver.id).limit(chunk_size)
+                        ).scalars().all()
+                        rows = self._driver_rows(connection, ids)
+                    else:
+                        result = connection.execute(
+                            select(Order.id, *(getattr(Order, field) for field in ORDER_FIELDS))
+                            .where(Order.id > last_id).order_by(Order.id).limit(chunk_size)
+                        ).all()
+                        ids = [row[0] for row in result]
+                        rows = [
+                            {'entity': ENTITY_ORDER, 'entity_id': row[0], 'content': order_document(*row[1:])}
+                            for row in result
+                        ]
+                    if not ids:
+                        break
+                    self._upsert(connection, rows)
+                    db.commit()
+                    count += len(rows)
+                    last_id = ids[-1]
+                documents = SearchDocument.__table__
+                db.connection().execute(delete(documents).where(
+                    documents.c.entity == entity,
+                    ~select(model.id).where(model.id == documents.c.entity_id).exists()
+                ))
+                db.commit()
+                counts[entity] = count
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        self.last_rebuild_stats = {**counts, 'duration_s': round(time.perf_counter() - started, 2)}
+        logger.info(f"🔎 Поисковый индекс построен: {self.last_rebuild_stats}")
+        return self.last_rebuild_stats
+
+    def needs_rebuild(self) -> bool:
+        """Водители или заказы есть, а документов ещё нет (первый запуск после миграции)"""
+        from app.database import SessionLocal
+        from app.models import Driver, Order, SearchDocument
+
+        db = SessionLocal()
+        try:
+            if db.query(SearchDocument.id).first() is not None:
+                return False
+            return db.query(Driver.id).first() is not None or db.query(Order.id).first() is not None
+        finally:
+            db.close()
+
+    async def _build_if_empty(self) -> None:
+        try:
+            if await asyncio.to_thread(self.needs_rebuild):
+                await asyncio.to_thread(self.rebuild)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка построения поискового индекса: {e}")
+
+    def start(self) -> None:
+        from app.database import SessionLocal
+
+        self.listen(SessionLocal)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._build_if_empty())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            'indexed_total': self.indexed_total,
+            'last_rebuild': self.last_rebuild_stats
+        }
+
+
+search_index = SearchIndex()
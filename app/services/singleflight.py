@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых запросов: пока запрос по ключу
+    выполняется, остальные вызывающие ждут его результат, а не отправляют свой.
+
+    Запрос выполняется отдельной задачей, вызывающие ждут её через shield:
+    отмена одного вызывающего (клиент закрыл автодополнение) не отменяет
+    запрос для остальных. Задача отменяется, только когда её больше никто не ждёт.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _, key=key, task=task: self._forget(key, task))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1 and self._calls.get(key) is task:
+                task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Запрос {self.name} {key} завершился ошибкой: {task.exception()}")
+
+    def stats(self) -> Dict:
+        return {
+            'in_flight': len(self._calls),
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled
+        }
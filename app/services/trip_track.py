@@ -0,0 +1,233 @@
+import asyncio
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services import polyline
+from app.services.distance import distance_km as _distance_km
+
+logger = logging.getLogger(__name__)
+
+# Множители polyline для (lat, lng, unix-время): ~1 м и 1 секунда
+TRACK_FACTORS = (1e5, 1e5, 1)
+
+
+def _accepted_step_km(last: Tuple[float, float, int], lat: float, lng: float, ts: int) -> Optional[float]:
+    """Длина шага до новой точки (км) или None, если точку нужно отбросить"""
+    step_km = _distance_km(last[0], last[1], lat, lng)
+    if step_km * 1000 < settings.TRACK_MIN_STEP_M:
+        return None
+    elapsed = max(1, ts - last[2])
+    if step_km / (elapsed / 3600) > settings.TRACK_MAX_SPEED_KMH:
+        # Скачок GPS - точку не принимаем
+        return None
+    return step_km
+
+
+class _ActiveTrack:
+    __slots__ = ('driver_id', 'last_point', 'pending', 'pending_distance', 'distance_km',
+                 'stored_points', 'chunk_started', 'finished')
+
+    def __init__(self, driver_id: Optional[int]):
+        self.driver_id = driver_id
+        self.last_point: Optional[Tuple[float, float, int]] = None
+        self.pending: List[Tuple[float, float, int]] = []
+        self.pending_distance = 0.0
+        self.distance_km = 0.0
+        self.stored_points = 0
+        self.chunk_started = time.time()
+        self.finished = False
+
+
+class TripTrackRecorder:
+    """
+    Запись GPS-треков поездок фрагментами.
+
+    Точки активного заказа копятся в памяти и раз в несколько секунд
+    сбрасываются в order_tracks: одна строка на фрагмент (до TRACK_CHUNK_POINTS
+    точек или TRACK_CHUNK_SECONDS секунд), точки - encoded polyline с
+    дельтами lat/lng/времени. Каждый фрагмент самодостаточен и только
+    вставляется, поэтому несколько воркеров могут писать трек одного заказа.
+
+    Пройденное расстояние считается инкрементально по принятым точкам.
+    Точки ближе TRACK_MIN_STEP_M к предыдущей и скачки со скоростью выше
+    TRACK_MAX_SPEED_KMH отбрасываются, после TRACK_MAX_POINTS точек трек
+    перестаёт расти (расстояние продолжает считаться) - объём ограничен
+    несколькими КБ на поездку.
+    """
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval if flush_interval is not None else settings.LOCATION_FLUSH_INTERVAL
+        self._tracks: Dict[int, _ActiveTrack] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._tracks
+
+    def append(self, order_id: int, driver_id: Optional[int], lat: float, lng: float,
+               timestamp: Optional[float] = None) -> float:
+        """Добавляет точку в трек заказа, возвращает пройденное расстояние (км) по данным воркера"""
+        ts = int(timestamp if timestamp is not None else time.time())
+        with self._lock:
+            track = self._tracks.get(order_id)
+            if track is None:
+                track = self._tracks[order_id] = _ActiveTrack(driver_id)
+            if track.finished:
+                return track.distance_km
+
+            last = track.last_point
+            if last is not None:
+                step_km = _accepted_step_km(last, lat, lng, ts)
+                if step_km is None:
+                    return track.distance_km
+                track.distance_km += step_km
+                track.pending_distance += step_km
+
+            point = (lat, lng, ts)
+            track.last_point = point
+            if track.stored_points < settings.TRACK_MAX_POINTS:
+                if not track.pending:
+                    track.chunk_started = time.time()
+                track.pending.append(point)
+                track.stored_points += 1
+            return track.distance_km
+
+    def distance_km(self, order_id: int) -> Optional[float]:
+        track = self._tracks.get(order_id)
+        return round(track.distance_km, 3) if track else None
+
+    def finish(self, order_id: int) -> None:
+        """Поездка завершена/отменена: трек будет дописан при следующем сбросе и забыт"""
+        with self._lock:
+            track = self._tracks.get(order_id)
+            if track is not None:
+                track.finished = True
+
+    # --- Запись в БД ---
+
+    def _take_chunks(self, force: bool) -> List[Dict]:
+        now = time.time()
+        chunks = []
+        with self._lock:
+            for order_id, track in list(self._tracks.items()):
+                ready = (
+                    force or track.finished
+                    or len(track.pending) >= settings.TRACK_CHUNK_POINTS
+                    or (track.pending and now - track.chunk_started >= settings.TRACK_CHUNK_SECONDS)
+                )
+                if ready and track.pending:
+                    chunks.append({
+                        'order_id': order_id,
+                        'driver_id': track.driver_id,
+                        'started_at': datetime.fromtimestamp(track.pending[0][2]),
+                        'ended_at': datetime.fromtimestamp(track.pending[-1][2]),
+                        'point_count': len(track.pending),
+                        'distance_km': round(track.pending_distance, 4),
+                        'points': polyline.encode(track.pending, factors=TRACK_FACTORS)
+                    })
+                    track.pending = []
+                    track.pending_distance = 0.0
+                idle = track.last_point is not None and now - track.last_point[2] > settings.TRACK_IDLE_TTL
+                if (track.finished or idle) and not track.pending:
+                    del self._tracks[order_id]
+        return chunks
+
+    def flush(self, force: bool = False) -> int:
+        """Записывает готовые фрагменты треков, возвращает число вставленных строк"""
+        from app.database import SessionLocal
+        from app import models
+
+        chunks = self._take_chunks(force)
+        if not chunks:
+            return 0
+
+        db = SessionLocal()
+        try:
+            db.execute(models.OrderTrack.__table__.insert(), chunks)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"❌ Ошибка записи треков поездок ({len(chunks)} фрагментов): {e}")
+            return 0
+        finally:
+            db.close()
+        return len(chunks)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка фоновой записи треков: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        flushed = await asyncio.to_thread(self.flush, True)
+        logger.info(f"🛑 Запись треков остановлена, сброшено фрагментов: {flushed}")
+
+
+def load_track(db, order_id: int) -> Dict:
+    """
+    Собирает трек заказа из фрагментов.
+
+    Фрагменты одного заказа могли записать разные воркеры, и их точки
+    перекрываются по времени. Поэтому точки всех фрагментов сливаются,
+    сортируются по времени, и расстояние считается один раз по общему
+    треку с теми же фильтрами, что и при записи. Сумма расстояний
+    фрагментов завышала бы пробег: шаги каждого воркера и переходы
+    между фрагментами дублируют один и тот же участок.
+    """
+    from app import models
+
+    chunks = db.query(models.OrderTrack).filter(
+        models.OrderTrack.order_id == order_id
+    ).order_by(models.OrderTrack.started_at, models.OrderTrack.id).all()
+
+    merged: List[Tuple[float, float, int]] = []
+    for chunk in chunks:
+        merged.extend(
+            (lat, lng, int(ts))
+            for lat, lng, ts in polyline.decode(chunk.points, dims=3, factors=TRACK_FACTORS)
+        )
+    merged.sort(key=lambda point: point[2])
+
+    points: List[Tuple[float, float, int]] = []
+    distance_km = 0.0
+    for lat, lng, ts in merged:
+        if points:
+            step_km = _accepted_step_km(points[-1], lat, lng, ts)
+            if step_km is None:
+                continue
+            distance_km += step_km
+        points.append((lat, lng, ts))
+
+    return {
+        'points': points,
+        'point_count': len(points),
+        'distance_km': round(distance_km, 3),
+        'chunks': len(chunks),
+        'bytes': sum(len(chunk.points) for chunk in chunks),
+        'started_at': datetime.fromtimestamp(points[0][2]).isoformat() if points else None,
+        'ended_at': datetime.fromtimestamp(points[-1][2]).isoformat() if points else None
+    }
+
+
+# Создаем экземпляр записи треков
+trip_tracks = TripTrackRecorder()
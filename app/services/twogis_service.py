@@ -7,6 +7,12 @@ import time
 import logging
 from typing import Dict, List, Tuple, Optional, Any
 from app.config import settings
+from app.services.ttl_cache import TTLCache
+from app.services.geo_cache import geo_cache, geocode_key, route_key, normalize_address
+from app.services.singleflight import SingleFlight
+from app.services.address_index import address_index, canonical_address
+from app.services import geohash
+from app.services.distance import distance_km
 
 logger = logging.getLogger(__name__)
 
@@ -23,9 +29,22 @@ class TwoGISService:
         self.distance_matrix_url = settings.TWOGIS_DISTANCE_MATRIX_URL
         self.search_url = settings.TWOGIS_SEARCH_URL
         
-        # Кэш для геокодирования
-        self._geocoding_cache = {}
-        self._routing_cache = {}
+        # Кэши ответов (LRU + TTL, отдельные лимиты)
+        self._geocoding_cache = TTLCache('geocode', settings.GEOCODING_CACHE_SIZE, settings.GEOCODING_CACHE_TTL)
+        self._reverse_cache = TTLCache('reverse_geocode', settings.REVERSE_GEOCODING_CACHE_SIZE,
+                                       settings.GEOCODING_CACHE_TTL)
+        self._routing_cache = TTLCache('route', settings.ROUTING_CACHE_SIZE, settings.ROUTING_CACHE_TTL)
+
+        # Одновременные одинаковые запросы ждут один ответ 2GIS
+        self._inflight = SingleFlight('2gis')
+
+        # Общая сессия с пулом keep-alive соединений (одна на воркер)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=settings.TWOGIS_CONNECT_TIMEOUT,
+            sock_read=settings.TWOGIS_READ_TIMEOUT
+        )
         
         logger.info(f"🚀 TwoGISService инициализирован с API ключом: {'*' * 8 + self.api_key[-4:] if self.api_key else 'НЕ НАСТРОЕН'}")
         if self.secret_key:
@@ -33,6 +52,56 @@ class TwoGISService:
         else:
             logger.info(f"ℹ️ Секретный ключ не настроен (необязательно)")
     
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Общая сессия воркера. Создаётся в lifespan приложения (start),
+        а при вызове вне него (скрипты) - лениво при первом запросе.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=settings.TWOGIS_POOL_PER_HOST,
+                keepalive_timeout=settings.TWOGIS_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=settings.TWOGIS_DNS_CACHE_TTL,
+                use_dns_cache=True
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout)
+        return self._session
+
+    async def start(self) -> None:
+        self._get_session()
+        logger.info(f"🚀 Сессия 2GIS открыта: до {settings.TWOGIS_POOL_PER_HOST} соединений на хост")
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("🛑 Сессия 2GIS закрыта")
+        self._session = None
+
+    async def warm_up(self) -> int:
+        """Наполняет кэши воркера последними записями общего кэша geo_cache"""
+        if not geo_cache.enabled:
+            return 0
+        entries = await asyncio.to_thread(geo_cache.load_recent, settings.GEO_CACHE_WARMUP_LIMIT)
+        caches = {'geocode': self._geocoding_cache, 'route': self._routing_cache}
+        loaded = 0
+        for kind, key, value, ttl_left in entries:
+            cache = caches.get(kind)
+            if cache is not None and ttl_left > 0:
+                cache.set(key, value, ttl=min(ttl_left, cache.ttl))
+                loaded += 1
+        logger.info(f"🔥 Кэш 2GIS прогрет из geo_cache: {loaded} записей")
+        return loaded
+
+    def cache_stats(self) -> Dict:
+        stats = {
+            cache.name: cache.stats()
+            for cache in (self._geocoding_cache, self._reverse_cache, self._routing_cache)
+        }
+        stats['persistent'] = geo_cache.stats()
+        stats['singleflight'] = self._inflight.stats()
+        stats['address_index'] = address_index.stats()
+        return stats
+
     def _create_signature(self, data: str) -> str:
         """
         Создание подписи для запросов (если нужен секретный ключ)
@@ -60,56 +129,63 @@ class TwoGISService:
             return None
         
         # Проверяем кэш
-        cache_key = f"{address}_{region}"
-        if cache_key in self._geocoding_cache:
-            cache_data = self._geocoding_cache[cache_key]
-            if time.time() - cache_data['timestamp'] < settings.GEOCODING_CACHE_TTL:
-                logger.info(f"✅ Адрес найден в кэше: {address}")
-                return cache_data['data']
-        
+        cache_key = geocode_key(address, region)
+        cached = self._geocoding_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"✅ Адрес найден в кэше: {address}")
+            return cached
+
+        return await self._inflight.run(cache_key, lambda: self._fetch_geocode(address, region, cache_key))
+
+    async def _fetch_geocode(self, address: str, region: str, cache_key: str) -> Optional[Dict]:
+        """Общий кэш geo_cache, затем запрос к 2GIS (один на ключ, см. SingleFlight)"""
+        cached = await geo_cache.aget(cache_key)
+        if cached is not None:
+            self._geocoding_cache.set(cache_key, cached)
+            logger.info(f"✅ Адрес найден в общем кэше: {address}")
+            return cached
+
         try:
-            async with aiohttp.ClientSession() as session:
-                params = {
-                    'q': address,
-                    'region': region,
-                    'fields': 'items.point,items.address_name,items.full_name',
-                    'key': self.api_key
-                }
+            session = self._get_session()
+            params = {
+                'q': address,
+                'region': region,
+                'fields': 'items.point,items.address_name,items.full_name',
+                'key': self.api_key
+            }
                 
-                logger.debug(f"🌐 Отправка запроса к 2GIS Geocoder API: {params}")
+            logger.debug(f"🌐 Отправка запроса к 2GIS Geocoder API: {params}")
                 
-                async with session.get(self.geocoder_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        logger.debug(f"📡 Ответ от 2GIS API: {data}")
+            async with session.get(self.geocoder_url, params=params, timeout=self._timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    logger.debug(f"📡 Ответ от 2GIS API: {data}")
                         
-                        if data.get('result') and data['result'].get('items'):
-                            # Берем первый найденный результат
-                            item = data['result']['items'][0]
-                            result = {
-                                'lat': item['point']['lat'],
-                                'lon': item['point']['lon'],
-                                'address': item.get('full_name', address),
-                                'name': item.get('name', ''),
-                                'confidence': 1.0
-                            }
+                    if data.get('result') and data['result'].get('items'):
+                        # Берем первый найденный результат
+                        item = data['result']['items'][0]
+                        result = {
+                            'lat': item['point']['lat'],
+                            'lon': item['point']['lon'],
+                            'address': item.get('full_name', address),
+                            'name': item.get('name', ''),
+                            'confidence': 1.0
+                        }
                             
-                            # Сохраняем в кэш
-                            self._geocoding_cache[cache_key] = {
-                                'data': result,
-                                'timestamp': time.time()
-                            }
+                        # Сохраняем в кэш
+                        self._geocoding_cache.set(cache_key, result)
+                        await geo_cache.aset(cache_key, 'geocode', result, settings.GEO_CACHE_GEOCODING_TTL)
                             
-                            logger.info(f"✅ Адрес успешно геокодирован: {result}")
-                            return result
-                        else:
-                            print(f"❌ Адрес не найден: {address}")
-                            logger.warning(f"⚠️ Адрес не найден в ответе API: {address}")
-                            return None
+                        logger.info(f"✅ Адрес успешно геокодирован: {result}")
+                        return result
                     else:
-                        print(f"❌ Ошибка геокодирования: {response.status}")
-                        logger.error(f"❌ Ошибка API геокодирования: {response.status}")
+                        print(f"❌ Адрес не найден: {address}")
+                        logger.warning(f"⚠️ Адрес не найден в ответе API: {address}")
                         return None
+                else:
+                    print(f"❌ Ошибка геокодирования: {response.status}")
+                    logger.error(f"❌ Ошибка API геокодирования: {response.status}")
+                    return None
                         
         except Exception as e:
             print(f"❌ Ошибка при геокодировании адреса '{address}': {e}")
@@ -135,74 +211,76 @@ class TwoGISService:
             return None
         
         # Проверяем кэш
-        cache_key = f"{origin}_{destination}_{transport_type}"
-        if cache_key in self._routing_cache:
-            cache_data = self._routing_cache[cache_key]
-            if time.time() - cache_data['timestamp'] < settings.ROUTING_CACHE_TTL:
-                return cache_data['data']
+        cache_key = route_key(origin, destination, transport_type)
+        cached = self._routing_cache.get(cache_key)
+        if cached is None:
+            cached = await geo_cache.aget(cache_key)
+            if cached is not None:
+                self._routing_cache.set(cache_key, cached)
+        if cached is not None:
+            return cached
         
         try:
-            async with aiohttp.ClientSession() as session:
-                # Новый формат запроса для API 7.0.0
-                request_body = {
-                    "points": [
-                        {
-                            "type": "stop",
-                            "lon": origin[1],  # долгота
-                            "lat": origin[0]   # широта
-                        },
-                        {
-                            "type": "stop", 
-                            "lon": destination[1],  # долгота
-                            "lat": destination[0]   # широта
-                        }
-                    ],
-                    "locale": "ru",
-                    "transport": transport_type,
-                    "route_mode": "fastest",  # Самый быстрый маршрут
-                    "traffic_mode": "jam",    # Учитываем пробки
-                    "output": "detailed"      # Детальный ответ с геометрией
-                }
+            session = self._get_session()
+            # Новый формат запроса для API 7.0.0
+            request_body = {
+                "points": [
+                    {
+                        "type": "stop",
+                        "lon": origin[1],  # долгота
+                        "lat": origin[0]   # широта
+                    },
+                    {
+                        "type": "stop", 
+                        "lon": destination[1],  # долгота
+                        "lat": destination[0]   # широта
+                    }
+                ],
+                "locale": "ru",
+                "transport": transport_type,
+                "route_mode": "fastest",  # Самый быстрый маршрут
+                "traffic_mode": "jam",    # Учитываем пробки
+                "output": "detailed"      # Детальный ответ с геометрией
+            }
                 
-                # URL с API ключом в параметрах
-                url_with_key = f"{self.routing_url}?key={self.api_key}"
+            # URL с API ключом в параметрах
+            url_with_key = f"{self.routing_url}?key={self.api_key}"
                 
-                headers = {
-                    'Content-Type': 'application/json'
-                }
+            headers = {
+                'Content-Type': 'application/json'
+            }
                 
-                async with session.post(url_with_key, 
-                                       headers=headers,
-                                       json=request_body) as response:
-                    if response.status == 200:
-                        data = await response.json()
+            async with session.post(url_with_key, 
+                                   headers=headers,
+                                   json=request_body,
+                                   timeout=self._timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
                         
-                        if data.get('result') and len(data['result']) > 0:
-                            route = data['result'][0]
-                            result = {
-                                'distance': route.get('total_distance', 0),  # в метрах
-                                'duration': route.get('total_duration', 0),  # в секундах
-                                'geometry': route.get('maneuvers', []),       # манёвры с геометрией
-                                'ui_distance': route.get('ui_total_distance', {}),
-                                'ui_duration': route.get('ui_total_duration', ''),
-                                'transport_type': transport_type
-                            }
+                    if data.get('result') and len(data['result']) > 0:
+                        route = data['result'][0]
+                        result = {
+                            'distance': route.get('total_distance', 0),  # в метрах
+                            'duration': route.get('total_duration', 0),  # в секундах
+                            'geometry': route.get('maneuvers', []),       # манёвры с геометрией
+                            'ui_distance': route.get('ui_total_distance', {}),
+                            'ui_duration': route.get('ui_total_duration', ''),
+                            'transport_type': transport_type
+                        }
                             
-                            # Сохраняем в кэш
-                            self._routing_cache[cache_key] = {
-                                'data': result,
-                                'timestamp': time.time()
-                            }
+                        # Сохраняем в кэш
+                        self._routing_cache.set(cache_key, result)
+                        await geo_cache.aset(cache_key, 'route', result, settings.GEO_CACHE_ROUTING_TTL)
                             
-                            return result
-                        else:
-                            print(f"❌ Маршрут не найден в ответе API")
-                            return None
+                        return result
                     else:
-                        print(f"❌ Ошибка построения маршрута: {response.status}")
-                        response_text = await response.text()
-                        print(f"❌ Ответ сервера: {response_text}")
+                        print(f"❌ Маршрут не найден в ответе API")
                         return None
+                else:
+                    print(f"❌ Ошибка построения маршрута: {response.status}")
+                    response_text = await response.text()
+                    print(f"❌ Ответ сервера: {response_text}")
+                    return None
                         
         except Exception as e:
             print(f"❌ Ошибка при построении маршрута: {e}")
@@ -227,38 +305,39 @@ class TwoGISService:
             return None
         
         try:
-            async with aiohttp.ClientSession() as session:
-                # Подготавливаем данные для POST запроса
-                payload = {
-                    'origins': [{'lat': lat, 'lon': lon} for lat, lon in origins],
-                    'destinations': [{'lat': lat, 'lon': lon} for lat, lon in destinations],
-                    'type': transport_type,
-                    'traffic_mode': 'enabled'  # Учитываем пробки
-                }
+            session = self._get_session()
+            # Подготавливаем данные для POST запроса
+            payload = {
+                'origins': [{'lat': lat, 'lon': lon} for lat, lon in origins],
+                'destinations': [{'lat': lat, 'lon': lon} for lat, lon in destinations],
+                'type': transport_type,
+                'traffic_mode': 'enabled'  # Учитываем пробки
+            }
                 
-                headers = {
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Key {self.api_key}'
-                }
+            headers = {
+                'Content-Type': 'application/json',
+                'Authorization': f'Key {self.api_key}'
+            }
                 
-                async with session.post(self.distance_matrix_url, 
-                                      json=payload, 
-                                      headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
+            async with session.post(self.distance_matrix_url, 
+                                  json=payload, 
+                                  headers=headers,
+                                  timeout=self._timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
                         
-                        if data.get('result'):
-                            return {
-                                'distances': data['result'].get('distances', []),
-                                'durations': data['result'].get('durations', []),
-                                'status': data['result'].get('status', '')
-                            }
-                        else:
-                            print(f"❌ Матрица расстояний не получена")
-                            return None
+                    if data.get('result'):
+                        return {
+                            'distances': data['result'].get('distances', []),
+                            'durations': data['result'].get('durations', []),
+                            'status': data['result'].get('status', '')
+                        }
                     else:
-                        print(f"❌ Ошибка получения матрицы расстояний: {response.status}")
+                        print(f"❌ Матрица расстояний не получена")
                         return None
+                else:
+                    print(f"❌ Ошибка получения матрицы расстояний: {response.status}")
+                    return None
                         
         except Exception as e:
             print(f"❌ Ошибка при получении матрицы расстояний: {e}")
@@ -279,14 +358,11 @@ class TwoGISService:
             logger.error("❌ API ключ 2GIS не настроен для обратной геокодировки")
             return None
             
-        cache_key = f"reverse_{lat:.6f}_{lon:.6f}"
-        
-        # Проверяем кэш
-        if cache_key in self._geocoding_cache:
-            cached_result = self._geocoding_cache[cache_key]
-            if time.time() - cached_result['timestamp'] < settings.GEOCODING_CACHE_TTL:
-                logger.info(f"🗄️ Возвращаем адрес из кэша: {cached_result['data']}")
-                return cached_result['data']
+        # Проверяем кэш: ячейка точки и соседние, уже разрешённая точка не дальше радиуса
+        cached = self._cached_reverse(lat, lon)
+        if cached is not None:
+            logger.info(f"🗄️ Возвращаем адрес из кэша: {cached}")
+            return cached
         
         try:
             # Используем геокодер 2GIS для обратного поиска
@@ -294,45 +370,74 @@ class TwoGISService:
                 'point': f"{lon},{lat}",  # 2GIS ожидает lon,lat
                 'key': self.api_key,
                 'types': 'building,adm_div',
+                'fields': 'items.point',
                 'radius_m': 100,  # радиус поиска 100 метров
                 'output_format': 'json'
             }
             
-            async with aiohttp.ClientSession() as session:
-                logger.info(f"🔄 Обратная геокодировка через 2GIS API: {lat}, {lon}")
+            session = self._get_session()
+            logger.info(f"🔄 Обратная геокодировка через 2GIS API: {lat}, {lon}")
                 
-                async with session.get(self.geocoder_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
+            async with session.get(self.geocoder_url, params=params, timeout=self._timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
                         
-                        if data.get('result') and data['result'].get('items'):
-                            # Берем первый результат
-                            item = data['result']['items'][0]
-                            address_name = item.get('full_name', '')
+                    if data.get('result') and data['result'].get('items'):
+                        # Берем первый результат
+                        item = data['result']['items'][0]
+                        address_name = item.get('full_name', '')
                             
-                            if address_name:
-                                # Кэшируем результат
-                                self._geocoding_cache[cache_key] = {
-                                    'data': address_name,
-                                    'timestamp': time.time()
-                                }
+                        if address_name:
+                            # Кэшируем по точке запроса, а не по центру найденного здания:
+                            # 2GIS ищет здание в радиусе 100 м, и GPS-точка обычно лежит
+                            # в десятках метров от его центра - повторный запрос с той же
+                            # или соседней точки должен попадать в кэш
+                            self._remember_reverse(lat, lon, address_name)
                                 
-                                logger.info(f"✅ Адрес найден: {address_name}")
-                                return address_name
-                            else:
-                                logger.warning(f"⚠️ Адрес не найден в результатах API")
-                                return None
+                            logger.info(f"✅ Адрес найден: {address_name}")
+                            return address_name
                         else:
-                            logger.warning(f"⚠️ Пустой результат от API геокодера")
+                            logger.warning(f"⚠️ Адрес не найден в результатах API")
                             return None
                     else:
-                        logger.error(f"❌ HTTP ошибка при обратной геокодировке: {response.status}")
+                        logger.warning(f"⚠️ Пустой результат от API геокодера")
                         return None
+                else:
+                    logger.error(f"❌ HTTP ошибка при обратной геокодировке: {response.status}")
+                    return None
                         
         except Exception as e:
             logger.error(f"❌ Ошибка обратной геокодировки: {e}")
             return None
 
+    def _cached_reverse(self, lat: float, lon: float) -> Optional[str]:
+        """Адрес ближайшей уже разрешённой точки в пределах REVERSE_GEOCODE_MATCH_RADIUS_M"""
+        precision = settings.REVERSE_GEOCODE_CELL_PRECISION
+        cell = geohash.encode(lat, lon, precision)
+        best = None
+        # Дальше соседних ячеек адреса не ищутся: больший радиус давал бы попадание
+        # или промах в зависимости от положения точки внутри ячейки
+        best_km = min(settings.REVERSE_GEOCODE_MATCH_RADIUS_M, geohash.neighbours_radius_m(precision, lat)) / 1000
+        for key in geohash.neighbours(cell):
+            for point_lat, point_lon, address_name in self._reverse_cache.peek(key) or ():
+                km = distance_km(lat, lon, point_lat, point_lon)
+                if km <= best_km:
+                    best, best_km = address_name, km
+        self._reverse_cache.record(best is not None)
+        return best
+
+    def _remember_reverse(self, lat: float, lon: float, address_name: str) -> None:
+        """Запоминает адрес точки запроса в её ячейке"""
+        cell = geohash.encode(lat, lon, settings.REVERSE_GEOCODE_CELL_PRECISION)
+        # Точки с тем же адресом в пределах радиуса новая точка заменяет
+        radius_km = settings.REVERSE_GEOCODE_MATCH_RADIUS_M / 1000
+        entries = [
+            entry for entry in self._reverse_cache.peek(cell) or ()
+            if entry[2] != address_name or distance_km(lat, lon, entry[0], entry[1]) > radius_km
+        ]
+        entries.append((lat, lon, address_name))
+        self._reverse_cache.set(cell, entries[-settings.REVERSE_GEOCODE_CELL_ENTRIES:])
+
     async def search_addresses(self, query: str, region: str = "kg", limit: int = 5) -> List[Dict]:
         """
         Поиск адресов с автодополнением
@@ -345,40 +450,54 @@ class TwoGISService:
         Returns:
             Список найденных адресов
         """
+        # Сначала адреса из истории заказов: повторные точки подачи не идут в 2GIS
+        local = address_index.search(query, limit) if settings.ADDRESS_INDEX_ENABLED else []
+        if len(local) >= min(limit, settings.ADDRESS_INDEX_MIN_RESULTS):
+            return local
+
         if not self.api_key:
             print("⚠️ 2GIS API ключ не настроен")
-            return []
-        
+            return local
+
+        flight_key = f"search:{region}:{limit}:{normalize_address(query)}"
+        results = await self._inflight.run(flight_key, lambda: self._fetch_search(query, region, limit))
+        if not local:
+            return list(results)
+        seen = {canonical_address(item['address']) for item in local}
+        merged = local + [item for item in results if canonical_address(item['address']) not in seen]
+        return merged[:limit]
+
+    async def _fetch_search(self, query: str, region: str, limit: int) -> List[Dict]:
         try:
-            async with aiohttp.ClientSession() as session:
-                params = {
-                    'q': query,
-                    'region': region,
-                    'fields': 'items.point,items.address_name,items.full_name,items.name',
-                    'key': self.api_key,
-                    'limit': limit
-                }
+            session = self._get_session()
+            params = {
+                'q': query,
+                'region': region,
+                'fields': 'items.point,items.address_name,items.full_name,items.name',
+                'key': self.api_key,
+                'limit': limit
+            }
                 
-                async with session.get(self.geocoder_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
+            async with session.get(self.geocoder_url, params=params, timeout=self._timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
                         
-                        if data.get('result') and data['result'].get('items'):
-                            results = []
-                            for item in data['result']['items']:
-                                results.append({
-                                    'lat': item['point']['lat'],
-                                    'lon': item['point']['lon'],
-                                    'address': item.get('full_name', ''),
-                                    'name': item.get('name', ''),
-                                    'short_address': item.get('address_name', '')
-                                })
-                            return results
-                        else:
-                            return []
+                    if data.get('result') and data['result'].get('items'):
+                        results = []
+                        for item in data['result']['items']:
+                            results.append({
+                                'lat': item['point']['lat'],
+                                'lon': item['point']['lon'],
+                                'address': item.get('full_name', ''),
+                                'name': item.get('name', ''),
+                                'short_address': item.get('address_name', '')
+                            })
+                        return results
                     else:
-                        print(f"❌ Ошибка поиска адресов: {response.status}")
                         return []
+                else:
+                    print(f"❌ Ошибка поиска адресов: {response.status}")
+                    return []
                         
         except Exception as e:
             print(f"❌ Ошибка при поиске адресов: {e}")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Заполнение дневных сводок аналитики (order_daily_stats, balance_daily_stats)
+из истории заказов и транзакций баланса.
+
+Каждый день пересчитывается целиком, поэтому скрипт можно запускать
+повторно: результат не изменится. Без --since обрабатывается вся история.
+
+Запуск: python backfill_analytics.py [--since 2025-01-01]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+from datetime import datetime
+
+from app.services.analytics_rollup import analytics_rollup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--since', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(), default=None)
+    args = parser.parse_args()
+
+    print("📊 Заполнение дневных сводок аналитики...")
+    days = analytics_rollup.backfill(since=args.since)
+    print(f"✅ Готово, обработано дней: {days}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк автодополнения адресов по истории заказов (services/address_index.py).
+
+Строит индекс из синтетических адресов (улицы x номера домов, частоты по
+закону Ципфа) без БД и меряет время поиска для запросов по началу слова и
+с номером дома. Результаты сверяются с полным перебором всех адресов с тем
+же ранжированием.
+
+Запуск: python benchmark_address_index.py [--addresses 130000] [--repeat 200]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+import heapq
+import random
+import time
+
+from app.services.address_index import AddressIndex
+
+STREETS = [
+    'Айтматова', 'Жибек Жолу', 'Ленина', 'Курманжан Датки', 'Масалиева', 'Навои', 'Кыргызстан',
+    'Исанова', 'Алымбека', 'Монуева', 'Токтогула', 'Манаса', 'Чуй', 'Советская', 'Фрунзе',
+    'Ахунбаева', 'Байтик Баатыра', 'Шопокова', 'Раззакова', 'Абдрахманова'
+]
+QUERIES = ['Айтм', 'Aytmatova', 'Жибек', 'Ленина 1', 'Aytmatova 12', 'Jibek Jolu 5', 'Масалиева 10', 'Навои 7а']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--addresses', type=int, default=130000)
+    parser.add_argument('--repeat', type=int, default=200)
+    return parser.parse_args()
+
+
+def build(n_addresses, seed=7):
+    rnd = random.Random(seed)
+    index = AddressIndex()
+    # Как AddressIndex.build: топы пересчитываются один раз в конце
+    index._bulk = True
+    now = time.time()
+    houses = max(1, n_addresses // len(STREETS))
+    for number in range(n_addresses):
+        street = STREETS[number % len(STREETS)]
+        house = number // len(STREETS) + 1
+        suffix = rnd.choice(['', '', '', 'а', '/1'])
+        address = f"ул. {street} {house}{suffix}, Ош"
+        for _ in range(max(1, int(50 / (1 + house * 50 / houses)))):
+            index.add(address, 40.5, 72.8, now - rnd.uniform(0, 90 * 86400))
+    index._bulk = False
+    index._rebuild_top()
+    return index
+
+
+def reference(index, query, limit=5):
+    """Полный перебор: те же правила совпадения и ранжирования"""
+    from app.services.address_index import address_tokens
+
+    parts = address_tokens(query)
+    matched = [
+        entry_id for entry_id, entry in enumerate(index._entries)
+        if all(any(token.startswith(part) for token in entry.tokens) for part in parts)
+    ]
+    return [index._entries[entry_id].address for entry_id in heapq.nlargest(limit, matched, key=index._rank_key)]
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    index = build(args.addresses)
+    print(f"📇 Адресов: {len(index)} | построение: {time.perf_counter() - started:.1f} с")
+
+    mismatches = 0
+    for query in QUERIES:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            results = index.search(query)
+        elapsed_us = (time.perf_counter() - started) / args.repeat * 1e6
+        same = [result['address'] for result in results] == reference(index, query)
+        mismatches += not same
+        print(f"{query:>16} | {elapsed_us:8.1f} мкс | найдено: {len(results)} | "
+              f"{'совпадает с перебором ✅' if same else 'расходится с перебором ❌'}")
+    print(f"Статистика индекса: {index.stats()}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
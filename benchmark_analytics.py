@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк аналитики заказов (/disp/analytics, /api/analytics/orders/{period}).
+
+Заполняет БД синтетическими заказами и сравнивает прежний расчёт
+(загрузка ORM-объектов и суммирование в Python) с агрегирующим запросом
+crud.get_order_analytics. Заодно проверяет, что цифры совпадают: прежний
+расчёт здесь идёт по всем заказам, без ограничения в 10 000 строк.
+
+Запуск: python benchmark_analytics.py [--orders 10000 100000 1000000] [--database-url sqlite:///bench.db]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+
+STATUSES = ['Выполняется', 'Завершен', 'Отменен']
+BATCH = 50000
+
+
+def seed(session, n_orders, now, seed=42):
+    rnd = random.Random(seed)
+    session.query(models.Order).delete()
+    rows = []
+    for order_id in range(1, n_orders + 1):
+        # Заказы за ~2 года, часть без цены или с нулевой ценой
+        price = rnd.choice([None, 0.0] + [round(rnd.uniform(80, 1500), 2)] * 8)
+        rows.append({
+            'id': order_id,
+            'order_number': f'{order_id:020d}',
+            'time': '12:00:00',
+            'origin': 'Ош',
+            'destination': 'Ош',
+            'created_at': now - timedelta(seconds=rnd.randint(0, 730 * 86400)),
+            'status': rnd.choice(STATUSES),
+            'price': price
+        })
+        if len(rows) == BATCH:
+            session.execute(insert(models.Order), rows)
+            rows = []
+    if rows:
+        session.execute(insert(models.Order), rows)
+    session.commit()
+
+
+def legacy_analytics(session, now):
+    """Прежний расчёт в Python по всем заказам"""
+    all_orders = session.query(models.Order).all()
+    orders_with_price = [order for order in all_orders if order.price and order.price > 0]
+    periods = {}
+    for period, days in crud.ORDER_ANALYTICS_PERIODS.items():
+        if days is None:
+            selected = orders_with_price
+        else:
+            selected = [o for o in orders_with_price if o.created_at >= now - timedelta(days=days)]
+        earnings = sum(order.price for order in selected)
+        periods[period] = {
+            'earnings': earnings,
+            'count': len(selected),
+            'avg': earnings / len(selected) if selected else 0
+        }
+    return {
+        'periods': periods,
+        'max_order': max((order.price for order in orders_with_price), default=0),
+        'min_order': min((order.price for order in orders_with_price), default=0),
+        'total_orders': len(all_orders),
+        'completed_orders': len([o for o in all_orders if o.status == 'Завершен']),
+        'cancelled_orders': len([o for o in all_orders if o.status == 'Отменен'])
+    }
+
+
+def assert_same(legacy, aggregated):
+    for key in ('max_order', 'min_order', 'total_orders', 'completed_orders', 'cancelled_orders'):
+        assert abs(legacy[key] - aggregated[key]) < 1e-6, (key, legacy[key], aggregated[key])
+    for period, stats in legacy['periods'].items():
+        for key, value in stats.items():
+            other = aggregated['periods'][period][key]
+            # Суммы float в разном порядке сложения расходятся в последних знаках
+            assert abs(value - other) <= 1e-6 * max(1.0, abs(value)), (period, key, value, other)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run(Session, n_orders, skip_legacy):
+    now = datetime.now()
+    with Session() as session:
+        _, seed_ms = timed(seed, session, n_orders, now)
+    with Session() as session:
+        aggregated, aggregated_ms = timed(crud.get_order_analytics, session, now)
+    line = (f"Заказов: {n_orders:>8} | заполнение: {seed_ms / 1000:6.1f} с | "
+            f"SQL-агрегат: {aggregated_ms:8.1f} мс")
+    if not skip_legacy:
+        with Session() as session:
+            legacy, legacy_ms = timed(legacy_analytics, session, now)
+        assert_same(legacy, aggregated)
+        line += f" | Python по ORM: {legacy_ms:9.1f} мс | x{legacy_ms / max(aggregated_ms, 1e-3):.0f} | цифры совпадают ✅"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--database-url', default=None, help='по умолчанию - временная SQLite')
+    parser.add_argument('--skip-legacy', action='store_true', help='не запускать прежний расчёт')
+    args = parser.parse_args()
+
+    url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'analytics.db')}"
+    engine = create_engine(url)
+    models.Base.metadata.create_all(engine, tables=[models.Driver.__table__, models.Order.__table__])
+    Session = sessionmaker(bind=engine)
+
+    print(f"📊 Бенчмарк аналитики заказов ({engine.dialect.name})")
+    for n_orders in args.orders:
+        run(Session, n_orders, args.skip_legacy)
+
+
+if __name__ == "__main__":
+    main()
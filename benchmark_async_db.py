@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк задержек горячих эндпоинтов водителя под смешанной нагрузкой.
+
+Запускает приложение (uvicorn, один воркер) на заполненной БД и параллельно
+гоняет два потока запросов:
+  - водители: update-location с заказом, active-trip, new-orders, статус заказа;
+  - диспетчеры: API аналитики (запросы по всем заказам и водителям).
+Печатает p50/p95/p99 горячих запросов и число запросов в секунду. Пока
+синхронный запрос блокирует цикл событий, ждут все водители воркера - это
+видно по p99.
+
+Сравнение "до/после": --tree указывает на другую копию проекта, например
+  git worktree add /tmp/before <коммит> && python benchmark_async_db.py --tree /tmp/before
+
+Запуск: python benchmark_async_db.py [--drivers 500] [--orders 200000] [--duration 20] [--database-url ...]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--drivers', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--driver-clients', type=int, default=50, help='одновременных водителей')
+    parser.add_argument('--dispatcher-clients', type=int, default=2, help='одновременных диспетчеров')
+    parser.add_argument('--interval', type=float, default=1.0, help='средняя пауза водителя между запросами, с')
+    parser.add_argument('--duration', type=float, default=20.0, help='секунд нагрузки')
+    parser.add_argument('--database-url', default=None, help='по умолчанию - временная SQLite')
+    parser.add_argument('--tree', default='.', help='каталог проекта, из которого запускать сервер')
+    parser.add_argument('--skip-seed', action='store_true', help='не заполнять БД заново')
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+os.environ['DATABASE_URL'] = ARGS.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'async_db.db')}"
+
+from datetime import date, datetime, timedelta
+
+import aiohttp
+from sqlalchemy import insert
+
+from app import models
+from app.database import engine
+from app.services.analytics_rollup import analytics_rollup
+from app.services.search import search_index
+
+STATUSES = ['Завершен', 'Отменен', 'Завершен', 'Завершен']
+DISPATCHER_URLS = ['/api/analytics/orders/all', '/api/analytics/orders-chart/365', '/api/analytics/balance/all']
+BATCH = 50000
+
+
+def seed(n_drivers, n_orders, seed=11):
+    """Водители в Оше, у каждого одна активная поездка, плюс история заказов"""
+    rnd = random.Random(seed)
+    models.Base.metadata.create_all(engine)
+    if engine.dialect.name == 'sqlite':
+        # WAL сохраняется в файле БД: читатели аналитики не блокируют запись позиций, как в PostgreSQL
+        with engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+    now = datetime.now()
+    with engine.begin() as connection:
+        for model in (models.Order, models.Car, models.Driver):
+            connection.execute(model.__table__.delete())
+        connection.execute(insert(models.Driver), [{
+            'id': driver_id, 'unique_id': f'U{driver_id}', 'full_name': f'Водитель {driver_id}',
+            'birth_date': date(1990, 1, 1), 'callsign': f'cs{driver_id}', 'city': 'Ош',
+            'driver_license_number': f'AB{driver_id:07d}', 'tariff': 'Эконом', 'phone': f'+996555{driver_id:06d}',
+            'balance': 1000.0, 'registration_date': now
+        } for driver_id in range(1, n_drivers + 1)])
+
+        rows = []
+        for order_id in range(1, n_orders + 1):
+            active = order_id <= n_drivers
+            rows.append({
+                'id': order_id, 'order_number': f'{order_id:020d}', 'time': '12:00:00',
+                'origin': 'ул. Ленина 1, Ош', 'destination': 'ул. Навои 20, Ош',
+                'origin_lat': 40.51, 'origin_lng': 72.80, 'destination_lat': 40.53, 'destination_lng': 72.79,
+                'driver_id': order_id if active else rnd.randint(1, n_drivers),
+                'status': 'Выполняется' if active else rnd.choice(STATUSES),
+                'price': round(rnd.uniform(100, 600), 2),
+                'created_at': now - timedelta(seconds=0 if active else rnd.randint(0, 365 * 86400))
+            })
+            if len(rows) == BATCH:
+                connection.execute(insert(models.Order), rows)
+                rows = []
+        if rows:
+            connection.execute(insert(models.Order), rows)
+    # Сводки и поисковый индекс строим заранее, иначе сервер займётся ими при старте во время замера
+    analytics_rollup.backfill()
+    search_index.rebuild()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(session, base_url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f'{base_url}/api/orders/1/status') as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError('Сервер не запустился')
+
+
+async def driver_client(session, base_url, driver_id, until, latencies, errors):
+    rnd = random.Random(driver_id)
+    lat, lng = 40.51, 72.80
+    while time.monotonic() < until:
+        lat += rnd.uniform(0, 0.0005)
+        lng -= rnd.uniform(0, 0.0002)
+        kind = rnd.choice(['location', 'location', 'active-trip', 'new-orders', 'status'])
+        started = time.perf_counter()
+        try:
+            if kind == 'location':
+                request = session.post(f'{base_url}/api/driver/update-location', json={
+                    'driver_id': driver_id, 'latitude': lat, 'longitude': lng, 'order_id': driver_id
+                })
+            elif kind == 'active-trip':
+                request = session.get(f'{base_url}/api/driver/{driver_id}/active-trip')
+            elif kind == 'new-orders':
+                request = session.get(f'{base_url}/api/driver/{driver_id}/new-orders')
+            else:
+                request = session.get(f'{base_url}/api/orders/{driver_id}/status')
+            async with request as response:
+                await response.read()
+                if response.status >= 500:
+                    errors[kind] = errors.get(kind, 0) + 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors[kind] = errors.get(kind, 0) + 1
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(rnd.uniform(0.5, 1.5) * ARGS.interval)
+
+
+async def dispatcher_client(session, base_url, until, latencies):
+    index = 0
+    while time.monotonic() < until:
+        started = time.perf_counter()
+        try:
+            async with session.get(base_url + DISPATCHER_URLS[index % len(DISPATCHER_URLS)]) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        latencies.append((time.perf_counter() - started) * 1000)
+        index += 1
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if ordered else 0.0
+
+
+async def run_load(base_url):
+    hot, slow, errors = [], [], {}
+    timeout = aiohttp.ClientTimeout(total=60)
+    connector = aiohttp.TCPConnector(limit=0)
+    # Любая cookie session проходит AuthMiddleware диспетчерской
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector, cookies={'session': 'benchmark'}) as session:
+        await wait_ready(session, base_url)
+        until = time.monotonic() + ARGS.duration
+        clients = [
+            driver_client(session, base_url, driver_id, until, hot, errors)
+            for driver_id in range(1, min(ARGS.driver_clients, ARGS.drivers) + 1)
+        ]
+        clients += [dispatcher_client(session, base_url, until, slow) for _ in range(ARGS.dispatcher_clients)]
+        await asyncio.gather(*clients)
+    return hot, slow, errors
+
+
+def main():
+    tree = os.path.abspath(ARGS.tree)
+    print(f"⏱️ Смешанная нагрузка ({engine.dialect.name}), сервер из {tree}")
+    if not ARGS.skip_seed:
+        started = time.perf_counter()
+        seed(ARGS.drivers, ARGS.orders)
+        print(f"Заполнение: водителей {ARGS.drivers}, заказов {ARGS.orders} за {time.perf_counter() - started:.1f} с")
+
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=tree)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        hot, slow, errors = asyncio.run(run_load(f'http://127.0.0.1:{port}'))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    print(f"Водители ({len(hot)} запросов, {len(hot) / ARGS.duration:.0f}/с): "
+          f"p50 {percentile(hot, 0.50):.1f} мс | p95 {percentile(hot, 0.95):.1f} мс | "
+          f"p99 {percentile(hot, 0.99):.1f} мс | max {max(hot, default=0):.1f} мс")
+    print(f"Диспетчеры ({len(slow)} запросов): p50 {percentile(slow, 0.50):.1f} мс | p99 {percentile(slow, 0.99):.1f} мс")
+    if errors:
+        print(f"❌ Ошибки: {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк расчёта расстояний.
+
+Сравнивает geopy geodesic (было в calculate_distance) со скалярными
+distance_km / haversine_km и векторным ядром distance_one_to_many,
+а также меряет их погрешность относительно geodesic
+на широтах Оша и Бишкека.
+
+Запуск: python benchmark_distance.py [--pairs 20000] [--radius-km 1 5 20 50 200]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+
+from app.services.distance import (
+    KM_PER_DEGREE, distance_km, haversine_km, distance_one_to_many
+)
+
+try:
+    from geopy.distance import geodesic
+except ImportError:  # geopy нужен только для эталона
+    geodesic = None
+
+CITIES = {
+    'Ош': (40.5283, 72.7985),
+    'Бишкек': (42.8746, 74.5698),
+}
+
+
+def random_pairs(center, radius_km, n, seed=42):
+    rnd = random.Random(seed)
+    lat0, lng0 = center
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = dlat / math.cos(math.radians(lat0))
+    return [
+        (lat0 + rnd.uniform(-dlat, dlat), lng0 + rnd.uniform(-dlng, dlng),
+         lat0 + rnd.uniform(-dlat, dlat), lng0 + rnd.uniform(-dlng, dlng))
+        for _ in range(n)
+    ]
+
+
+def timed(func, pairs):
+    started = time.perf_counter()
+    for lat1, lng1, lat2, lng2 in pairs:
+        func(lat1, lng1, lat2, lng2)
+    return (time.perf_counter() - started) / len(pairs) * 1e9
+
+
+def accuracy(pairs):
+    """Максимальная относительная (%) и абсолютная (м) ошибка против geodesic"""
+    worst = {'distance_km': (0.0, 0.0), 'haversine_km': (0.0, 0.0)}
+    for lat1, lng1, lat2, lng2 in pairs:
+        reference = geodesic((lat1, lng1), (lat2, lng2)).kilometers
+        if reference < 0.01:
+            continue
+        for name, func in (('distance_km', distance_km), ('haversine_km', haversine_km)):
+            error_km = abs(func(lat1, lng1, lat2, lng2) - reference)
+            rel, absolute = worst[name]
+            worst[name] = (max(rel, error_km / reference * 100), max(absolute, error_km * 1000))
+    return worst
+
+
+def run_scalar(pairs):
+    print(f"  скалярно, нс на пару: distance_km {timed(distance_km, pairs):8.0f} | "
+          f"haversine_km {timed(haversine_km, pairs):8.0f}", end='')
+    if geodesic is not None:
+        geodesic_ns = timed(lambda a, b, c, d: geodesic((a, b), (c, d)).kilometers, pairs[:2000])
+        print(f" | geodesic {geodesic_ns:8.0f}")
+    else:
+        print(" | geodesic не установлен")
+
+
+def run_vector(center, n_points):
+    pairs = random_pairs(center, 10, n_points)
+    lats = np.array([p[0] for p in pairs])
+    lngs = np.array([p[1] for p in pairs])
+
+    started = time.perf_counter()
+    distance_one_to_many(center[0], center[1], lats, lngs)
+    one_ns = (time.perf_counter() - started) / n_points * 1e9
+
+    print(f"  векторно, нс на пару: one_to_many({n_points}) {one_ns:6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pairs', type=int, default=20000)
+    parser.add_argument('--radius-km', type=float, nargs='+', default=[1, 5, 20, 50, 200])
+    args = parser.parse_args()
+
+    print("📏 Бенчмарк расчёта расстояний")
+    for city, center in CITIES.items():
+        print(f"{city} {center}")
+        run_scalar(random_pairs(center, 10, args.pairs))
+        run_vector(center, args.pairs * 10)
+        if geodesic is None:
+            continue
+        for radius_km in args.radius_km:
+            worst = accuracy(random_pairs(center, radius_km, 2000))
+            print(f"  R={radius_km:>5g} км | погрешность distance_km: "
+                  f"{worst['distance_km'][0]:.5f}% ({worst['distance_km'][1]:.2f} м) | "
+                  f"haversine_km: {worst['haversine_km'][0]:.3f}% ({worst['haversine_km'][1]:.1f} м)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поиска водителей и заказов (services/search.py).
+
+Заполняет БД синтетическими водителями, автомобилями и заказами, строит
+поисковый индекс и сравнивает прежние запросы (ILIKE '%...%' по полям
+с LEFT JOIN cars / JOIN drivers) с поиском по индексу: время COUNT +
+первой страницы и совпадение найденных множеств. Прежний поиск водителей
+через LEFT JOIN cars считает водителя с двумя машинами дважды - это видно
+в колонке COUNT.
+
+Запуск: python benchmark_search.py [--drivers 100000] [--orders 1000000] [--database-url postgresql://...]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--drivers', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--database-url', default=None, help='по умолчанию - временная SQLite')
+    parser.add_argument('--repeat', type=int, default=3)
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+os.environ['DATABASE_URL'] = ARGS.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'search.db')}"
+
+from datetime import date, datetime
+
+from sqlalchemy import insert, or_
+
+from app import models
+from app.database import SessionLocal, engine
+from app.services.search import ENTITY_DRIVER, ENTITY_ORDER, search_index
+
+SURNAMES = ['Иванов', 'Садыков', 'Абдыкадыров', 'Токтогулов', 'Маматов', 'Юсупов', 'Осмонов', 'Кадыров', 'Турсунов', 'Эргешов']
+NAMES = ['Азамат', 'Бакыт', 'Данияр', 'Эрлан', 'Нурлан', 'Улан', 'Тимур', 'Руслан', 'Марат', 'Алмаз']
+STREETS = ['Ленина', 'Курманжан Датки', 'Масалиева', 'Навои', 'Кыргызстан', 'Исанова', 'Алымбека', 'Монуева']
+LETTERS = 'ABEKMHOPCTYX'
+BATCH = 50000
+
+DRIVER_TERMS = ['Иванов Азамат', 'Данияр', 'cs1234', '555 12', '02KG101', '101 ВАА']
+ORDER_TERMS = ['Ленина 12', 'Датки', '00000004', 'Маматов Улан', '996 555']
+
+
+def plate(car_id):
+    """Уникальный номер вида '01 KG 123 ABC' для car_id"""
+    letters = ''.join(LETTERS[car_id // len(LETTERS) ** power % len(LETTERS)] for power in range(3))
+    return f"0{car_id % 9 + 1} KG {car_id % 900 + 100} {letters}"
+
+
+def seed(n_drivers, n_orders, seed=7):
+    rnd = random.Random(seed)
+    models.Base.metadata.create_all(engine, tables=[
+        models.Driver.__table__, models.Car.__table__, models.Order.__table__, models.SearchDocument.__table__
+    ])
+    with engine.begin() as connection:
+        for table in (models.SearchDocument, models.Order, models.Car, models.Driver):
+            connection.execute(table.__table__.delete())
+
+        drivers, cars = [], []
+        for driver_id in range(1, n_drivers + 1):
+            drivers.append({
+                'id': driver_id, 'unique_id': f'U{driver_id}',
+                'full_name': f"{rnd.choice(SURNAMES)} {rnd.choice(NAMES)}",
+                'birth_date': date(1990, 1, 1), 'callsign': f'cs{driver_id}', 'city': 'Ош',
+                'driver_license_number': f'AB{driver_id:07d}', 'tariff': 'Эконом',
+                'phone': f"+996 {rnd.randint(500, 999)} {rnd.randint(10, 99)}-{rnd.randint(10, 99)}-{rnd.randint(10, 99)}",
+                'balance': 0.0, 'registration_date': datetime.now()
+            })
+            for _ in range(rnd.choice([0, 1, 1, 1, 2])):
+                car_id = len(cars) + 1
+                cars.append({
+                    'id': car_id, 'driver_id': driver_id, 'brand': 'Toyota', 'model': 'Camry', 'year': 2015,
+                    'transmission': 'автомат', 'tariff': 'Эконом', 'service_type': 'Такси', 'vin': f'VIN{car_id}',
+                    'license_plate': plate(car_id)
+                })
+        for rows, model in ((drivers, models.Driver), (cars, models.Car)):
+            for start in range(0, len(rows), BATCH):
+                connection.execute(insert(model), rows[start:start + BATCH])
+
+        orders = []
+        for order_id in range(1, n_orders + 1):
+            orders.append({
+                'id': order_id, 'order_number': f'{order_id:020d}', 'time': '12:00:00',
+                'origin': f"ул. {rnd.choice(STREETS)} {rnd.randint(1, 200)}, Ош",
+                'destination': f"ул. {rnd.choice(STREETS)} {rnd.randint(1, 200)}, Ош",
+                'driver_id': rnd.randint(1, n_drivers), 'status': 'Завершен', 'created_at': datetime.now()
+            })
+            if len(orders) == BATCH:
+                connection.execute(insert(models.Order), orders)
+                orders = []
+        if orders:
+            connection.execute(insert(models.Order), orders)
+
+
+def legacy_drivers(db, term):
+    pattern = f"%{term}%"
+    return db.query(models.Driver).join(
+        models.Car, models.Driver.id == models.Car.driver_id, isouter=True
+    ).filter(or_(
+        models.Driver.full_name.ilike(pattern),
+        models.Driver.callsign.ilike(pattern),
+        models.Driver.phone.ilike(pattern),
+        models.Car.license_plate.ilike(pattern)
+    ))
+
+
+def legacy_orders(db, term):
+    pattern = f"%{term}%"
+    return db.query(models.Order).join(models.Driver).filter(or_(
+        models.Order.order_number.ilike(pattern),
+        models.Order.origin.ilike(pattern),
+        models.Order.destination.ilike(pattern),
+        models.Driver.full_name.ilike(pattern),
+        models.Driver.phone.ilike(pattern)
+    ))
+
+
+def indexed_drivers(db, term):
+    return search_index.apply(db.query(models.Driver), db, ENTITY_DRIVER, models.Driver.id, term)
+
+
+def indexed_orders(db, term):
+    return search_index.apply(db.query(models.Order), db, ENTITY_ORDER, models.Order.id, term)
+
+
+def timed_page(build, db, term, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        query = build(db, term)
+        count = query.count()
+        query.limit(10).all()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+def compare(db, title, terms, legacy, indexed, id_column, repeat):
+    print(f"\n{title}")
+    for term in terms:
+        legacy_count, legacy_ms = timed_page(legacy, db, term, repeat)
+        count, indexed_ms = timed_page(indexed, db, term, repeat)
+        legacy_ids = {row[0] for row in legacy(db, term).with_entities(id_column).all()}
+        found_ids = {row[0] for row in indexed(db, term).with_entities(id_column).all()}
+        covered = '✅' if legacy_ids <= found_ids else f'❌ пропущено {len(legacy_ids - found_ids)}'
+        print(f"  {term!r:18} | ILIKE: {legacy_ms:8.1f} мс, COUNT {legacy_count:>7} ({len(legacy_ids):>7} уник.) | "
+              f"индекс: {indexed_ms:7.1f} мс, найдено {count:>7} | прежние результаты найдены: {covered}")
+
+
+def main():
+    print(f"🔎 Бенчмарк поиска ({engine.dialect.name}): водителей {ARGS.drivers}, заказов {ARGS.orders}")
+    started = time.perf_counter()
+    seed(ARGS.drivers, ARGS.orders)
+    print(f"Заполнение: {time.perf_counter() - started:.1f} с")
+    stats = search_index.rebuild(chunk_size=20000)
+    print(f"Построение индекса: {stats}")
+
+    db = SessionLocal()
+    try:
+        compare(db, "Водители", DRIVER_TERMS, legacy_drivers, indexed_drivers, models.Driver.id, ARGS.repeat)
+        compare(db, "Заказы", ORDER_TERMS, legacy_orders, indexed_orders, models.Order.id, ARGS.repeat)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Проверка асинхронных обработчиков водителя при активном подписчике заказа.
+
+Эндпоинты водителя работают с AsyncSession; после commit они публикуют
+состояние заказа пассажиру (order_state читает водителя и его машины).
+Ленивая загрузка связей вне асинхронной сессии падает с MissingGreenlet, и
+водитель получает 500 за уже сохранённое действие. Скрипт вызывает каждый
+обработчик - напрямую и через путь WebSocket (_call_driver_handler) - с
+подписчиком на поток заказа и проверяет ответ 200 и событие с водителем.
+
+Запуск: python check_async_handlers.py [--database-url ...]
+Код возврата 1, если хоть одна проверка не прошла.
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+import os
+import tempfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url', default=None, help='по умолчанию - временная SQLite')
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+os.environ['DATABASE_URL'] = ARGS.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'async_handlers.db')}"
+
+import asyncio
+import json
+from datetime import date, datetime
+
+from starlette.requests import Request
+
+from app import models
+from app.database import AsyncSessionLocal, SessionLocal, engine
+from app.main import (
+    UpdateDriverLocationRequest, _call_driver_handler, accept_order_by_driver, complete_trip,
+    decline_order_by_driver, get_active_trip, get_new_orders_for_driver, start_trip, update_driver_location
+)
+from app.services.order_events import order_events
+
+DRIVER_ID = 1
+
+
+def seed():
+    models.Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        db.add(models.Driver(
+            id=DRIVER_ID, unique_id='U1', full_name='Водитель 1', birth_date=date(1990, 1, 1), callsign='cs1',
+            city='Ош', driver_license_number='AB0000001', tariff='Эконом', phone='+996555000001',
+            balance=1000.0, registration_date=datetime.now()
+        ))
+        db.add(models.Car(
+            driver_id=DRIVER_ID, brand='Toyota', model='Camry', year=2015, transmission='автомат',
+            tariff='Эконом', service_type='Такси', vin='VIN1', license_plate='01 KG 101 ABC'
+        ))
+        # Свой заказ на каждую проверку: шина событий не повторяет неизменившийся статус
+        for order_id in range(1, len(CASES) + 1):
+            db.add(models.Order(
+                id=order_id, order_number=f'{order_id:020d}', time='12:00:00',
+                origin='ул. Ленина 1, Ош', destination='ул. Навои 20, Ош', driver_id=DRIVER_ID,
+                origin_lat=40.51, origin_lng=72.80, destination_lat=40.53, destination_lng=72.79,
+                # Маршрут уже есть: принятие не пойдёт за ним во внешний API
+                route_polyline='_p~iF~ps|U', status='Отменен', price=300.0
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def set_order_status(order_id, status):
+    db = SessionLocal()
+    try:
+        db.get(models.Order, order_id).status = status
+        db.commit()
+    finally:
+        db.close()
+
+
+def json_request(body):
+    """Request с JSON-телом для обработчиков, читающих request.json()"""
+    raw = json.dumps(body).encode()
+
+    async def receive():
+        return {'type': 'http.request', 'body': raw, 'more_body': False}
+
+    return Request({'type': 'http', 'method': 'POST', 'headers': [], 'query_string': b''}, receive)
+
+
+async def via_http(handler, *args):
+    async with AsyncSessionLocal() as db:
+        response = await handler(*args, db=db)
+    return response.status_code, json.loads(response.body)
+
+
+async def via_ws(handler, *args):
+    result = await _call_driver_handler(handler, *args)
+    return (200 if result.get('success') else 500), result
+
+
+# (название, статус заказа до вызова, вызов, ждём событие статуса пассажиру)
+CASES = [
+    ('accept-order', 'Назначен', lambda order_id: via_http(accept_order_by_driver, DRIVER_ID, order_id, None), True),
+    ('ws accept', 'Назначен', lambda order_id: via_ws(accept_order_by_driver, DRIVER_ID, order_id, None), True),
+    ('start-trip', 'Принят', lambda order_id: via_http(start_trip, DRIVER_ID, order_id), True),
+    ('update-location', 'Выполняется', lambda order_id: via_http(update_driver_location, UpdateDriverLocationRequest(
+        driver_id=DRIVER_ID, latitude=40.515, longitude=72.799, order_id=order_id
+    )), False),
+    ('active-trip', 'Выполняется', lambda order_id: via_http(get_active_trip, DRIVER_ID), False),
+    ('complete-trip', 'Выполняется', lambda order_id: via_http(
+        complete_trip, DRIVER_ID, order_id, json_request({'completion_percentage': 100, 'rating': 5})
+    ), True),
+    ('new-orders', 'Назначен', lambda order_id: via_http(get_new_orders_for_driver, DRIVER_ID), False),
+    ('decline-order', 'Назначен', lambda order_id: via_http(decline_order_by_driver, DRIVER_ID, order_id, None), True),
+    ('ws decline', 'Назначен', lambda order_id: via_ws(decline_order_by_driver, DRIVER_ID, order_id, None), True),
+]
+
+
+async def run_case(order_id, name, status, call, expect_event) -> bool:
+    set_order_status(order_id, status)
+    queue, _, _ = order_events.subscribe(order_id)
+    try:
+        code, body = await call(order_id)
+        events = []
+        while not queue.empty():
+            events.append(queue.get_nowait())
+    finally:
+        order_events.unsubscribe(order_id, queue)
+
+    problems = []
+    if code != 200:
+        problems.append(f"ответ {code}: {body.get('error') or body.get('detail') or body}")
+    status_events = [data for _, event, data in events if event == 'status']
+    if expect_event and code == 200:
+        if not status_events:
+            problems.append("пассажир не получил событие статуса")
+        elif not (status_events[-1].get('driver') or {}).get('car_number'):
+            problems.append("в событии нет водителя с машиной")
+
+    if problems:
+        print(f"❌ {name}: {'; '.join(problems)}")
+        return False
+    print(f"✅ {name}" + (f": {status_events[-1]['status']}" if status_events else ""))
+    return True
+
+
+async def main():
+    print(f"🔌 Обработчики водителя с подписчиком заказа ({engine.dialect.name})")
+    seed()
+    failures = 0
+    for order_id, case in enumerate(CASES, start=1):
+        if not await run_case(order_id, *case):
+            failures += 1
+    if failures:
+        print(f"❌ Не прошло: {failures} из {len(CASES)}")
+        sys.exit(1)
+    print(f"✅ Все {len(CASES)} проверок прошли")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
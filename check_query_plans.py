@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Проверка планов горячих запросов: ни один не должен читать таблицу целиком.
+
+Заполняет БД синтетическими данными, собирает статистику (ANALYZE) и для
+каждого запроса из HOT_QUERIES смотрит план:
+  - SQLite: EXPLAIN QUERY PLAN, регрессия - шаг "SCAN <таблица>" без индекса;
+  - PostgreSQL: EXPLAIN (FORMAT JSON) с enable_seqscan = off, регрессия -
+    узел Seq Scan. На небольшой тестовой БД полный проход дешевле индекса,
+    поэтому планировщику запрещаем его: Seq Scan останется в плане, только
+    если подходящего индекса нет.
+Код возврата 1, если хоть один запрос регрессировал - скрипт можно ставить в CI
+после миграций.
+
+Запуск: python check_query_plans.py [--drivers 2000] [--orders 100000] [--database-url postgresql://...] [--skip-seed]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+import os
+import random
+import re
+import tempfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--drivers', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--database-url', default=None, help='по умолчанию - временная SQLite')
+    parser.add_argument('--skip-seed', action='store_true', help='проверить планы на уже заполненной БД')
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+os.environ['DATABASE_URL'] = ARGS.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'query_plans.db')}"
+
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from app import models
+from app.database import engine
+
+BATCH = 50000
+DRIVER_ID = 7
+# Шаг плана SQLite, читающий таблицу целиком: "SCAN orders", но не "SCAN orders USING INDEX ..."
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+Order, Message = models.Order, models.Message
+
+# Горячие запросы в том виде, в каком их строят эндпоинты и crud
+HOT_QUERIES = {
+    # Занятость водителя, текущая поездка
+    'orders: активные заказы водителя': select(Order.id).where(
+        Order.driver_id == DRIVER_ID, Order.status.in_(models.BUSY_ORDER_STATUSES)
+    ),
+    # new-orders без диспетчера: заказы без водителя
+    'orders: очередь без водителя': select(Order).where(
+        Order.status == "Ожидает водителя", Order.driver_id.is_(None)
+    ).order_by(Order.created_at.desc()).limit(20),
+    # Аналитика за период
+    'orders: заказы за период': select(Order.id, Order.price).where(
+        Order.created_at >= datetime(2026, 1, 1), Order.created_at < datetime(2026, 1, 2)
+    ),
+    # crud.get_driver_activity_page
+    'orders: история водителя': select(Order).where(
+        Order.driver_id == DRIVER_ID, Order.created_at >= datetime(2025, 1, 1)
+    ).order_by(Order.created_at.desc(), Order.id.desc()).limit(51),
+    # Баланс водителя: последние транзакции
+    'balance_transactions: последние транзакции водителя': select(models.BalanceTransaction).where(
+        models.BalanceTransaction.driver_id == DRIVER_ID
+    ).order_by(models.BalanceTransaction.created_at.desc()).limit(10),
+    # Фотоконтроль: последняя верификация водителя
+    'driver_verifications: последний фотоконтроль': select(models.DriverVerification).where(
+        models.DriverVerification.driver_id == DRIVER_ID,
+        models.DriverVerification.verification_type == "photo_control"
+    ).order_by(models.DriverVerification.created_at.desc()).limit(1),
+    # crud.get_messages_for_driver
+    'messages: сообщения водителя': select(Message).where(
+        (Message.recipient_id == DRIVER_ID) | (Message.is_broadcast == True)
+    ).order_by(Message.created_at.desc(), Message.id.desc()).limit(101),
+    # crud.get_broadcast_messages
+    'messages: рассылки': select(Message).where(
+        Message.is_broadcast == True
+    ).order_by(Message.created_at.desc()).limit(100),
+    'cars: автомобили водителя': select(models.Car).where(models.Car.driver_id == DRIVER_ID),
+    'driver_users: аккаунт водителя': select(models.DriverUser).where(models.DriverUser.driver_id == DRIVER_ID),
+    # Такт диспетчера: истёкшие предложения и позиции водителей, записанные всеми воркерами
+    'orders: истёкшие предложения диспетчера': select(Order.id, Order.driver_id).where(
+        Order.offer_expires_at < datetime(2026, 1, 1), Order.status == "Назначен"
+    ),
+    'drivers: позиции за TTL': select(models.Driver.id, models.Driver.current_lat, models.Driver.current_lng).where(
+        models.Driver.last_location_update >= datetime(2026, 1, 1),
+        models.Driver.current_lat.isnot(None), models.Driver.current_lng.isnot(None)
+    ),
+    # Доступные тарифы, фильтр списка водителей
+    'drivers: водители по статусу': select(models.Driver.id, models.Driver.tariff).where(
+        models.Driver.status == "rejected"
+    ),
+}
+
+
+def insert_batches(connection, model, rows):
+    for start in range(0, len(rows), BATCH):
+        connection.execute(insert(model), rows[start:start + BATCH])
+
+
+def seed(n_drivers, n_orders, seed=5):
+    """Водители с машинами, аккаунтами, верификациями, транзакциями и сообщениями плюс история заказов"""
+    rnd = random.Random(seed)
+    models.Base.metadata.create_all(engine)
+    start = datetime(2025, 1, 1)
+    with engine.begin() as connection:
+        for model in (models.Message, models.BalanceTransaction, models.DriverVerification, models.DriverUser,
+                      models.Order, models.Car, models.Driver):
+            connection.execute(model.__table__.delete())
+
+        insert_batches(connection, models.Driver, [{
+            'id': driver_id, 'unique_id': f'U{driver_id}', 'full_name': f'Водитель {driver_id}',
+            'birth_date': date(1990, 1, 1), 'callsign': f'cs{driver_id}', 'city': 'Ош',
+            'driver_license_number': f'AB{driver_id:07d}', 'tariff': rnd.choice(['Эконом', 'Комфорт']),
+            'phone': f'+996555{driver_id:06d}', 'balance': 0.0, 'registration_date': start,
+            'status': rnd.choice(['accepted'] * 18 + ['pending', 'rejected'])
+        } for driver_id in range(1, n_drivers + 1)])
+        insert_batches(connection, models.Car, [{
+            'id': driver_id, 'driver_id': driver_id, 'brand': 'Toyota', 'model': 'Camry', 'year': 2015,
+            'transmission': 'автомат', 'tariff': 'Эконом', 'service_type': 'Такси', 'vin': f'VIN{driver_id}',
+            'license_plate': f'01 KG {driver_id:06d}'
+        } for driver_id in range(1, n_drivers + 1)])
+        insert_batches(connection, models.DriverUser, [{
+            'id': driver_id, 'phone': f'+996555{driver_id:06d}', 'driver_id': driver_id, 'is_verified': True
+        } for driver_id in range(1, n_drivers + 1)])
+
+        orders = []
+        for order_id in range(1, n_orders + 1):
+            # Каждый сотый заказ ждёт водителя, остальные - история
+            unassigned = order_id % 100 == 0
+            orders.append({
+                'id': order_id, 'order_number': f'{order_id:020d}', 'time': '12:00:00',
+                'origin': 'ул. Ленина 1, Ош', 'destination': 'ул. Навои 20, Ош',
+                'driver_id': None if unassigned else rnd.randint(1, n_drivers),
+                'status': 'Ожидает водителя' if unassigned else rnd.choice(['Завершен', 'Завершен', 'Отменен']),
+                'price': round(rnd.uniform(100, 600), 2),
+                'created_at': start + timedelta(seconds=rnd.randint(0, 365 * 86400))
+            })
+            if len(orders) == BATCH:
+                connection.execute(insert(models.Order), orders)
+                orders = []
+        if orders:
+            connection.execute(insert(models.Order), orders)
+
+        insert_batches(connection, models.BalanceTransaction, [{
+            'driver_id': rnd.randint(1, n_drivers), 'amount': 100.0, 'type': 'deposit', 'status': 'completed',
+            'created_at': start + timedelta(seconds=rnd.randint(0, 365 * 86400))
+        } for _ in range(n_orders // 2)])
+        insert_batches(connection, models.DriverVerification, [{
+            'driver_id': rnd.randint(1, n_drivers), 'status': 'accepted',
+            'verification_type': rnd.choice(['photo_control', 'photo_car_front', 'photo_license']),
+            'created_at': start + timedelta(seconds=rnd.randint(0, 365 * 86400))
+        } for _ in range(n_drivers * 10)])
+        insert_batches(connection, models.Message, [{
+            'recipient_id': None if broadcast else rnd.randint(1, n_drivers), 'content': 'Сообщение',
+            'is_broadcast': broadcast, 'created_at': start + timedelta(seconds=rnd.randint(0, 365 * 86400))
+        } for broadcast in (rnd.random() < 0.01 for _ in range(n_orders // 2))])
+
+        connection.exec_driver_sql('ANALYZE')
+
+
+def sqlite_plan(connection, statement):
+    """Шаги EXPLAIN QUERY PLAN и таблицы, которые читаются целиком"""
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    steps = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    scans = [match.group(1) for match in map(SQLITE_FULL_SCAN.match, steps) if match]
+    return steps, scans
+
+
+def postgresql_plan(connection, statement):
+    """Узлы EXPLAIN (FORMAT JSON) и таблицы с Seq Scan"""
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    steps, scans, nodes = [], [], [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        relation = node.get('Relation Name')
+        index = node.get('Index Name')
+        steps.append(' '.join(part for part in (node['Node Type'], relation, index and f'({index})') if part))
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(relation)
+        nodes.extend(node.get('Plans', []))
+    return steps, scans
+
+
+def check_plans() -> int:
+    """Печатает планы и возвращает число запросов с полным проходом по таблице"""
+    explain = postgresql_plan if engine.dialect.name == 'postgresql' else sqlite_plan
+    failures = 0
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            connection.exec_driver_sql('SET enable_seqscan = off')
+        for name, statement in HOT_QUERIES.items():
+            steps, scans = explain(connection, statement)
+            if scans:
+                failures += 1
+                print(f"❌ {name}: полный проход по {', '.join(scans)}")
+            else:
+                print(f"✅ {name}")
+            for step in steps:
+                print(f"     {step}")
+        connection.rollback()
+    return failures
+
+
+def main():
+    print(f"🔍 Планы горячих запросов ({engine.dialect.name})")
+    if not ARGS.skip_seed:
+        seed(ARGS.drivers, ARGS.orders)
+        print(f"Заполнение: водителей {ARGS.drivers}, заказов {ARGS.orders}")
+
+    failures = check_plans()
+    if failures:
+        print(f"❌ Регрессий: {failures} из {len(HOT_QUERIES)}")
+        sys.exit(1)
+    print(f"✅ Все {len(HOT_QUERIES)} запросов используют индексы")
+
+
+if __name__ == "__main__":
+    main()
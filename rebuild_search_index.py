@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Построение поискового индекса (search_documents) по всем водителям и заказам.
+
+Документы пересобираются из исходных таблиц, документы удалённых объектов
+удаляются, поэтому скрипт можно запускать повторно.
+
+Запуск: python rebuild_search_index.py [--chunk-size 10000]
+"""
+
+import sys
+sys.path.append('.')
+
+import argparse
+
+from app.services.search import search_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    print("🔎 Построение поискового индекса...")
+    stats = search_index.rebuild(chunk_size=args.chunk_size)
+    print(f"✅ Готово: {stats}")
+
+
+if __name__ == "__main__":
+    main()